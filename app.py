@@ -5,14 +5,36 @@ import pydicom
 import shutil
 import numpy as np
 import SimpleITK as sitk
-from flask import Flask, render_template, request, jsonify, send_file, redirect
+from flask import Flask, render_template, request, jsonify, send_file, redirect, g, Response
 from werkzeug.utils import secure_filename
+from werkzeug.http import parse_options_header
 from werkzeug.middleware.proxy_fix import ProxyFix
 from python.dicom_processor import process_dicom_file, read_dicom_folder, extract_zip, process_zip_file
 from python.segmentation import segment_dicom_file, apply_segmentation, process_dicom_folder_for_segmentation
+from python.segmentation_session import SegmentationSession, SessionCache, touch_saved_session, remove_stale_sessions
+from python.admission import ServiceLimiter, Rejected, SLOT_ENVIRON_KEY, available_cpus
 from python.growth_rate import predict_growth_rate_from_excel, predict_growth_rate_from_input
 from python.rupture_risk import predict_rupture_risk_from_excel, predict_rupture_risk_from_input
-import glob
+from python.instrumentation import start_trace, finish_trace, write_trace
+from python.profiling import sample_stacks, format_folded, RequestProfiler, PROFILE_MODES
+from python.directory_ingest import ingest_directory, scan_series_directories, LOCAL_SERVICES
+from python.file_index import ProcessedFileIndex, file_etag, is_uniquely_named
+from python.upload_pipeline import receive_and_convert, convert_upload, unique_filename
+from python.chunked_upload import init_upload, get_upload, write_chunk, finalize_upload, abort_upload, remove_stale_uploads
+from python.zip_stream import stream_zip, archive_members
+from python.tile_pyramid import build_series_pyramids, load_manifest, tile_path, thumbnail_path
+from python.rendering import parse_window
+from python.multiresolution import SEGMENTATION_METHODS
+from python.dicom_store import DicomStore, render_frame, raw_frame, RENDERED_FORMATS, UID_PATTERN
+from python.dicom_decoding import available_decoders, DECODER_PREFERENCE, STATS as DECODE_STATS
+from python.mesh_export import (export_mesh, export_lods, series_mask, image_mask, mesh_path, lod_path,
+                                load_lod_manifest, MESH_FORMATS, DEFAULT_TARGET_TRIANGLES, DEFAULT_SMOOTHING_ITERATIONS)
+import base64
+import hmac
+import json
+import uuid
+from urllib.parse import quote
+import re
 from flask_cors import CORS
 import time
 import tempfile
@@ -21,6 +43,7 @@ import logging
 from logging.handlers import RotatingFileHandler
 from datetime import datetime
 from prometheus_flask_exporter import PrometheusMetrics
+from prometheus_flask_exporter.multiprocess import GunicornInternalPrometheusMetrics
 
 # Load environment variables
 load_dotenv()
@@ -39,14 +62,130 @@ app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0 if os.environ.get('FLASK_ENV') == 'd
 cors_origins = os.environ.get('CORS_ORIGINS', '*')
 CORS(app, origins=cors_origins.split(',') if cors_origins != '*' else '*')
 
-# Initialize Prometheus metrics
-metrics = PrometheusMetrics(app)
+# Initialize Prometheus metrics; with several worker processes (PROMETHEUS_MULTIPROC_DIR, set by
+# gunicorn.conf.py) /metrics adds up every worker's metrics instead of reporting only its own
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    metrics = GunicornInternalPrometheusMetrics(app)
+else:
+    metrics = PrometheusMetrics(app)
 
 # Configuration
 UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads/')
 PROCESSED_FOLDER = os.environ.get('PROCESSED_FOLDER', 'processed/')
 ALLOWED_EXTENSIONS = {'dcm', 'png', 'jpg', 'jpeg', 'zip', '', 'xlsx', 'xls', 'csv'}
 
+# Request tracing: per-stage spans for every request (TRACE_REQUESTS=1) or on demand (X-Trace-Request: 1)
+TRACE_REQUESTS = os.environ.get('TRACE_REQUESTS', '0') == '1'
+TRACE_LOG_PATH = os.environ.get('TRACE_LOG_PATH', os.path.join('logs', 'request_trace.log'))
+
+# Admin endpoints (profiling) are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+PROFILE_OUTPUT_DIR = os.environ.get('PROFILE_OUTPUT_DIR', os.path.join('logs', 'profiles'))
+
+# Server-side directory processing is limited to these roots (os.pathsep-separated); disabled when unset
+LOCAL_DIRECTORY_ROOTS = [os.path.realpath(p) for p in os.environ.get('LOCAL_DIRECTORY_ROOTS', '').split(os.pathsep) if p]
+DIRECTORY_WORKERS = int(os.environ.get('DIRECTORY_WORKERS', min(8, os.cpu_count() or 1)))
+
+# Downloads are resolved through an in-memory index of PROCESSED_FOLDER. With ACCEL_REDIRECT_PREFIX
+# set (e.g. /_processed_internal/, an internal nginx location aliased to the folder) nginx sends the bytes.
+processed_index = ProcessedFileIndex(PROCESSED_FOLDER)
+ACCEL_REDIRECT_PREFIX = os.environ.get('ACCEL_REDIRECT_PREFIX', '')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+ZIP_STREAM_WORKERS = int(os.environ.get('ZIP_STREAM_WORKERS', min(4, os.cpu_count() or 1)))
+
+# DICOM viewer tile pyramids, one folder per series under PROCESSED_FOLDER/pyramids
+PYRAMID_FOLDER = os.path.join(PROCESSED_FOLDER, 'pyramids')
+PYRAMID_WORKERS = int(os.environ.get('PYRAMID_WORKERS', min(8, os.cpu_count() or 1)))
+PYRAMID_ID_PATTERN = re.compile(r'[0-9a-f]{16}')
+
+# Surface meshes of segmentations, one folder per mask hash under PROCESSED_FOLDER/meshes
+MESH_FOLDER = os.path.join(PROCESSED_FOLDER, 'meshes')
+MESH_ID_PATTERN = re.compile(r'[0-9a-f]{16}')
+MESH_MAX_TRIANGLES = int(os.environ.get('MESH_MAX_TRIANGLES', 2000000))
+
+# Resident series for threshold previews and incremental segmentation, kept per process in an LRU.
+# Their arrays are saved under SESSION_STATE_FOLDER (never served) for the other workers and removed
+# once unused for SEGMENTATION_SESSION_EXPIRY seconds; segmentations are written to SEGMENTATION_SESSION_FOLDER
+SEGMENTATION_SESSION_MB = int(os.environ.get('SEGMENTATION_SESSION_MB', 1024))
+SEGMENTATION_SESSION_FOLDER = os.path.join(PROCESSED_FOLDER, 'segmentation_sessions')
+SESSION_STATE_FOLDER = os.environ.get('SESSION_STATE_FOLDER', 'session_state/')
+SEGMENTATION_SESSION_EXPIRY = int(os.environ.get('SEGMENTATION_SESSION_EXPIRY', 24 * 3600))
+SESSION_ID_PATTERN = re.compile(r'[0-9a-f]{16}')
+PREVIEW_MAX_SLICES = int(os.environ.get('PREVIEW_MAX_SLICES', 8))
+segmentation_sessions = SessionCache(SEGMENTATION_SESSION_MB * 1024 * 1024)
+
+# Uploaded instances for frame retrieval, filed by Study/Series/SOP Instance UID, and the decoded frame cache size
+DICOM_STORE_FOLDER = os.environ.get('DICOM_STORE_FOLDER', os.path.join(UPLOAD_FOLDER, 'dicom_store'))
+FRAME_CACHE_MB = int(os.environ.get('FRAME_CACHE_MB', 256))
+dicom_store = DicomStore(DICOM_STORE_FOLDER, FRAME_CACHE_MB * 1024 * 1024)
+
+# Resumable chunked uploads: total size limit and how long an idle partial upload is kept
+CHUNKED_UPLOAD_MAX_SIZE = int(os.environ.get('CHUNKED_UPLOAD_MAX_SIZE', 20 * 1024 * 1024 * 1024))
+CHUNKED_UPLOAD_EXPIRY = int(os.environ.get('CHUNKED_UPLOAD_EXPIRY', 24 * 3600))
+CHUNKED_UPLOAD_SERVICES = ('upload', 'image_conversion', 'growth_rate', 'rupture_risk', 'dicom_store')
+
+# image_conversion uploads are converted while the request is still arriving (PIPELINED_UPLOADS=0 to disable)
+PIPELINED_UPLOADS = os.environ.get('PIPELINED_UPLOADS', '1') == '1'
+UPLOAD_PIPELINE_WORKERS = int(os.environ.get('UPLOAD_PIPELINE_WORKERS', min(4, os.cpu_count() or 1)))
+
+# Admission control per service class (per worker process): concurrent requests, waiting requests
+# and how long one may wait; see python/admission.py
+CPUS = available_cpus()
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 30))
+# Request threads per worker process (gunicorn.conf.py exports its threads setting), of which
+# ADMISSION_FREE_THREADS are never given to limited requests, running or waiting for a slot
+WORKER_THREADS = int(os.environ.get('WORKER_THREADS', 8))
+ADMISSION_FREE_THREADS = int(os.environ.get('ADMISSION_FREE_THREADS', max(1, WORKER_THREADS // 4)))
+
+
+def default_admission_limits(threads, cpus):
+    """
+    (concurrency, queue) per service class with at most threads requests running or waiting
+    across all classes (but at least one slot each): one for training, a quarter of the rest
+    for cohort inference and the remainder for DICOM conversion, running at most cpus at a time.
+    """
+    rest = max(2, threads - 1)
+    inference = max(1, rest // 4)
+    conversion = max(1, rest - inference)
+    inference_concurrency = min(max(1, cpus // 2), inference)
+    conversion_concurrency = min(cpus, conversion)
+    return {
+        'dicom_conversion': (conversion_concurrency, conversion - conversion_concurrency),
+        'cohort_inference': (inference_concurrency, inference - inference_concurrency),
+        'training': (1, 0)
+    }
+
+
+ADMISSION_DEFAULTS = default_admission_limits(WORKER_THREADS - ADMISSION_FREE_THREADS, CPUS)
+ADMISSION_LIMITS = {
+    name: (int(os.environ.get(f"{name.upper()}_CONCURRENCY", concurrency)),
+           int(os.environ.get(f"{name.upper()}_QUEUE", queue)))
+    for name, (concurrency, queue) in ADMISSION_DEFAULTS.items()
+}
+admission = {name: ServiceLimiter(name, concurrency, queue, ADMISSION_QUEUE_TIMEOUT)
+             for name, (concurrency, queue) in ADMISSION_LIMITS.items()}
+
+# Endpoints in each service class; everything else (pages, health, retrieval) is never limited
+SERVICE_CLASSES = {
+    'upload_file': 'dicom_conversion',
+    'process_file': 'dicom_conversion',
+    'service_handler': 'dicom_conversion',
+    'chunked_upload_finalize': 'dicom_conversion',
+    'process_local_directory': 'dicom_conversion',
+    'process_local_directory_images': 'dicom_conversion',
+    'build_viewer_pyramid': 'dicom_conversion',
+    'build_mesh': 'dicom_conversion',
+    'build_mesh_lods': 'dicom_conversion',
+    'create_segmentation_session': 'dicom_conversion',
+    'segmentation_session_segment': 'dicom_conversion',
+    'dicomweb_store': 'dicom_conversion',
+    'growth_rate_service': 'cohort_inference',
+    'rupture_risk_service': 'cohort_inference',
+    'train_growth_model': 'training'
+}
+# Prediction requests up to this size are manual single-patient inputs rather than cohort files
+MANUAL_PREDICTION_MAX_BYTES = int(os.environ.get('MANUAL_PREDICTION_MAX_BYTES', 64 * 1024))
+
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['PROCESSED_FOLDER'] = PROCESSED_FOLDER
 
@@ -101,6 +240,174 @@ def upload_file():
 
     return jsonify({'error': 'File type not allowed'}), 400
 
+def conversion_output_folder():
+    """New PROCESSED_FOLDER/conversions/<id> folder for the images converted by one request."""
+    output_folder = os.path.join(app.config['PROCESSED_FOLDER'], 'conversions', uuid.uuid4().hex[:12])
+    os.makedirs(output_folder)
+    return output_folder
+
+
+# Resumable chunked uploads: POST to start, PUT each chunk at its offset, then finalize
+def chunked_upload_response(result, success_status=200):
+    """JSON response for a chunked upload record, with the offset also in the Upload-Offset header."""
+    if 'error' in result:
+        body = {'error': result['error']}
+        if result.get('offset') is not None:
+            body['offset'] = result['offset']
+        response = jsonify(body)
+        status = result.get('status', 400)
+    else:
+        body = {k: result[k] for k in ('upload_id', 'filename', 'size', 'offset', 'chunk_size', 'chunks')}
+        response = jsonify(body)
+        status = success_status
+    if body.get('offset') is not None:
+        response.headers['Upload-Offset'] = str(body['offset'])
+    return response, status
+
+
+def process_uploaded_file(filepath, service):
+    """Hand a finished upload to the same processing the direct upload routes use."""
+    filename = os.path.basename(filepath)
+    if service == 'image_conversion':
+        output_files = convert_upload(filepath, conversion_output_folder())
+        if not output_files:
+            return {'error': 'No valid files could be processed'}
+        return {
+            'message': 'File processed successfully',
+            'output': processed_url(output_files[0]),
+            'all_outputs': [processed_url(path) for path in output_files]
+        }
+
+    if service in ('growth_rate', 'rupture_risk'):
+        output_dir = os.path.join(app.config['PROCESSED_FOLDER'], service)
+        os.makedirs(output_dir, exist_ok=True)
+        if service == 'growth_rate':
+            result = predict_growth_rate_from_excel(filepath, output_dir)
+        else:
+            result = predict_rupture_risk_from_excel(filepath, output_dir)
+        if 'error' in result:
+            return {'error': result['error']}
+        response = {
+            'message': result['message'],
+            'download_url': processed_url(result['results_csv']) if result.get('results_csv') else None,
+            'statistics': result.get('statistics', {})
+        }
+        if result.get('visualization'):
+            response['output'] = processed_url(result['visualization'])
+        if result.get('patient_visualization'):
+            response['patient_visualization'] = processed_url(result['patient_visualization'])
+        for key in ('metrics', 'patient_data', 'detailed_results', 'is_single_patient'):
+            if key in result:
+                response[key] = result[key]
+        return response
+
+    if service == 'dicom_store':
+        stored, failed = store_dicom_files([filepath])
+        if not stored:
+            return {'error': 'No DICOM instances could be stored'}
+        return {'message': f"Stored {len(stored)} instances", 'stored': stored, 'failed': failed}
+
+    return {'message': 'File uploaded successfully', 'filename': filename}
+
+
+@app.route('/upload/chunked', methods=['POST'])
+def chunked_upload_init():
+    """
+    Start a resumable upload.
+
+    JSON or form fields: filename, size (bytes) and an optional service to run
+    on finalize (upload, image_conversion, growth_rate or rupture_risk).
+    """
+    data = request.get_json(silent=True) or request.form
+    filename = secure_filename(data.get('filename', ''))
+    service = data.get('service') or 'upload'
+    try:
+        size = int(data.get('size', 0))
+    except (TypeError, ValueError):
+        size = 0
+
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'File type not allowed'}), 400
+    if size <= 0 or size > CHUNKED_UPLOAD_MAX_SIZE:
+        return jsonify({'error': f'Size must be between 1 and {CHUNKED_UPLOAD_MAX_SIZE} bytes'}), 400
+    if service not in CHUNKED_UPLOAD_SERVICES:
+        return jsonify({'error': f"Unknown service '{service}'"}), 400
+
+    remove_stale_uploads(app.config['UPLOAD_FOLDER'], CHUNKED_UPLOAD_EXPIRY)
+    meta = init_upload(app.config['UPLOAD_FOLDER'], filename, size, service)
+    return chunked_upload_response(meta, 201)
+
+
+@app.route('/upload/chunked/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+def chunked_upload_chunk(upload_id):
+    """
+    GET: current offset (resume point) of an upload.
+    PUT: write the raw request body at the offset given by Content-Range
+         ("bytes <start>-<end>/<total>") or X-Upload-Offset, verified against
+         the X-Chunk-SHA256 header when present. A Content-Range total that
+         differs from the size given at init is rejected with 416.
+    DELETE: abandon the upload.
+    """
+    upload_folder = app.config['UPLOAD_FOLDER']
+    if request.method == 'GET':
+        meta = get_upload(upload_folder, upload_id)
+        if meta is None:
+            return jsonify({'error': 'Unknown upload'}), 404
+        return chunked_upload_response(meta)
+
+    if request.method == 'DELETE':
+        if not abort_upload(upload_folder, upload_id):
+            return jsonify({'error': 'Unknown upload'}), 404
+        return jsonify({'message': 'Upload cancelled'}), 200
+
+    content_range = re.fullmatch(r'bytes (\d+)-(\d+)/(\d+|\*)', request.headers.get('Content-Range', ''))
+    total = None
+    if content_range:
+        offset = int(content_range.group(1))
+        length = int(content_range.group(2)) - offset + 1
+        if content_range.group(3) != '*':
+            total = int(content_range.group(3))
+    elif request.headers.get('X-Upload-Offset', '').isdigit():
+        offset = int(request.headers['X-Upload-Offset'])
+        length = request.content_length
+    else:
+        return jsonify({'error': 'Content-Range or X-Upload-Offset header required'}), 400
+
+    if request.content_length is not None and request.content_length != length:
+        return jsonify({'error': 'Content-Length does not match the chunk range'}), 400
+
+    result = write_chunk(upload_folder, upload_id, offset, request.stream, length,
+                         request.headers.get('X-Chunk-SHA256'), total)
+    return chunked_upload_response(result)
+
+
+@app.route('/upload/chunked/<upload_id>/finalize', methods=['POST'])
+def chunked_upload_finalize(upload_id):
+    """
+    Complete an upload and run the service chosen at init.
+
+    Optional JSON/form field sha256 verifies the whole file before it is moved
+    into place.
+    """
+    try:
+        data = request.get_json(silent=True) or request.form
+        meta = finalize_upload(app.config['UPLOAD_FOLDER'], upload_id, data.get('sha256'))
+        if 'error' in meta:
+            return chunked_upload_response(meta)
+
+        result = process_uploaded_file(meta['path'], meta['service'])
+        if 'error' in result:
+            return jsonify({'error': result['error']}), 400
+        result['upload_id'] = upload_id
+        result['filename'] = meta['filename']
+        return jsonify(result), 200
+
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"[ERROR] Chunked upload finalize error: {str(e)}\n{error_details}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/process/<filename>', methods=['POST'])
 def process_file(filename):
     """Process an uploaded file (placeholder for actual processing)."""
@@ -162,6 +469,120 @@ def health_check():
         'environment': os.environ.get('FLASK_ENV', 'development')
     }), 200
 
+# Request tracing middleware
+@app.before_request
+def begin_request_trace():
+    """Start collecting stage spans for this request if tracing is enabled."""
+    if TRACE_REQUESTS or request.headers.get('X-Trace-Request') == '1':
+        start_trace(request.headers.get('X-Request-ID'), method=request.method, path=request.path)
+
+
+@app.after_request
+def end_request_trace(response):
+    """Write the structured trace for this request and return its ID."""
+    record = finish_trace(status=response.status_code)
+    if record is not None:
+        try:
+            write_trace(record, TRACE_LOG_PATH)
+        except OSError as e:
+            print(f"Trace logging error: {str(e)}")
+        response.headers['X-Request-ID'] = record['request_id']
+    return response
+
+# Admission control: expensive services wait for a slot of their class or are turned away at once
+def service_class(endpoint, content_length):
+    """Service class of a request to endpoint for admission control, or None if it is not limited."""
+    service = SERVICE_CLASSES.get(endpoint)
+    if service == 'cohort_inference' and (content_length or 0) <= MANUAL_PREDICTION_MAX_BYTES:
+        return None
+    return service
+
+
+def request_service_class():
+    return service_class(request.endpoint, request.content_length)
+
+
+@app.before_request
+def admit_request():
+    """
+    Take a slot of the request's service class before any of the body is read (under asgi.py
+    the bridge has already taken it on the event loop).
+    """
+    slot = request.environ.pop(SLOT_ENVIRON_KEY, None)
+    if slot is not None:
+        g.admission_slot = slot
+        return None
+    service = request_service_class()
+    if service is None:
+        return None
+    try:
+        g.admission_slot = admission[service].acquire()
+    except Rejected as e:
+        print(f"[INFO] Rejected {request.method} {request.path}: {str(e)}")
+        response = jsonify(e.payload())
+        response.status_code = e.status
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    return None
+
+
+@app.after_request
+def release_admission_slot(response):
+    """Hold the slot until the response has been sent, so streamed work stays counted."""
+    slot = g.pop('admission_slot', None)
+    if slot is not None:
+        response.call_on_close(slot.release)
+    return response
+
+
+@app.teardown_request
+def release_admission_slot_on_error(exc):
+    """Release the slot of a request that failed before after_request ran."""
+    slot = g.pop('admission_slot', None)
+    if slot is not None:
+        slot.release()
+
+
+# On-demand request profiling (admin only): send X-Profile: cprofile|tracemalloc with X-Admin-Token
+def is_admin_request():
+    """Check the X-Admin-Token header against ADMIN_TOKEN."""
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+@app.before_request
+def begin_request_profile():
+    """Start cProfile or tracemalloc for this request if an admin asked for it."""
+    mode = request.headers.get('X-Profile')
+    if mode in PROFILE_MODES and is_admin_request():
+        g.request_profiler = RequestProfiler(mode)
+        g.request_profiler.start()
+
+
+@app.after_request
+def end_request_profile(response):
+    """Write the profile report for this request and point to it in the response headers."""
+    profiler = g.pop('request_profiler', None)
+    if profiler is not None:
+        try:
+            result = profiler.stop(PROFILE_OUTPUT_DIR)
+            response.headers['X-Profile-ID'] = result['profile_id']
+            response.headers['X-Profile-Report'] = f"/admin/profile/reports/{result['profile_id']}"
+        except Exception as e:
+            print(f"[ERROR] Profiling error: {str(e)}")
+    return response
+
+
+@app.teardown_request
+def discard_request_profile(exc):
+    """Make sure a profiler never outlives a request that failed before after_request ran."""
+    profiler = g.pop('request_profiler', None)
+    if profiler is not None:
+        try:
+            profiler.stop(PROFILE_OUTPUT_DIR)
+        except Exception as e:
+            print(f"[ERROR] Profiling error: {str(e)}")
+
 # Add security headers middleware
 @app.after_request
 def add_security_headers(response):
@@ -192,34 +613,54 @@ def page_not_found(e):
         ''', 404
 
 
+def send_processed_file(file_path, mimetype, as_attachment=False):
+    """
+    Send a file from PROCESSED_FOLDER with caching and range support.
+
+    Responses carry a size and mtime ETag (no file read), so repeat requests
+    with If-None-Match get a 304, and Range requests get a 206. Outputs with a timestamp or job
+    ID in their path are cached as immutable; everything else must be
+    revalidated.
+
+    With ACCEL_REDIRECT_PREFIX set, the response only carries an X-Accel-Redirect
+    header and nginx streams the file itself, so the worker is freed immediately.
+    """
+    relative = processed_index.relative_path(file_path)
+    etag = file_etag(file_path)
+    cache_control = IMMUTABLE_CACHE_CONTROL if is_uniquely_named(relative) else 'no-cache'
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif ACCEL_REDIRECT_PREFIX and relative:
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = f"{ACCEL_REDIRECT_PREFIX.rstrip('/')}/{quote(relative)}"
+    else:
+        # conditional=True answers Range requests with 206 and matching If-None-Match with 304
+        response = send_file(file_path, mimetype=mimetype, as_attachment=as_attachment,
+                             download_name=os.path.basename(file_path) if as_attachment else None,
+                             conditional=True, etag=etag)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    if as_attachment and response.status_code != 304:
+        response.headers['Content-Disposition'] = f'attachment; filename="{os.path.basename(file_path)}"'
+    return response
+
+
 @app.route('/serve/processed/<path:filename>')
 def serve_processed_file(filename):
     """
     Serve a processed file (e.g., STL model, ZIP archive) for download.
     """
-    # Search for the file in various locations
-    possible_paths = [
-        os.path.join(PROCESSED_FOLDER, filename),
-        os.path.join(PROCESSED_FOLDER, 'local_image_conversion', filename),
-    ]
-    
-    file_path = None
-    for path in possible_paths:
-        if os.path.exists(path):
-            file_path = path
-            break
+    # Look the file up in the processed folder index instead of probing the disk
+    file_path = processed_index.resolve(filename, ('', 'local_image_conversion'))
 
     # Add specific folder for rupture risk
     if not file_path and 'rupture_risk' in filename:
-        risk_folder_path = os.path.join(PROCESSED_FOLDER, 'rupture_risk', os.path.basename(filename))
-        if os.path.exists(risk_folder_path):
-            file_path = risk_folder_path
+        file_path = processed_index.resolve(os.path.basename(filename), ('rupture_risk',))
             
     # Add specific folder for growth rate
     if not file_path and 'growth' in filename:
-        growth_folder_path = os.path.join(PROCESSED_FOLDER, 'growth_rate', os.path.basename(filename))
-        if os.path.exists(growth_folder_path):
-            file_path = growth_folder_path
+        file_path = processed_index.resolve(os.path.basename(filename), ('growth_rate',))
     
     # Check if file exists
     if not file_path:
@@ -231,6 +672,8 @@ def serve_processed_file(filename):
     
     if filename.lower().endswith('.stl'):
         mime_type = 'application/vnd.ms-pki.stl'
+    elif filename.lower().endswith('.glb'):
+        mime_type = 'model/gltf-binary'
     elif filename.lower().endswith('.zip'):
         mime_type = 'application/zip'
     elif filename.lower().endswith('.jpg') or filename.lower().endswith('.jpeg'):
@@ -243,26 +686,8 @@ def serve_processed_file(filename):
     # Always use as_attachment=True for ZIP files to force download
     as_attachment = filename.lower().endswith('.zip')
     
-    # For newer Flask versions, use download_name instead of attachment_filename
-    try:
-        response = send_file(
-            file_path, 
-            mimetype=mime_type, 
-            as_attachment=as_attachment,
-            download_name=os.path.basename(file_path) if as_attachment else None
-        )
-        # Add Cache-Control header to prevent caching issues
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
-        
-        # For ZIP files, add Content-Disposition header to force download
-        if as_attachment:
-            response.headers['Content-Disposition'] = f'attachment; filename="{os.path.basename(file_path)}"'
-            # Set content length header explicitly
-            response.headers['Content-Length'] = str(os.path.getsize(file_path))
-        
-        return response
+    try:
+        return send_processed_file(file_path, mime_type, as_attachment)
     except Exception as e:
         print(f"Error serving file {file_path}: {str(e)}")
         return f"Error serving file: {str(e)}", 500
@@ -305,65 +730,55 @@ def service_handler(service_name):
     """
     Simplified service handler for processing services.
     Only handles image_conversion now - 3D Slicer service is informational only.
+
+    Uploaded files are converted on a bounded worker pool as each one finishes
+    arriving (see python/upload_pipeline.py); the response lists every output.
     """
     try:
         # Only process image_conversion service
         if service_name != "image_conversion":
             return jsonify({"error": f"Service '{service_name}' is not available for file processing. Please use the information provided in the service."}), 400
         
-        # File upload - handle multiple files
-        if 'dicom_file' not in request.files:
-            return jsonify({"error": "No files provided"}), 400
-        
-        files = request.files.getlist('dicom_file')
-        if not files or len(files) == 0:
-            return jsonify({"error": "No files provided"}), 400
-        
-        # Create a temporary directory for processing multiple files
-        import tempfile
+        content_type, options = parse_options_header(request.headers.get('Content-Type', ''))
         temp_dir = tempfile.mkdtemp()
-        
-        processed_files = []
-        
-        # Process each file for image conversion
-        for uploaded_file in files:
-            if uploaded_file.filename == '':
-                continue
-                
-            filename = secure_filename(uploaded_file.filename)
-            filepath = os.path.join(temp_dir, filename)
-            uploaded_file.save(filepath)
-            
-            # Process based on the service selected
-            if service_name == "image_conversion":
-                # Check if it's a ZIP file
-                if filename.lower().endswith('.zip'):
-                    from python.dicom_processor import process_zip_file
-                    output_files = process_zip_file(filepath, app.config['PROCESSED_FOLDER'])
-                    processed_files.extend(output_files)
-                else:
-                    # Process as DICOM file
-                    base_filename = os.path.basename(filepath)
-                    output_path = os.path.join(app.config['PROCESSED_FOLDER'], f"{base_filename}.jpg")
-                    
+        # Every request converts into its own folder, so same-named files from concurrent uploads never collide
+        output_folder = conversion_output_folder()
+        try:
+            if PIPELINED_UPLOADS and content_type == 'multipart/form-data' and options.get('boundary'):
+                # Convert each file as soon as it has been received instead of after the whole body
+                results = receive_and_convert(request.stream, options['boundary'], 'dicom_file', temp_dir,
+                                              output_folder, UPLOAD_PIPELINE_WORKERS)
+            else:
+                files = [f for f in request.files.getlist('dicom_file') if f.filename != '']
+                results = []
+                used_names = set()
+                for uploaded_file in files:
+                    filename = unique_filename(secure_filename(uploaded_file.filename) or 'upload', used_names)
+                    filepath = os.path.join(temp_dir, filename)
+                    uploaded_file.save(filepath)
                     try:
-                        from python.dicom_processor import process_dicom_file
-                        output_file = process_dicom_file(filepath, output_path)
-                        processed_files.append(output_file)
+                        results.append({'filename': filename, 'error': None,
+                                        'outputs': convert_upload(filepath, output_folder)})
                     except Exception as e:
-                        print(f"Error processing {filename}: {str(e)}")
-        
-        # Return results
+                        print(f"Error processing {uploaded_file.filename}: {str(e)}")
+                        results.append({'filename': filename, 'outputs': [], 'error': str(e)})
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+        processed_files = [path for result in results for path in result['outputs']]
         if not processed_files:
+            shutil.rmtree(output_folder, ignore_errors=True)
+            if not results:
+                return jsonify({"error": "No files provided"}), 400
             return jsonify({"error": "No valid files could be processed"}), 400
-            
-        # Return the first processed file for display - SIMPLIFIED
-        output_url = f"/serve/processed/{os.path.basename(processed_files[0])}"
-        
-        # SIMPLIFIED response
+
+        all_outputs = [processed_url(path) for path in processed_files]
         return jsonify({
-            "message": f"File processed successfully", 
-            "output": output_url
+            "message": f"Processed {len(processed_files)} image(s) from {len(results)} file(s)",
+            "output": all_outputs[0],
+            "all_outputs": all_outputs,
+            "total_files": len(processed_files),
+            "failed_files": [{'filename': r['filename'], 'error': r['error']} for r in results if r['error']]
         }), 200
     
     except Exception as e:
@@ -373,6 +788,223 @@ def service_handler(service_name):
         return jsonify({"error": str(e)}), 500
 
 
+# Server-side directory processing
+def resolve_local_directory(directory):
+    """Return the real path of directory if it lies under one of LOCAL_DIRECTORY_ROOTS, else None."""
+    if not directory:
+        return None
+    real_path = os.path.realpath(directory)
+    for root in LOCAL_DIRECTORY_ROOTS:
+        if real_path == root or real_path.startswith(root + os.sep):
+            return real_path
+    return None
+
+
+def processed_url(path):
+    """URL under /serve/processed/ for a file inside PROCESSED_FOLDER (also registers it in the index)."""
+    processed_index.add(path)
+    relative = os.path.relpath(path, app.config['PROCESSED_FOLDER'])
+    return f"/serve/processed/{relative.replace(os.sep, '/')}"
+
+
+def archive_url(folder):
+    """URL that streams a ZIP of a folder inside PROCESSED_FOLDER."""
+    relative = os.path.relpath(folder, app.config['PROCESSED_FOLDER'])
+    return f"/download/archive/{relative.replace(os.sep, '/')}.zip"
+
+
+def local_directory_events(directory, service_type, lower_threshold, upper_threshold):
+    """
+    Run ingest_directory and turn its events into JSON-ready dicts with URLs.
+
+    Yields the 'scan' and per-'series' events, then a 'complete' event with
+    totals and a streamed ZIP of every series' outputs (or an 'error' event).
+    """
+    job_id = uuid.uuid4().hex[:12]
+    output_root = os.path.join(app.config['PROCESSED_FOLDER'], f"local_{service_type}", job_id)
+    all_outputs = []
+    series_count = 0
+    failed = 0
+
+    try:
+        for event in ingest_directory(directory, output_root, service_type, lower_threshold,
+                                      upper_threshold, DIRECTORY_WORKERS, MESH_FOLDER):
+            if event['event'] == 'series':
+                series_count += 1
+                # A series can finish with a mesh but no slice images to show; report it as that series' error
+                if (not event['error'] and service_type != 'image_conversion'
+                        and all(path.endswith('.stl') for path in event['outputs'])):
+                    event['error'] = 'No segmented slice images were written for this series'
+                if event['error']:
+                    failed += 1
+                all_outputs.extend(event['outputs'])
+                event = {
+                    'event': 'series',
+                    'series': event['series'],
+                    'file_count': event['file_count'],
+                    'outputs': [processed_url(path) for path in event['outputs']],
+                    'zip_url': archive_url(event['output_dir']) if event['outputs'] else None,
+                    'error': event['error']
+                }
+            yield event
+    except ValueError as e:
+        yield {'event': 'error', 'error': str(e)}
+        return
+
+    if not all_outputs:
+        yield {'event': 'error', 'error': 'No valid files could be processed'}
+        return
+
+    yield {
+        'event': 'complete',
+        'job_id': job_id,
+        'series_count': series_count,
+        'failed_series': failed,
+        'total_files': len(all_outputs),
+        'zip_url': archive_url(output_root)
+    }
+
+
+def local_directory_response(events, stream_format):
+    """Stream events as NDJSON or server-sent events."""
+    if stream_format == 'sse':
+        body = (f"event: {event['event']}\ndata: {json.dumps(event)}\n\n" for event in events)
+        mimetype = 'text/event-stream'
+    else:
+        body = (json.dumps(event) + "\n" for event in events)
+        mimetype = 'application/x-ndjson'
+    response = Response(body, mimetype=mimetype)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # let nginx pass events through as they happen
+    return response
+
+
+def local_directory_request():
+    """
+    Validate a local directory request.
+
+    Returns:
+        tuple: (directory, stream_format, error response or None)
+    """
+    if not LOCAL_DIRECTORY_ROOTS:
+        return None, None, (jsonify({'error': 'Local directory processing is disabled. Set LOCAL_DIRECTORY_ROOTS on the server.'}), 403)
+
+    directory = resolve_local_directory(request.form.get('directory', '').strip())
+    if directory is None:
+        return None, None, (jsonify({'error': 'Directory is not under an allowed LOCAL_DIRECTORY_ROOTS path'}), 403)
+    if not os.path.isdir(directory):
+        return None, None, (jsonify({'error': f'Directory not found: {directory}'}), 404)
+
+    stream_format = request.form.get('stream') or request.args.get('stream')
+    accept = request.headers.get('Accept', '')
+    if not stream_format and 'application/x-ndjson' in accept:
+        stream_format = 'ndjson'
+    elif not stream_format and 'text/event-stream' in accept:
+        stream_format = 'sse'
+    return directory, stream_format, None
+
+
+@app.route('/process_local_directory', methods=['POST'])
+def process_local_directory():
+    """
+    Process every DICOM series under a server-side directory.
+
+    Form fields: directory, service_type (image_conversion, segmentation or 3d_model),
+    lower_threshold/upper_threshold, and optionally stream=ndjson|sse to receive each
+    series' result as soon as it finishes instead of one response at the end.
+    """
+    try:
+        directory, stream_format, error = local_directory_request()
+        if error:
+            return error
+
+        service_type = request.form.get('service_type', 'image_conversion')
+        if service_type not in LOCAL_SERVICES:
+            return jsonify({'error': f"Unknown service '{service_type}'"}), 400
+        lower_threshold = int(request.form.get('lower_threshold') or 100)
+        upper_threshold = int(request.form.get('upper_threshold') or 300)
+
+        events = local_directory_events(directory, service_type, lower_threshold, upper_threshold)
+        if stream_format in ('ndjson', 'sse'):
+            return local_directory_response(events, stream_format)
+
+        series = []
+        for event in events:
+            if event['event'] == 'error':
+                return jsonify({'error': event['error']}), 400
+            if event['event'] == 'series':
+                series.append(event)
+            elif event['event'] == 'complete':
+                summary = event
+
+        outputs = [url for s in series for url in s['outputs']]
+        response = {
+            'message': f"Processed {summary['total_files']} files from {summary['series_count']} series",
+            'url': summary['zip_url'],
+            'total_files': summary['total_files'],
+            'series': [{k: s[k] for k in ('series', 'file_count', 'zip_url', 'error')} for s in series]
+        }
+        if service_type == 'image_conversion':
+            response.update({'output': summary['zip_url'], 'file_type': 'zip'})
+        else:
+            if service_type == '3d_model':
+                response['model_urls'] = [url for url in outputs if url.endswith('.stl')]
+                outputs = [url for url in outputs if not url.endswith('.stl')]
+            response.update({
+                'output': outputs[0] if outputs else None,
+                'viewer_url': outputs[len(outputs) // 2] if outputs else None,
+                'file_type': 'png',
+                'all_outputs': outputs[:50]
+            })
+        return jsonify(response), 200
+
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"[ERROR] Local directory processing error: {str(e)}\n{error_details}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/process_local_directory_images', methods=['POST'])
+def process_local_directory_images():
+    """
+    Convert every DICOM file under a server-side directory to JPG.
+
+    Returns image_paths and total_files for the client-side ZIP builder, or
+    streams per-series events with stream=ndjson|sse.
+    """
+    try:
+        directory, stream_format, error = local_directory_request()
+        if error:
+            return error
+
+        events = local_directory_events(directory, 'image_conversion', 100, 300)
+        if stream_format in ('ndjson', 'sse'):
+            return local_directory_response(events, stream_format)
+
+        image_paths = []
+        for event in events:
+            if event['event'] == 'error':
+                return jsonify({'error': event['error']}), 400
+            if event['event'] == 'series':
+                image_paths.extend(event['outputs'])
+            elif event['event'] == 'complete':
+                summary = event
+
+        return jsonify({
+            'message': f"Converted {len(image_paths)} files from {summary['series_count']} series",
+            'image_paths': image_paths,
+            'total_files': len(image_paths),
+            'zip_url': summary['zip_url']
+        }), 200
+
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"[ERROR] Local directory image conversion error: {str(e)}\n{error_details}")
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/extension_service/growth_rate', methods=['POST'])
 def growth_rate_service():
     """Handle growth rate prediction service requests."""
@@ -463,8 +1095,9 @@ def growth_rate_service():
 @app.route('/train_growth_model', methods=['GET'])
 def train_growth_model():
     try:
-        from python.growth_rate import train_model
+        from python.growth_rate import train_model, clear_model_cache
         train_model()
+        clear_model_cache()
         return jsonify({"message": "Model trained successfully"}), 200
     except Exception as e:
         import traceback
@@ -535,17 +1168,10 @@ def download_zip_file(filename):
     """
     Special route specifically for downloading ZIP files with proper headers.
     """
-    # Find the ZIP file
-    zip_path = os.path.join(PROCESSED_FOLDER, filename)
-    if not os.path.exists(zip_path):
-        # Check in subfolders
-        for subfolder in ['local_image_conversion', 'temp_*']:
-            for path in glob.glob(os.path.join(PROCESSED_FOLDER, subfolder, filename)):
-                if os.path.exists(path):
-                    zip_path = path
-                    break
+    # Find the ZIP file (top level, local conversions or temp_* job folders)
+    zip_path = processed_index.resolve(filename, ('', 'local_image_conversion', 'temp_*'))
     
-    if not os.path.exists(zip_path):
+    if not zip_path:
         print(f"ZIP file not found: {filename}")
         return "ZIP file not found", 404
     
@@ -555,20 +1181,8 @@ def download_zip_file(filename):
         return "ZIP file is empty", 500
     
     try:
-        # Create response with explicit file streaming
-        response = send_file(
-            zip_path,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=os.path.basename(zip_path)
-        )
-        
-        # Add additional headers for proper download
-        response.headers['Content-Disposition'] = f'attachment; filename="{os.path.basename(zip_path)}"'
-        response.headers['Content-Length'] = str(file_size)
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
+        # Create response with explicit file streaming (or hand it to nginx)
+        response = send_processed_file(zip_path, 'application/zip', as_attachment=True)
         
         print(f"Sending ZIP file: {zip_path}, size: {file_size} bytes, headers: {response.headers}")
         return response
@@ -577,6 +1191,704 @@ def download_zip_file(filename):
         return f"Error sending ZIP file: {str(e)}", 500
 
 
+@app.route('/download/archive/<path:folder>.zip')
+def download_archive(folder):
+    """
+    Stream a ZIP of a folder inside PROCESSED_FOLDER as it is generated.
+
+    Nothing is written to disk: PNG/JPEG members are STORED and other small
+    members are deflated on ZIP_STREAM_WORKERS threads (large ones inline,
+    block by block), so the first bytes go out at once.
+    """
+    processed_root = os.path.realpath(app.config['PROCESSED_FOLDER'])
+    folder_path = os.path.realpath(os.path.join(processed_root, folder))
+    if not folder_path.startswith(processed_root + os.sep) or not os.path.isdir(folder_path):
+        return "Folder not found", 404
+
+    paths = sorted(os.path.join(root, name) for root, _, names in os.walk(folder_path) for name in names)
+    if not paths:
+        return "Folder is empty", 404
+
+    response = Response(stream_zip(archive_members(paths, folder_path), compress_workers=ZIP_STREAM_WORKERS),
+                        mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{os.path.basename(folder_path)}.zip"'
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# DICOM viewer tile pyramids: each series is rendered once into tiles the viewer fetches by
+# (series, slice, level, x, y) instead of whole re-rendered images
+def pyramid_summary(manifest):
+    """Manifest plus the URLs the viewer needs."""
+    if 'error' in manifest:
+        return manifest
+    series_id = manifest['series_id']
+    return dict(manifest,
+                manifest_url=f"/viewer/pyramid/{series_id}",
+                tile_url=f"/viewer/tiles/{series_id}/{{slice}}/{{level}}/{{x}}/{{y}}.png",
+                thumbnail_url=f"/viewer/thumbnails/{series_id}/{{slice}}.png")
+
+
+@app.route('/viewer/pyramid', methods=['POST'])
+def build_viewer_pyramid():
+    """
+    Build tile pyramids for the series in an upload ('dicom_file': DICOM files or a ZIP)
+    or in a server-side 'directory' (under LOCAL_DIRECTORY_ROOTS).
+
+    Optional 'window': a preset (abdomen, angio, bone), 'dicom', 'auto' or 'center,width'.
+    A series that was built before is returned immediately.
+    """
+    try:
+        window = parse_window(request.form.get('window'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    temp_dir = None
+    try:
+        if request.form.get('directory'):
+            directory, _, error = local_directory_request()
+            if error:
+                return error
+        else:
+            files = [f for f in request.files.getlist('dicom_file') if f and f.filename]
+            if not files:
+                return jsonify({'error': 'Provide dicom_file uploads or a directory'}), 400
+            temp_dir = directory = tempfile.mkdtemp(dir=app.config['UPLOAD_FOLDER'])
+            for i, file in enumerate(files):
+                filepath = os.path.join(temp_dir, f"{i:05d}_{secure_filename(file.filename) or 'upload'}")
+                file.save(filepath)
+                if filepath.lower().endswith('.zip'):
+                    extract_zip(filepath, os.path.join(temp_dir, f"{i:05d}_extracted"))
+                    os.remove(filepath)
+
+        try:
+            series = scan_series_directories(directory, DIRECTORY_WORKERS)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        files = [path for paths in series.values() for path in paths]
+
+        manifests = build_series_pyramids(files, PYRAMID_FOLDER, window, max_workers=PYRAMID_WORKERS)
+        if not any('error' not in m for m in manifests):
+            return jsonify({'error': 'No series could be rendered', 'series': manifests}), 500
+        return jsonify({'series': [pyramid_summary(m) for m in manifests]})
+    except Exception as e:
+        print(f"[ERROR] Building tile pyramid failed: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+@app.route('/viewer/pyramid/<series_id>')
+def viewer_pyramid_manifest(series_id):
+    manifest = load_manifest(os.path.join(PYRAMID_FOLDER, series_id)) if PYRAMID_ID_PATTERN.fullmatch(series_id) else None
+    if manifest is None:
+        return jsonify({'error': 'Series not found'}), 404
+    return jsonify(pyramid_summary(manifest))
+
+
+@app.route('/viewer/tiles/<series_id>/<int:slice_index>/<int:level>/<int:x>/<int:y>.png')
+def viewer_tile(series_id, slice_index, level, x, y):
+    """One PNG tile; tiles never change once built, so they are cached as immutable."""
+    if not PYRAMID_ID_PATTERN.fullmatch(series_id):
+        return "Tile not found", 404
+    path = tile_path(os.path.join(PYRAMID_FOLDER, series_id), slice_index, level, x, y)
+    if not os.path.isfile(path):
+        return "Tile not found", 404
+    return send_processed_file(path, 'image/png')
+
+
+@app.route('/viewer/thumbnails/<series_id>/<int:slice_index>.png')
+def viewer_thumbnail(series_id, slice_index):
+    if not PYRAMID_ID_PATTERN.fullmatch(series_id):
+        return "Thumbnail not found", 404
+    path = thumbnail_path(os.path.join(PYRAMID_FOLDER, series_id), slice_index)
+    if not os.path.isfile(path):
+        return "Thumbnail not found", 404
+    return send_processed_file(path, 'image/png')
+
+
+def mesh_summary(mesh):
+    """Mesh info plus its download URL."""
+    if 'error' in mesh:
+        return mesh
+    summary = {k: v for k, v in mesh.items() if k != 'path'}
+    summary['url'] = f"/mesh/{mesh['mesh_id']}/surface.{mesh['format']}"
+    return summary
+
+
+def lod_summary(manifest):
+    """Level-of-detail manifest plus the URLs of its levels, coarsest first."""
+    if 'error' in manifest:
+        return manifest
+    mesh_id = manifest['mesh_id']
+    return dict(manifest,
+                manifest_url=f"/mesh/{mesh_id}/lods",
+                levels=[dict(level, url=f"/mesh/{mesh_id}/lod/{level['level']}.glb") for level in manifest['levels']])
+
+
+def mesh_request_settings():
+    """
+    Parse the mesh form fields (thresholds in HU, target_triangles, smoothing_iterations and
+    the segmentation method, full or coarse_to_fine).
+
+    Returns:
+        tuple: (settings dict, error response or None)
+    """
+    try:
+        settings = {
+            'lower_threshold': int(request.form.get('lower_threshold') or 100),
+            'upper_threshold': int(request.form.get('upper_threshold') or 300),
+            'target_triangles': int(request.form.get('target_triangles') or DEFAULT_TARGET_TRIANGLES),
+            'smoothing_iterations': int(request.form.get('smoothing_iterations') or DEFAULT_SMOOTHING_ITERATIONS),
+            'method': request.form.get('method') or 'full'
+        }
+    except ValueError:
+        return None, (jsonify({'error': 'Thresholds, target_triangles and smoothing_iterations must be integers'}), 400)
+    if not 0 < settings['target_triangles'] <= MESH_MAX_TRIANGLES or not 0 <= settings['smoothing_iterations'] <= 100:
+        return None, (jsonify({'error': f'target_triangles must be 1-{MESH_MAX_TRIANGLES} and smoothing_iterations 0-100'}), 400)
+    if settings['method'] not in SEGMENTATION_METHODS:
+        return None, (jsonify({'error': f"method must be one of: {', '.join(SEGMENTATION_METHODS)}"}), 400)
+    return settings, None
+
+
+def mesh_request_masks(settings, temp_dir):
+    """
+    Masks to mesh from a 'mask_file' label image (e.g. NIfTI from segment_aneurysm), or from
+    thresholding each series in 'dicom_file' uploads (DICOM files or a ZIP) or a server-side
+    'directory'. Uploads are saved in temp_dir.
+
+    Returns:
+        tuple: ([(source, mask, geometry)], error response or None); a series that cannot be
+               read has mask None and the error message in place of geometry
+    """
+    mask_file = request.files.get('mask_file')
+    if mask_file and mask_file.filename:
+        filepath = os.path.join(temp_dir, secure_filename(mask_file.filename) or 'mask.nii')
+        mask_file.save(filepath)
+        return [('mask', *image_mask(filepath))], None
+
+    if request.form.get('directory'):
+        directory, _, error = local_directory_request()
+        if error:
+            return None, error
+    else:
+        files = [f for f in request.files.getlist('dicom_file') if f and f.filename]
+        if not files:
+            return None, (jsonify({'error': 'Provide a mask_file, dicom_file uploads or a directory'}), 400)
+        directory = temp_dir
+        for i, file in enumerate(files):
+            filepath = os.path.join(temp_dir, f"{i:05d}_{secure_filename(file.filename) or 'upload'}")
+            file.save(filepath)
+            if filepath.lower().endswith('.zip'):
+                extract_zip(filepath, os.path.join(temp_dir, f"{i:05d}_extracted"))
+                os.remove(filepath)
+    try:
+        series_dirs = scan_series_directories(directory, DIRECTORY_WORKERS)
+    except ValueError as e:
+        return None, (jsonify({'error': str(e)}), 400)
+
+    masks = []
+    for series_dir in series_dirs:
+        source = os.path.relpath(series_dir, directory)
+        try:
+            masks.append((source, *series_mask(series_dir, settings['lower_threshold'], settings['upper_threshold'],
+                                               method=settings['method'])))
+        except Exception as e:
+            print(f"[ERROR] Reading series {series_dir} for meshing failed: {str(e)}")
+            masks.append((source, None, str(e)))
+    return masks, None
+
+
+def build_meshes(settings, export):
+    """
+    Run export(mask, geometry) on every mask of the request (see mesh_request_masks).
+
+    Returns:
+        tuple: (list of results, with an 'error' key for masks that failed, error response or None)
+    """
+    temp_dir = tempfile.mkdtemp(dir=app.config['UPLOAD_FOLDER'])
+    try:
+        masks, error = mesh_request_masks(settings, temp_dir)
+        if error:
+            return None, error
+        meshes = []
+        for source, mask, geometry in masks:
+            if mask is None:
+                meshes.append({'source': source, 'error': geometry})
+                continue
+            try:
+                meshes.append(dict(export(mask, geometry), source=source))
+            except ValueError as e:
+                meshes.append({'source': source, 'error': str(e)})
+        if not any('error' not in m for m in meshes):
+            return None, (jsonify({'error': 'No mesh could be built', 'meshes': meshes}), 422)
+        return meshes, None
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+@app.route('/mesh', methods=['POST'])
+def build_mesh():
+    """
+    Export the surface of a segmentation as a mesh (see mesh_request_masks for the inputs).
+
+    Optional fields: format (stl or glb), lower_threshold/upper_threshold (HU),
+    target_triangles and smoothing_iterations. A mask that was meshed before with
+    the same settings is returned immediately.
+    """
+    mesh_format = request.form.get('format', 'stl').lower()
+    if mesh_format not in MESH_FORMATS:
+        return jsonify({'error': f"Unknown format '{mesh_format}'. Choose from: {', '.join(MESH_FORMATS)}"}), 400
+    settings, error = mesh_request_settings()
+    if error:
+        return error
+
+    try:
+        meshes, error = build_meshes(settings, lambda mask, geometry: export_mesh(
+            mask, geometry, MESH_FOLDER, mesh_format, settings['target_triangles'], settings['smoothing_iterations']))
+        if error:
+            return error
+        return jsonify({'meshes': [mesh_summary(m) for m in meshes]})
+    except Exception as e:
+        print(f"[ERROR] Mesh export failed: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/mesh/lods', methods=['POST'])
+def build_mesh_lods():
+    """
+    Build coarse-to-fine levels of detail of a segmentation surface for progressive
+    3D preview. Takes the same fields as /mesh; target_triangles is the finest level.
+
+    Each mesh lists its levels coarsest first with their triangle counts, sizes and
+    URLs: a viewer draws level 0 (a few tens of kB) at once and fetches finer levels
+    as the user zooms in or once the coarse model is on screen.
+    """
+    settings, error = mesh_request_settings()
+    if error:
+        return error
+
+    try:
+        meshes, error = build_meshes(settings, lambda mask, geometry: export_lods(
+            mask, geometry, MESH_FOLDER, settings['target_triangles'], settings['smoothing_iterations']))
+        if error:
+            return error
+        return jsonify({'meshes': [lod_summary(m) for m in meshes]})
+    except Exception as e:
+        print(f"[ERROR] Mesh level-of-detail export failed: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/mesh/<mesh_id>/surface.<mesh_format>')
+def mesh_file(mesh_id, mesh_format):
+    """A mesh file; meshes are named by the hash of their mask, so they are cached as immutable."""
+    if not MESH_ID_PATTERN.fullmatch(mesh_id) or mesh_format not in MESH_FORMATS:
+        return "Mesh not found", 404
+    path = mesh_path(os.path.join(MESH_FOLDER, mesh_id), mesh_format)
+    if not os.path.isfile(path):
+        return "Mesh not found", 404
+    return send_processed_file(path, MESH_FORMATS[mesh_format], as_attachment=True)
+
+
+@app.route('/mesh/<mesh_id>/lods')
+def mesh_lod_manifest(mesh_id):
+    manifest = load_lod_manifest(os.path.join(MESH_FOLDER, mesh_id)) if MESH_ID_PATTERN.fullmatch(mesh_id) else None
+    if manifest is None:
+        return jsonify({'error': 'Mesh not found'}), 404
+    return jsonify(lod_summary(manifest))
+
+
+@app.route('/mesh/<mesh_id>/lod/<int:level>.glb')
+def mesh_lod(mesh_id, level):
+    """One level of detail as quantized binary glTF, cached as immutable like the other mesh files."""
+    if not MESH_ID_PATTERN.fullmatch(mesh_id):
+        return "Mesh not found", 404
+    path = lod_path(os.path.join(MESH_FOLDER, mesh_id), level)
+    if not os.path.isfile(path):
+        return "Mesh not found", 404
+    return send_processed_file(path, MESH_FORMATS['glb'])
+
+
+# Threshold previews: a series is decoded once into a SegmentationSession, then overlays at any
+# thresholds are rendered from memory before a full segmentation is committed
+def session_summary(session_id, session):
+    return {
+        'session_id': session_id,
+        'slices': session.shape[0],
+        'rows': session.shape[1],
+        'columns': session.shape[2],
+        'roi': [[s.start, s.stop] for s in session.roi],
+        'thresholds': list(session.thresholds) if session.thresholds else None,
+        'preview_url': f"/segmentation/sessions/{session_id}/preview/{{slice}}.png",
+        'segment_url': f"/segmentation/sessions/{session_id}/segment"
+    }
+
+
+def request_thresholds(source):
+    """
+    lower_threshold/upper_threshold (HU) from request args or form.
+
+    Returns:
+        tuple: (lower, upper, error response or None)
+    """
+    try:
+        lower = int(source.get('lower_threshold') or 100)
+        upper = int(source.get('upper_threshold') or 300)
+    except ValueError:
+        return None, None, (jsonify({'error': 'Thresholds must be integers'}), 400)
+    if lower >= upper:
+        return None, None, (jsonify({'error': 'lower_threshold must be below upper_threshold'}), 400)
+    return lower, upper, None
+
+
+def session_folder(session_id):
+    return os.path.join(SEGMENTATION_SESSION_FOLDER, f"session_{session_id}")
+
+
+def session_state_folder(session_id):
+    return os.path.join(SESSION_STATE_FOLDER, f"session_{session_id}")
+
+
+def requested_session(session_id):
+    if not SESSION_ID_PATTERN.fullmatch(session_id):
+        return None, (jsonify({'error': 'Session not found or expired'}), 404)
+    session = segmentation_sessions.get(session_id)
+    try:
+        # Keeps the saved arrays from expiring while the session is in use
+        touch_saved_session(session_state_folder(session_id))
+        if session is None:
+            # Opened by another worker (or evicted from this one's LRU): map its saved arrays back in
+            session = SegmentationSession.load(session_state_folder(session_id))
+            segmentation_sessions.put(session_id, session)
+    except (OSError, ValueError) as e:
+        print(f"[INFO] Segmentation session {session_id} is not available: {str(e)}")
+        segmentation_sessions.discard(session_id)
+        session = None
+    if session is None:
+        return None, (jsonify({'error': 'Session not found or expired'}), 404)
+    return session, None
+
+
+@app.route('/segmentation/sessions', methods=['POST'])
+def create_segmentation_session():
+    """
+    Load a series ('dicom_file' uploads or a ZIP, or a server-side 'directory') into memory
+    for threshold previews. One session is opened per series found.
+
+    Optional 'window': a preset (abdomen, angio, bone), 'dicom', 'auto' or 'center,width'.
+    """
+    try:
+        window = parse_window(request.form.get('window'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    remove_stale_sessions(SESSION_STATE_FOLDER, SEGMENTATION_SESSION_EXPIRY)
+    temp_dir = tempfile.mkdtemp(dir=app.config['UPLOAD_FOLDER'])
+    try:
+        if request.form.get('directory'):
+            directory, _, error = local_directory_request()
+            if error:
+                return error
+        else:
+            files = [f for f in request.files.getlist('dicom_file') if f and f.filename]
+            if not files:
+                return jsonify({'error': 'Provide dicom_file uploads or a directory'}), 400
+            directory = temp_dir
+            for i, file in enumerate(files):
+                filepath = os.path.join(temp_dir, f"{i:05d}_{secure_filename(file.filename) or 'upload'}")
+                file.save(filepath)
+                if filepath.lower().endswith('.zip'):
+                    extract_zip(filepath, os.path.join(temp_dir, f"{i:05d}_extracted"))
+                    os.remove(filepath)
+        try:
+            series_dirs = scan_series_directories(directory, DIRECTORY_WORKERS)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        sessions = []
+        for series_dir in series_dirs:
+            source = os.path.relpath(series_dir, directory)
+            session_id = uuid.uuid4().hex[:16]
+            try:
+                session = SegmentationSession.from_folder(series_dir, window)
+                # Saved so that whichever worker gets the next request can load it
+                session.save(session_state_folder(session_id))
+            except Exception as e:
+                print(f"[ERROR] Opening segmentation session for {series_dir} failed: {str(e)}")
+                shutil.rmtree(session_state_folder(session_id), ignore_errors=True)
+                sessions.append({'source': source, 'error': str(e)})
+                continue
+            segmentation_sessions.put(session_id, session)
+            sessions.append(dict(session_summary(session_id, session), source=source))
+        if not any('error' not in s for s in sessions):
+            return jsonify({'error': 'No series could be read', 'sessions': sessions}), 422
+        return jsonify({'sessions': sessions}), 201
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+@app.route('/segmentation/sessions/<session_id>', methods=['GET', 'DELETE'])
+def segmentation_session(session_id):
+    session, error = requested_session(session_id)
+    if error:
+        return error
+    if request.method == 'DELETE':
+        segmentation_sessions.discard(session_id)
+        shutil.rmtree(session_state_folder(session_id), ignore_errors=True)
+        shutil.rmtree(session_folder(session_id), ignore_errors=True)
+        return '', 204
+    return jsonify(session_summary(session_id, session))
+
+
+@app.route('/segmentation/sessions/<session_id>/preview/<int:slice_index>.png')
+def segmentation_preview(session_id, slice_index):
+    """Overlay of one slice at lower_threshold/upper_threshold, rendered from the resident series."""
+    session, error = requested_session(session_id)
+    if error:
+        return error
+    lower, upper, error = request_thresholds(request.args)
+    if error:
+        return error
+    if not 0 <= slice_index < session.shape[0]:
+        return jsonify({'error': f'slice must be 0-{session.shape[0] - 1}'}), 404
+    response = Response(session.preview_png(slice_index, lower, upper), mimetype='image/png')
+    response.headers['Cache-Control'] = 'private, max-age=300'
+    return response
+
+
+@app.route('/segmentation/sessions/<session_id>/preview')
+def segmentation_previews(session_id):
+    """
+    Overlays of a few slices (slices=10,11,12, at most PREVIEW_MAX_SLICES) at
+    lower_threshold/upper_threshold, as PNG data URLs.
+    """
+    session, error = requested_session(session_id)
+    if error:
+        return error
+    lower, upper, error = request_thresholds(request.args)
+    if error:
+        return error
+    try:
+        indices = [int(i) for i in request.args.get('slices', '').split(',') if i.strip()]
+    except ValueError:
+        return jsonify({'error': 'slices must be comma-separated integers'}), 400
+    if not indices or len(indices) > PREVIEW_MAX_SLICES:
+        return jsonify({'error': f'Request 1-{PREVIEW_MAX_SLICES} slices'}), 400
+    if not all(0 <= i < session.shape[0] for i in indices):
+        return jsonify({'error': f'slices must be 0-{session.shape[0] - 1}'}), 404
+
+    started = time.perf_counter()
+    previews = [{'slice': i, 'image': 'data:image/png;base64,' + base64.b64encode(session.preview_png(i, lower, upper)).decode('ascii')}
+                for i in indices]
+    return jsonify({'lower_threshold': lower, 'upper_threshold': upper, 'previews': previews,
+                    'render_ms': round(1000 * (time.perf_counter() - started), 1)})
+
+
+@app.route('/segmentation/sessions/<session_id>/segment', methods=['POST'])
+def segmentation_session_segment(session_id):
+    """
+    Commit the full segmentation at lower_threshold/upper_threshold. Repeated runs only
+    re-encode the slices whose masks changed.
+    """
+    session, error = requested_session(session_id)
+    if error:
+        return error
+    lower, upper, error = request_thresholds(request.form)
+    if error:
+        return error
+    output_folder = session_folder(session_id)
+    try:
+        result = session.segment(output_folder, lower, upper)
+    except Exception as e:
+        print(f"[ERROR] Segmenting session {session_id} failed: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    all_outputs = [processed_url(path) for path in result['files']]
+    return jsonify({
+        "message": f"Segmented {len(all_outputs)} slice(s), {len(result['encoded'])} re-encoded",
+        "output": all_outputs[0] if all_outputs else None,
+        "all_outputs": all_outputs,
+        "encoded_slices": result['encoded'],
+        "zip_url": archive_url(output_folder)
+    })
+
+
+# Frame retrieval in the spirit of DICOMweb: instances are stored by Study/Series/SOP Instance UID
+# and single frames are decoded on demand (STOW-RS style upload, WADO-RS style retrieval)
+def store_dicom_files(paths):
+    """
+    Add uploaded files (ZIP archives are extracted) to the DICOM store.
+
+    Returns:
+        tuple: (stored instance summaries, failed files with their errors)
+    """
+    stored, failed = [], []
+    for path in paths:
+        if path.lower().endswith('.zip'):
+            extract_dir = f"{path}_extracted"
+            try:
+                extract_zip(path, extract_dir)
+                members = sorted(os.path.join(root, name) for root, _, names in os.walk(extract_dir) for name in names)
+                member_stored, member_failed = store_dicom_files(members)
+                stored.extend(member_stored)
+                failed.extend(member_failed)
+            finally:
+                shutil.rmtree(extract_dir, ignore_errors=True)
+            continue
+        try:
+            record = dicom_store.store(path)
+        except Exception as e:
+            failed.append({'filename': os.path.basename(path), 'error': str(e)})
+            continue
+        stored.append({
+            'study_uid': record['study_uid'],
+            'series_uid': record['series_uid'],
+            'sop_uid': record['sop_uid'],
+            'frames': record['frames'],
+            'url': instance_url(record)
+        })
+    return stored, failed
+
+
+def instance_url(record):
+    return (f"/dicomweb/studies/{record['study_uid']}/series/{record['series_uid']}"
+            f"/instances/{record['sop_uid']}")
+
+
+def requested_instance(study_uid, series_uid, sop_uid, frame):
+    """Instance record for a frame request, or an error response."""
+    if not all(UID_PATTERN.fullmatch(uid) for uid in (study_uid, series_uid, sop_uid)):
+        return None, (jsonify({'error': 'Invalid UID'}), 400)
+    record = dicom_store.get_instance(study_uid, series_uid, sop_uid)
+    if record is None:
+        return None, (jsonify({'error': 'Instance not found'}), 404)
+    if not 1 <= frame <= record['frames']:
+        return None, (jsonify({'error': f"Frame {frame} out of range (1-{record['frames']})"}), 404)
+    return record, None
+
+
+def frame_response(body, mimetype, etag):
+    """Frames never change for a given SOP Instance UID, so they are cached like other immutable outputs."""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+@app.route('/dicomweb/studies', methods=['POST'])
+def dicomweb_store():
+    """Store DICOM files (or ZIPs of them) sent as 'dicom_file' form uploads."""
+    files = [f for f in request.files.getlist('dicom_file') if f and f.filename]
+    if not files:
+        return jsonify({'error': 'No dicom_file uploads'}), 400
+
+    temp_dir = tempfile.mkdtemp(dir=app.config['UPLOAD_FOLDER'])
+    try:
+        paths = []
+        for i, file in enumerate(files):
+            path = os.path.join(temp_dir, f"{i:05d}_{secure_filename(file.filename) or 'upload'}")
+            file.save(path)
+            paths.append(path)
+        stored, failed = store_dicom_files(paths)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if not stored:
+        return jsonify({'error': 'No DICOM instances could be stored', 'failed': failed}), 400
+    return jsonify({'stored': stored, 'failed': failed})
+
+
+@app.route('/dicomweb/studies', methods=['GET'])
+def dicomweb_studies():
+    return jsonify(dicom_store.studies())
+
+
+@app.route('/dicomweb/studies/<study_uid>/series')
+def dicomweb_series(study_uid):
+    series = dicom_store.series(study_uid)
+    if not series:
+        return jsonify({'error': 'Study not found'}), 404
+    return jsonify(series)
+
+
+@app.route('/dicomweb/studies/<study_uid>/series/<series_uid>/instances')
+def dicomweb_instances(study_uid, series_uid):
+    """Instances of a series in InstanceNumber order, so slice k is the k-th entry."""
+    records = dicom_store.instances(study_uid, series_uid)
+    if not records:
+        return jsonify({'error': 'Series not found'}), 404
+    return jsonify([{
+        'sop_uid': r['sop_uid'],
+        'instance_number': r['instance_number'],
+        'frames': r['frames'],
+        'rows': r['rows'],
+        'columns': r['columns'],
+        'transfer_syntax': r['transfer_syntax'],
+        'url': instance_url(r)
+    } for r in records])
+
+
+@app.route('/dicomweb/studies/<study_uid>/series/<series_uid>/instances/<sop_uid>/frames/<int:frame>')
+def dicomweb_frame(study_uid, series_uid, sop_uid, frame):
+    """
+    Stored pixel values of one frame (1-based) as little-endian bytes.
+
+    The X-Frame-Shape and X-Frame-Dtype headers describe the array.
+    """
+    record, error = requested_instance(study_uid, series_uid, sop_uid, frame)
+    if error:
+        return error
+    try:
+        pixels = dicom_store.frame(record, frame - 1)
+    except Exception as e:
+        print(f"[ERROR] Decoding frame {frame} of {sop_uid} failed: {str(e)}")
+        return jsonify({'error': f"Frame could not be decoded: {str(e)}"}), 500
+
+    body, dtype = raw_frame(pixels)
+    response = frame_response(body, 'application/octet-stream', f"{sop_uid}-{frame}-raw")
+    response.headers['X-Frame-Shape'] = ','.join(str(n) for n in pixels.shape)
+    response.headers['X-Frame-Dtype'] = dtype
+    return response
+
+
+@app.route('/dicomweb/studies/<study_uid>/series/<series_uid>/instances/<sop_uid>/frames/<int:frame>/rendered')
+def dicomweb_rendered_frame(study_uid, series_uid, sop_uid, frame):
+    """
+    One frame (1-based) rendered as JPEG (default) or PNG.
+
+    Query parameters: window (preset, 'dicom', 'auto' or 'center,width'),
+    quality (JPEG, 1-100) and accept=image/png; the Accept header also selects PNG.
+    """
+    record, error = requested_instance(study_uid, series_uid, sop_uid, frame)
+    if error:
+        return error
+    try:
+        # WADO-RS windows are 'center,width,function'; only the linear function is supported
+        window = parse_window(','.join(request.args.get('window', '').split(',')[:2]))
+        quality = min(100, max(1, int(request.args.get('quality', 90))))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    accept = request.args.get('accept') or request.headers.get('Accept', '')
+    image_format = 'png' if 'image/png' in accept else 'jpeg'
+    window_key = ','.join(f"{v:g}" for v in window) if isinstance(window, tuple) else (window or 'dicom')
+    etag = f"{sop_uid}-{frame}-{image_format}-{window_key}-{quality if image_format == 'jpeg' else ''}"
+    if request.if_none_match.contains(etag):
+        return frame_response(None, RENDERED_FORMATS[image_format], etag)
+
+    try:
+        pixels = dicom_store.frame(record, frame - 1)
+        body = render_frame(pixels, record, window, image_format, quality)
+    except Exception as e:
+        print(f"[ERROR] Rendering frame {frame} of {sop_uid} failed: {str(e)}")
+        return jsonify({'error': f"Frame could not be rendered: {str(e)}"}), 500
+    return frame_response(body, RENDERED_FORMATS[image_format], etag)
+
+
 @app.route('/api/slicer_analytics', methods=['POST'])
 def track_slicer_analytics():
     """
@@ -680,6 +1992,80 @@ def slicer_usage_stats():
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+@app.route('/admin/profile/sample')
+def profile_sample():
+    """
+    Sample the Python stacks of this worker's other threads for N seconds (admin only).
+
+    Query parameters: seconds (default 10), interval in seconds (default 0.005) and
+    idle=1 to keep threads that are only waiting. Returns folded stacks
+    ("frame;frame;frame count" per line) for flamegraph.pl or speedscope.
+    Only the worker that receives this request is sampled, so it needs a
+    threaded worker (or the development server) to see requests in flight.
+    """
+    if not is_admin_request():
+        return jsonify({'error': 'Admin token required'}), 403
+
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', 0.005))
+    except ValueError:
+        return jsonify({'error': 'seconds and interval must be numbers'}), 400
+
+    counts, rounds = sample_stacks(seconds, interval=max(interval, 0.001),
+                                   include_idle=request.args.get('idle') == '1')
+    response = Response(format_folded(counts), mimetype='text/plain')
+    response.headers['X-Profile-Samples'] = str(rounds)
+    response.headers['X-Worker-PID'] = str(os.getpid())
+    return response
+
+
+@app.route('/admin/admission')
+def admission_stats():
+    """Limits, running and waiting requests and rejections per service class in this worker (admin only)."""
+    if not is_admin_request():
+        return jsonify({'error': 'Admin token required'}), 403
+    return jsonify({name: limiter.stats() for name, limiter in admission.items()})
+
+
+@app.route('/admin/decode_stats')
+def decode_stats():
+    """
+    Installed decoders per transfer syntax family, fastest first, and this worker's
+    decode throughput per (transfer syntax, decoder) (admin only).
+    """
+    if not is_admin_request():
+        return jsonify({'error': 'Admin token required'}), 403
+
+    return jsonify({
+        'decoders': {family: available_decoders(family) for family in DECODER_PREFERENCE},
+        'stats': DECODE_STATS.snapshot()
+    })
+
+@app.route('/admin/profile/reports/<profile_id>')
+def profile_report(profile_id):
+    """
+    Return a single-request profile report (admin only).
+
+    Add ?format=pstats to download the raw cProfile data for snakeviz or pstats.
+    """
+    if not is_admin_request():
+        return jsonify({'error': 'Admin token required'}), 403
+    if not re.fullmatch(r'[0-9a-f]{32}', profile_id):
+        return jsonify({'error': 'Invalid profile ID'}), 400
+
+    if request.args.get('format') == 'pstats':
+        pstats_path = os.path.abspath(os.path.join(PROFILE_OUTPUT_DIR, f"{profile_id}.prof"))
+        if not os.path.exists(pstats_path):
+            return jsonify({'error': 'Profile not found'}), 404
+        return send_file(pstats_path, as_attachment=True, download_name=f"{profile_id}.prof")
+
+    report_path = os.path.join(PROFILE_OUTPUT_DIR, f"{profile_id}.txt")
+    if not os.path.exists(report_path):
+        return jsonify({'error': 'Profile not found'}), 404
+    with open(report_path, 'r') as f:
+        return Response(f.read(), mimetype='text/plain')
     
 
 # Home page route
@@ -0,0 +1,38 @@
+# ASGI entry point: serves the Flask app through python/asgi_bridge.py under an ASGI server, e.g.
+#   uvicorn asgi:application --host 0.0.0.0 --port 8000
+#-----------------------------------
+import os
+
+from werkzeug.exceptions import HTTPException
+
+from app import app, admission, service_class
+from python.admission import available_cpus
+from python.asgi_bridge import ExecutorASGIBridge
+
+# Uploads, conversions, segmentation, meshing, predictions and training share the heavy pool; GET
+# requests (pages, static files, tiles, previews, frames) use the light pool except these long ones.
+# Requests of an admission-controlled service class are admitted on the event loop and run on a pool
+# of their class's concurrency instead, so they never queue behind another class.
+HEAVY_GET_PREFIXES = ('/train_growth_model', '/download/')
+LIGHT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'DELETE')
+
+ASGI_HEAVY_WORKERS = int(os.environ.get('ASGI_HEAVY_WORKERS', available_cpus()))
+ASGI_LIGHT_WORKERS = int(os.environ.get('ASGI_LIGHT_WORKERS', 16))
+
+
+def is_heavy(scope):
+    return scope['method'] not in LIGHT_METHODS or scope['path'].startswith(HEAVY_GET_PREFIXES)
+
+
+def environ_service_class(environ):
+    """app.service_class() of a request that Flask has not routed yet, or None."""
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(environ).match()
+        content_length = int(environ.get('CONTENT_LENGTH') or 0)
+    except (HTTPException, ValueError):
+        return None
+    return service_class(endpoint, content_length)
+
+
+application = ExecutorASGIBridge(app, is_heavy, ASGI_HEAVY_WORKERS, ASGI_LIGHT_WORKERS,
+                                 service_class=environ_service_class, limiters=admission)
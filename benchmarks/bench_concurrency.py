@@ -0,0 +1,201 @@
+# Load test comparing the shipped gunicorn setup (gunicorn.conf.py, gthread workers) with the ASGI entry
+# point (asgi.py) under mixed load: clients posting DICOM conversions while other clients load pages and
+# health checks.
+#
+# Usage (from the repository root, with gunicorn and uvicorn installed):
+#   python -m benchmarks.bench_concurrency --duration 20 --heavy-clients 4 --light-clients 8
+#
+# Each server runs as one process on a free port with temporary upload and processed folders.
+#-----------------------------------
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.harness import environment_info
+from benchmarks.synthetic_dicom import package_zip, write_dicom_series
+
+HOST = '127.0.0.1'
+LIGHT_PATHS = ['/', '/health', '/about', '/extensions']
+HEAVY_PATH = '/service/image_conversion'
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def server_command(server, port, workers):
+    """
+    Command line of one server: 'gthread' is gunicorn with gunicorn.conf.py (its threads per worker,
+    GUNICORN_THREADS), 'sync' is gunicorn's single-threaded sync worker and 'asgi' is uvicorn on asgi.py.
+    """
+    if server == 'gthread':
+        return [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_ROOT, 'gunicorn.conf.py'),
+                '-w', str(workers), '-b', f"{HOST}:{port}", 'app:app']
+    if server == 'sync':
+        # gunicorn also reads ./gunicorn.conf.py here, and its threads would turn the sync worker into gthread
+        return [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-k', 'sync', '--threads', '1',
+                '--timeout', '600', '-b', f"{HOST}:{port}", 'app:app']
+    return [sys.executable, '-m', 'uvicorn', 'asgi:application', '--workers', str(workers),
+            '--host', HOST, '--port', str(port), '--log-level', 'warning']
+
+
+def wait_until_up(port, process, timeout=180):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            connection = http.client.HTTPConnection(HOST, port, timeout=5)
+            connection.request('GET', '/health')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError("Server did not start in time")
+
+
+def multipart_body(zip_path):
+    boundary = uuid.uuid4().hex
+    with open(zip_path, 'rb') as f:
+        content = f.read()
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"dicom_file\"; filename=\"series.zip\"\r\n"
+            f"Content-Type: application/zip\r\n\r\n").encode() + content + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def _client(port, stop, record, method, paths, body=None, content_type=None):
+    """Send requests back to back until stop is set, recording (path, status, seconds)."""
+    i = 0
+    while not stop.is_set():
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            connection = http.client.HTTPConnection(HOST, port, timeout=600)
+            headers = {'Content-Type': content_type} if content_type else {}
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+            connection.close()
+        except OSError:
+            status = 0
+        record.append((path, status, time.perf_counter() - start))
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(records, duration):
+    seconds = [s for _, status, s in records if status == 200]
+    return {
+        'requests': len(records),
+        'errors': sum(1 for _, status, _ in records if status != 200),
+        'per_second': len(seconds) / duration,
+        'p50_ms': (_percentile(seconds, 0.5) or 0) * 1000,
+        'p95_ms': (_percentile(seconds, 0.95) or 0) * 1000,
+        'max_ms': max(seconds, default=0) * 1000
+    }
+
+
+def run_server(server, zip_path, args):
+    """Start one server, drive the mixed load against it and return light/heavy summaries."""
+    port = _free_port()
+    work_dir = tempfile.mkdtemp(prefix=f"bench_{server}_")
+    env = dict(os.environ,
+               UPLOAD_FOLDER=os.path.join(work_dir, 'uploads') + os.sep,
+               PROCESSED_FOLDER=os.path.join(work_dir, 'processed') + os.sep,
+               FLASK_ENV='production')
+    os.makedirs(env['UPLOAD_FOLDER'])
+    os.makedirs(env['PROCESSED_FOLDER'])
+    log = open(os.path.join(work_dir, 'server.log'), 'w')
+    process = subprocess.Popen(server_command(server, port, args.workers), cwd=REPO_ROOT, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    try:
+        wait_until_up(port, process)
+        body, content_type = multipart_body(zip_path)
+        stop = threading.Event()
+        light, heavy = [], []
+        threads = [threading.Thread(target=_client, args=(port, stop, heavy, 'POST', [HEAVY_PATH], body, content_type))
+                   for _ in range(args.heavy_clients)]
+        threads += [threading.Thread(target=_client, args=(port, stop, light, 'GET', LIGHT_PATHS))
+                    for _ in range(args.light_clients)]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return {'light': summarize(light, args.duration), 'heavy': summarize(heavy, args.duration)}
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        log.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def format_results(results):
+    lines = [f"{'server':<8} {'class':<7} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}"]
+    for server, classes in results.items():
+        for name, r in classes.items():
+            lines.append(f"{server:<8} {name:<7} {r['requests']:>9} {r['errors']:>7} {r['per_second']:>8.1f} "
+                         f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['max_ms']:>9.1f}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the shipped gunicorn setup and the ASGI entry point under mixed load.")
+    parser.add_argument('--servers', nargs='+', choices=['gthread', 'sync', 'asgi'], default=['gthread', 'asgi'])
+    parser.add_argument('--workers', type=int, default=1, help="Server processes")
+    parser.add_argument('--duration', type=float, default=20, help="Seconds of load per server")
+    parser.add_argument('--heavy-clients', type=int, default=4, help="Clients posting DICOM ZIP conversions")
+    parser.add_argument('--light-clients', type=int, default=8, help="Clients loading pages and /health")
+    parser.add_argument('--slices', type=int, default=32, help="Slices in the posted series")
+    parser.add_argument('--size', type=int, default=512, help="Rows and columns per slice")
+    parser.add_argument('--json', help="Write raw results to this file")
+    args = parser.parse_args(argv)
+
+    series_dir = tempfile.mkdtemp(prefix='bench_series_')
+    try:
+        series = write_dicom_series(series_dir, args.slices, args.size, args.size)
+        zip_path = os.path.join(series_dir, 'series.zip')
+        package_zip(series['files'], zip_path)
+
+        results = {}
+        for server in args.servers:
+            print(f"[INFO] Loading {server} for {args.duration:.0f}s...", flush=True)
+            results[server] = run_server(server, zip_path, args)
+    finally:
+        shutil.rmtree(series_dir, ignore_errors=True)
+
+    print(format_results(results))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'environment': environment_info(), 'results': results}, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
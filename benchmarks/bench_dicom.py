@@ -0,0 +1,142 @@
+# Benchmark for the DICOM conversion, segmentation and growth simulation pipeline.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_dicom --slices 64 --size 512
+#   python -m benchmarks.bench_dicom --slices 300 --compression rle --save-baseline
+#
+# Each volume size runs in a fresh process so peak RSS is per case.
+#-----------------------------------
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.harness import (StageTimer, compare_to_baseline, format_regressions, format_report,
+                                load_baseline, save_baseline)
+
+BASELINE_NAME = 'dicom_pipeline'
+STAGES = ['process_dicom_file', 'process_zip_file', 'apply_segmentation', 'segment_aaa', 'simulate_aneurysm_growth']
+
+
+@contextlib.contextmanager
+def _quiet(enabled):
+    """Silence the pipeline's print() logging while a stage runs."""
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def run_case(slices, rows, columns, compression, stages, trace_memory, quiet, growth_iterations):
+    """Write a synthetic series, run the selected pipeline stages and return the stage results."""
+    import numpy as np
+    import pydicom
+    import SimpleITK as sitk
+    from benchmarks.synthetic_dicom import package_zip, write_dicom_series
+
+    work_dir = tempfile.mkdtemp(prefix="bench_dicom_")
+    timer = StageTimer(trace_memory=trace_memory)
+    try:
+        series_dir = os.path.join(work_dir, 'series')
+        with timer.stage('write_series', items=slices):
+            series = write_dicom_series(series_dir, slices, rows, columns, compression=compression)
+        files = series['files']
+
+        if 'process_dicom_file' in stages:
+            from python.dicom_processor import process_dicom_file
+            output_dir = os.path.join(work_dir, 'converted')
+            with _quiet(quiet), timer.stage('process_dicom_file', items=slices):
+                for path in files:
+                    process_dicom_file(path, os.path.join(output_dir, os.path.basename(path) + '.jpg'))
+
+        if 'process_zip_file' in stages:
+            from python.dicom_processor import process_zip_file
+            zip_path = package_zip(files, os.path.join(work_dir, 'series.zip'))
+            with _quiet(quiet), timer.stage('process_zip_file', items=slices):
+                process_zip_file(zip_path, os.path.join(work_dir, 'zip_converted'))
+
+        if 'apply_segmentation' in stages:
+            from python.segmentation import apply_segmentation
+            with _quiet(quiet), timer.stage('apply_segmentation', items=slices):
+                apply_segmentation(series_dir, os.path.join(work_dir, 'segmented'))
+
+        if 'segment_aaa' in stages:
+            from python.automated_measure import segment_aaa
+            pixel_arrays = [pydicom.dcmread(path).pixel_array for path in files]
+            with _quiet(quiet), timer.stage('segment_aaa', items=slices):
+                for pixel_array in pixel_arrays:
+                    segment_aaa(pixel_array)
+            del pixel_arrays
+
+        if 'simulate_aneurysm_growth' in stages:
+            from python.simulator import simulate_aneurysm_growth
+            mask_image = sitk.GetImageFromArray(series['aorta_mask'].astype(np.uint8))
+            with _quiet(quiet), timer.stage('simulate_aneurysm_growth', items=slices):
+                simulate_aneurysm_growth(mask_image, iterations=growth_iterations)
+
+        return timer.stages
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the DICOM processing pipeline on synthetic CT volumes.")
+    parser.add_argument('--slices', nargs='+', type=int, default=[32, 128], help="Number of slices per volume")
+    parser.add_argument('--size', type=int, default=512, help="Rows and columns per slice")
+    parser.add_argument('--compression', choices=['none', 'rle'], default='none')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--growth-iterations', type=int, default=5)
+    parser.add_argument('--trace-memory', action='store_true', help="Record per-stage Python allocation peaks (slower)")
+    parser.add_argument('--verbose', action='store_true', help="Show the pipeline's own logging")
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed slowdown before flagging a regression")
+    parser.add_argument('--json', help="Write raw results to this file")
+    args = parser.parse_args(argv)
+
+    compression = None if args.compression == 'none' else args.compression
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for slices in args.slices:
+        case_key = f"{slices}x{args.size}x{args.size}/{args.compression}"
+        print(f"[INFO] Running {case_key}...", flush=True)
+        with context.Pool(1) as pool:
+            results[case_key] = pool.apply(
+                run_case,
+                (slices, args.size, args.size, compression, args.stages, args.trace_memory,
+                 not args.verbose, args.growth_iterations)
+            )
+
+    print(format_report(results))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        print(f"[INFO] Baseline saved to {save_baseline(BASELINE_NAME, results)}")
+        return 0
+
+    baseline = load_baseline(BASELINE_NAME)
+    if baseline is None:
+        print("[INFO] No baseline stored yet. Run with --save-baseline to create one.")
+        return 0
+
+    regressions = compare_to_baseline(results, baseline, tolerance=args.tolerance)
+    if regressions:
+        print(format_regressions(regressions))
+        return 1
+    print("[INFO] No regressions against baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,184 @@
+# End-to-end benchmark for the growth rate and rupture risk prediction services.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_predictions --sizes 100 10000 1000000
+#   python -m benchmarks.bench_predictions --save-baseline
+#
+# Each (service, size) case runs in a fresh process so peak RSS is per case.
+#-----------------------------------
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.cohort import COHORT_GENERATORS
+from benchmarks.harness import (StageTimer, compare_to_baseline, format_regressions, format_report,
+                                load_baseline, save_baseline)
+
+BASELINE_NAME = 'predictions'
+DEFAULT_SIZES = [100, 1000, 10000, 100000, 1000000]
+
+
+def _record_spans(timer, parent, trace, n):
+    """Add the service's own spans (python/instrumentation.py) inside a stage as '<parent>.<span>' stages."""
+    totals = {}
+    for record in trace['spans']:
+        name = f"{parent}.{record['stage']}"
+        totals[name] = totals.get(name, 0.0) + record['duration_ms'] / 1000  # Repeated spans are summed
+    for name, seconds in totals.items():
+        timer.stages[name] = {"seconds": seconds, "items": n, "ms_per_item": seconds * 1000 / n,
+                              "items_per_sec": n / seconds if seconds > 0 else float('inf')}
+
+
+def _predict_stage(timer, n, predict, *args):
+    """Time one service stage function, broken down by the spans it records."""
+    from python.instrumentation import finish_trace, start_trace
+
+    start_trace()
+    try:
+        with timer.stage("predict", items=n):
+            predict(*args)
+    finally:
+        trace = finish_trace()
+    _record_spans(timer, "predict", trace, n)
+
+
+def _bench_growth_rate(csv_path, output_dir, timer, max_chart_rows):
+    from python.features import read_patient_table
+    from python.growth_rate import (create_multiple_patients_visualization, load_prediction_model,
+                                    predict_growth_frame, write_growth_predictions)
+
+    with timer.stage("model_load"):
+        model, scaler = load_prediction_model()
+
+    with timer.stage("load"):
+        df = read_patient_table(csv_path)
+    n = len(df)
+
+    _predict_stage(timer, n, predict_growth_frame, df, model, scaler)
+
+    with timer.stage("csv_write", items=n):
+        results_path = write_growth_predictions(df, output_dir)
+
+    if n <= max_chart_rows:
+        with timer.stage("chart", items=n):
+            create_multiple_patients_visualization(df, output_dir, results_path)
+
+
+def _bench_rupture_risk(csv_path, output_dir, timer, max_chart_rows):
+    from python.features import read_patient_table
+    from python.rupture_risk import (create_patient_progression_visualization, load_prediction_models,
+                                     predict_risk_frame, write_risk_predictions)
+
+    with timer.stage("model_load"):
+        models = load_prediction_models()
+
+    with timer.stage("load"):
+        df = read_patient_table(csv_path)
+    n = len(df)
+
+    _predict_stage(timer, n, predict_risk_frame, df, *models)
+
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    with timer.stage("csv_write", items=n):
+        write_risk_predictions(df, output_dir, timestamp)
+
+    if n <= max_chart_rows:
+        with timer.stage("chart", items=n):
+            create_patient_progression_visualization(df, output_dir, timestamp)
+
+
+def _bench_end_to_end(service, csv_path, output_dir, timer, n):
+    if service == "growth_rate":
+        from python.growth_rate import predict_growth_rate_from_excel as predict_from_excel
+    else:
+        from python.rupture_risk import predict_rupture_risk_from_excel as predict_from_excel
+
+    with timer.stage("end_to_end", items=n):
+        result = predict_from_excel(csv_path, output_dir)
+    if 'error' in result:
+        raise RuntimeError(result['error'])
+
+
+STAGE_BENCHMARKS = {
+    "growth_rate": _bench_growth_rate,
+    "rupture_risk": _bench_rupture_risk
+}
+
+
+def run_case(service, rows, seed, trace_memory, max_chart_rows, end_to_end):
+    """Generate a cohort, run every stage once and return the stage results."""
+    os.chdir(REPO_ROOT)  # Model paths are relative to the repository root
+    work_dir = tempfile.mkdtemp(prefix=f"bench_{service}_")
+    try:
+        csv_path = os.path.join(work_dir, f"{service}_{rows}.csv")
+        COHORT_GENERATORS[service](rows, seed=seed).to_csv(csv_path, index=False)
+
+        timer = StageTimer(trace_memory=trace_memory)
+        STAGE_BENCHMARKS[service](csv_path, work_dir, timer, max_chart_rows)
+        if end_to_end:
+            _bench_end_to_end(service, csv_path, work_dir, timer, rows)
+        return timer.stages
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the growth rate and rupture risk prediction services.")
+    parser.add_argument('--services', nargs='+', choices=sorted(STAGE_BENCHMARKS), default=sorted(STAGE_BENCHMARKS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES, help="Cohort sizes (rows)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--trace-memory', action='store_true', help="Record per-stage Python allocation peaks (slower)")
+    parser.add_argument('--max-chart-rows', type=int, default=1000,
+                        help="Skip chart rendering above this many rows (the per-patient bar chart does not scale)")
+    parser.add_argument('--end-to-end', action='store_true', help="Also time the full predict_*_from_excel call")
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed slowdown before flagging a regression")
+    parser.add_argument('--json', help="Write raw results to this file")
+    args = parser.parse_args(argv)
+
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for service in args.services:
+        for rows in args.sizes:
+            case_key = f"{service}/{rows}"
+            print(f"[INFO] Running {case_key}...", flush=True)
+            with context.Pool(1) as pool:
+                results[case_key] = pool.apply(
+                    run_case,
+                    (service, rows, args.seed, args.trace_memory, args.max_chart_rows, args.end_to_end)
+                )
+
+    print(format_report(results))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        print(f"[INFO] Baseline saved to {save_baseline(BASELINE_NAME, results)}")
+        return 0
+
+    baseline = load_baseline(BASELINE_NAME)
+    if baseline is None:
+        print("[INFO] No baseline stored yet. Run with --save-baseline to create one.")
+        return 0
+
+    regressions = compare_to_baseline(results, baseline, tolerance=args.tolerance)
+    if regressions:
+        print(format_regressions(regressions))
+        return 1
+    print("[INFO] No regressions against baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
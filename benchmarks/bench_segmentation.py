@@ -0,0 +1,121 @@
+# Benchmark for python/multiresolution.py: 'full' against 'coarse_to_fine' segmentation, with the cheap
+# threshold classifier the entry points use and with an expensive per-voxel classifier.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_segmentation --slices 64 --size 256 --noise 0 40
+#
+# Reports the best of --repeats runs per case and how many voxels coarse_to_fine labels differently.
+#-----------------------------------
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.harness import environment_info
+from benchmarks.synthetic_dicom import synthetic_ct_volume
+
+LOWER_HU, UPPER_HU = 100, 300
+HIDDEN_UNITS = 32
+CLASSIFY_CHUNK = 256 * 1024
+
+
+def expensive_classifier(lower, upper, hidden=HIDDEN_UNITS):
+    """
+    Same decision as threshold_classifier(lower, upper), at the cost of a
+    per-voxel hidden layer of hidden tanh units: a stand-in for a learned
+    voxel classifier, where each classified voxel is expensive.
+    """
+    weights = np.random.default_rng(0).normal(0, 1e-3, hidden).astype(np.float32)
+
+    def classify(values):
+        flat = np.asarray(values, dtype=np.float32).ravel()
+        labels = np.empty(flat.shape, dtype=bool)
+        for start in range(0, flat.size, CLASSIFY_CHUNK):
+            chunk = flat[start:start + CLASSIFY_CHUNK]
+            hidden_layer = np.tanh(np.outer(chunk, weights))
+            # The hidden layer only adds cost; the decision is the threshold's
+            score = chunk + 0 * hidden_layer.sum(axis=1)
+            labels[start:start + CLASSIFY_CHUNK] = (score > lower) & (score < upper)
+        return labels.reshape(np.shape(values))
+
+    return classify
+
+
+def _best_of(repeats, func):
+    best, result = None, None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_case(volume, classifiers, repeats):
+    from python.multiresolution import segment
+
+    results = {}
+    for name, classify in classifiers.items():
+        full_seconds, full_mask = _best_of(repeats, lambda: segment(volume, classify, 'full'))
+        coarse_seconds, coarse_mask = _best_of(repeats, lambda: segment(volume, classify, 'coarse_to_fine'))
+        results[name] = {
+            'full_ms': full_seconds * 1000,
+            'coarse_to_fine_ms': coarse_seconds * 1000,
+            'speedup': full_seconds / coarse_seconds if coarse_seconds > 0 else float('inf'),
+            'voxels': int(full_mask.sum()),
+            'different_voxels': int(np.count_nonzero(full_mask != coarse_mask))
+        }
+    return results
+
+
+def format_results(results):
+    lines = [f"{'case':<22} {'classifier':<10} {'full ms':>9} {'c2f ms':>9} {'speedup':>8} {'voxels':>9} {'differ':>8}"]
+    for case, classifiers in results.items():
+        for name, r in classifiers.items():
+            lines.append(f"{case:<22} {name:<10} {r['full_ms']:>9.1f} {r['coarse_to_fine_ms']:>9.1f} "
+                         f"{r['speedup']:>7.2f}x {r['voxels']:>9} {r['different_voxels']:>8}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare full and coarse-to-fine segmentation on a synthetic CT volume.")
+    parser.add_argument('--slices', type=int, default=64)
+    parser.add_argument('--size', type=int, default=256, help="Rows and columns per slice")
+    parser.add_argument('--noise', nargs='+', type=float, default=[0, 40],
+                        help="Extra Gaussian noise (HU standard deviation) on top of the phantom's own")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--json', help="Write raw results to this file")
+    args = parser.parse_args(argv)
+
+    from python.multiresolution import threshold_classifier
+    classifiers = {
+        'threshold': threshold_classifier(LOWER_HU, UPPER_HU),
+        'expensive': expensive_classifier(LOWER_HU, UPPER_HU)
+    }
+
+    phantom, _ = synthetic_ct_volume(args.slices, args.size, args.size)
+    results = {}
+    for noise in args.noise:
+        volume = phantom.astype(np.float32)
+        if noise:
+            volume += np.random.default_rng(1).normal(0, noise, volume.shape).astype(np.float32)
+        case = f"{args.slices}x{args.size}x{args.size}/noise{noise:g}"
+        print(f"[INFO] Running {case}...", flush=True)
+        results[case] = run_case(volume, classifiers, args.repeats)
+
+    print(format_results(results))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'environment': environment_info(), 'results': results}, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+# Seeded synthetic patient cohorts matching the columns expected by the prediction services.
+#-----------------------------------
+import numpy as np
+import pandas as pd
+
+
+def _patient_ids(n):
+    """Patient IDs in the same P001 style as the sample uploads."""
+    width = max(3, len(str(n)))
+    return [f"P{i + 1:0{width}d}" for i in range(n)]
+
+
+def generate_growth_cohort(n, seed=42):
+    """
+    Generate a cohort for predict_growth_rate_from_excel.
+
+    Columns match data/correct_dataset.csv: Patient ID, Current Axial Diameter (mm),
+    Previous Axial Diameter (mm), Time Interval (months), ILT Volume (mL).
+    """
+    rng = np.random.default_rng(seed)
+    previous = rng.uniform(25, 65, n).round(1)
+    interval = rng.choice([6, 12, 18, 24], size=n)
+    # Monthly growth of 0-0.6 mm with occasional small measurement errors
+    growth = rng.gamma(2.0, 0.08, n) - rng.uniform(0, 0.05, n)
+    current = (previous + growth * interval).round(1)
+
+    return pd.DataFrame({
+        "Patient ID": _patient_ids(n),
+        "Current Axial Diameter (mm)": current,
+        "Previous Axial Diameter (mm)": previous,
+        "Time Interval (months)": interval,
+        "ILT Volume (mL)": rng.uniform(0, 100, n).round(3)
+    })
+
+
+def generate_rupture_cohort(n, seed=42, missing_fraction=0.05):
+    """
+    Generate a cohort for predict_rupture_risk_from_excel.
+
+    Columns match uploads/AAA_Rupture_Risk_Sample.csv. A fraction of the
+    optional values is blanked so the default-filling paths are exercised.
+    """
+    rng = np.random.default_rng(seed)
+    diameter = rng.uniform(25, 70, n).round(1)
+
+    df = pd.DataFrame({
+        "Patient ID": _patient_ids(n),
+        "Axial Diameter (mm)": diameter,
+        "ILT Volume (mL)": rng.uniform(0, 100, n).round(3),
+        "Peak Wall Stress (kPa)": (diameter * 3 + rng.normal(0, 15, n)).round(0),
+        "Blood Pressure (mmHg)": rng.integers(100, 181, n),
+        "Smoking History": rng.choice(["Yes", "No", "yes", "no", "Y", "N"], size=n, p=[0.3, 0.4, 0.05, 0.15, 0.05, 0.05]),
+        "Age": rng.integers(50, 91, n),
+        "Gender": rng.choice(["M", "F", "Male", "Female"], size=n, p=[0.6, 0.25, 0.1, 0.05])
+    })
+
+    if missing_fraction > 0:
+        for column in ["Peak Wall Stress (kPa)", "Blood Pressure (mmHg)", "Age", "Smoking History", "Gender"]:
+            blank = rng.random(n) < missing_fraction
+            df[column] = df[column].astype(object)
+            df.loc[blank, column] = None
+
+    return df
+
+
+COHORT_GENERATORS = {
+    "growth_rate": generate_growth_cohort,
+    "rupture_risk": generate_rupture_cohort
+}
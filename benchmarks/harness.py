@@ -0,0 +1,149 @@
+# Shared timing, memory tracking and baseline comparison for the benchmark scripts.
+#-----------------------------------
+import gc
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in KB elsewhere
+    if sys.platform == 'darwin':
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+class StageTimer:
+    """
+    Record wall time and memory for named pipeline stages.
+
+    Each stage records seconds, throughput (items per second when an item
+    count is given), peak RSS after the stage and, when trace_memory is
+    enabled, the peak Python allocation during the stage via tracemalloc.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name, items=None):
+        gc.collect()
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            result = {"seconds": elapsed, "peak_rss_mb": peak_rss_mb()}
+            if self.trace_memory:
+                _, traced_peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                result["traced_peak_mb"] = traced_peak / (1024 * 1024)
+            if items:
+                result["items"] = items
+                result["items_per_sec"] = items / elapsed if elapsed > 0 else float('inf')
+                result["ms_per_item"] = elapsed * 1000 / items
+            self.stages[name] = result
+
+
+def environment_info():
+    """Basic host information stored alongside results and baselines."""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+def baseline_path(name):
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def load_baseline(name):
+    """Load a stored baseline, or None if it does not exist."""
+    path = baseline_path(name)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_baseline(name, results):
+    """Store results as the new baseline for this benchmark."""
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = baseline_path(name)
+    with open(path, 'w') as f:
+        json.dump({"environment": environment_info(), "results": results}, f, indent=2, sort_keys=True)
+    return path
+
+
+def compare_to_baseline(results, baseline, tolerance=0.2, min_seconds=0.05):
+    """
+    Compare stage timings against a stored baseline.
+
+    Results and baseline are both {case_key: {stage: {"seconds": ...}}}.
+    A stage regresses when it is more than `tolerance` slower than the
+    baseline and the absolute difference exceeds `min_seconds` (to ignore
+    noise on very fast stages).
+
+    Returns:
+        list: One dict per regressed stage
+    """
+    regressions = []
+    baseline_results = baseline.get("results", {}) if baseline else {}
+    for case_key, stages in results.items():
+        for stage_name, stage in stages.items():
+            reference = baseline_results.get(case_key, {}).get(stage_name)
+            if not reference:
+                continue
+            current_seconds = stage["seconds"]
+            baseline_seconds = reference["seconds"]
+            if (current_seconds > baseline_seconds * (1 + tolerance)
+                    and current_seconds - baseline_seconds > min_seconds):
+                regressions.append({
+                    "case": case_key,
+                    "stage": stage_name,
+                    "baseline_seconds": baseline_seconds,
+                    "seconds": current_seconds,
+                    "slowdown": current_seconds / baseline_seconds if baseline_seconds > 0 else float('inf')
+                })
+    return regressions
+
+
+def format_report(results):
+    """Format {case_key: {stage: result}} as a plain-text table."""
+    lines = [f"{'case':<28} {'stage':<24} {'seconds':>10} {'items/s':>14} {'ms/item':>10} {'peak RSS MB':>12} {'traced MB':>10}"]
+    for case_key, stages in results.items():
+        for stage_name, stage in stages.items():
+            throughput = stage.get("items_per_sec")
+            per_item = stage.get("ms_per_item")
+            traced = stage.get("traced_peak_mb")
+            lines.append(
+                f"{case_key:<28} {stage_name:<24} {stage['seconds']:>10.4f} "
+                f"{(f'{throughput:,.0f}' if throughput is not None else '-'):>14} "
+                f"{(f'{per_item:.3f}' if per_item is not None else '-'):>10} "
+                f"{stage['peak_rss_mb']:>12.1f} "
+                f"{(f'{traced:.1f}' if traced is not None else '-'):>10}"
+            )
+    return "\n".join(lines)
+
+
+def format_regressions(regressions):
+    lines = []
+    for r in regressions:
+        lines.append(
+            f"[REGRESSION] {r['case']} {r['stage']}: {r['seconds']:.4f}s vs baseline "
+            f"{r['baseline_seconds']:.4f}s ({r['slowdown']:.2f}x)"
+        )
+    return "\n".join(lines)
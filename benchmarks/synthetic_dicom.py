@@ -0,0 +1,171 @@
+# Synthetic abdominal CT series written with pydicom, used by the DICOM benchmarks.
+#-----------------------------------
+import os
+import zipfile
+
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import CTImageStorage, ExplicitVRLittleEndian, RLELossless, generate_uid
+
+PYDICOM_MAJOR = int(pydicom.__version__.split('.')[0])
+
+# Transfer syntaxes that can be written without optional encoder plugins
+COMPRESSION_SYNTAXES = {
+    None: ExplicitVRLittleEndian,
+    'rle': RLELossless
+}
+
+RESCALE_INTERCEPT = -1024
+
+
+def synthetic_ct_volume(slices=64, rows=512, columns=512, seed=42):
+    """
+    Build a synthetic abdominal CT volume in Hounsfield units.
+
+    The phantom has air, an elliptical soft-tissue body, a vertebral body and
+    a contrast-filled aorta whose radius bulges in the middle slices to mimic
+    an aneurysm.
+
+    Returns:
+        tuple: (hu_volume int16 array of shape (slices, rows, columns), aorta_mask bool array)
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:rows, 0:columns].astype(np.float32)
+    cy, cx = rows / 2, columns / 2
+
+    body = ((yy - cy) / (rows * 0.38)) ** 2 + ((xx - cx) / (columns * 0.45)) ** 2 <= 1
+    spine = ((yy - cy - rows * 0.2) / (rows * 0.06)) ** 2 + ((xx - cx) / (columns * 0.06)) ** 2 <= 1
+
+    volume = np.empty((slices, rows, columns), dtype=np.int16)
+    aorta_mask = np.zeros((slices, rows, columns), dtype=bool)
+    base_radius = min(rows, columns) * 0.03
+    for z in range(slices):
+        # Aneurysmal bulge centred in the volume
+        bulge = np.exp(-((z - slices / 2) / (slices / 6)) ** 2)
+        radius = base_radius * (1 + 1.5 * bulge)
+        aorta = (yy - cy) ** 2 + (xx - cx + columns * 0.04) ** 2 <= radius ** 2
+
+        slice_hu = np.full((rows, columns), -1000, dtype=np.int16)
+        slice_hu[body] = 40
+        slice_hu[spine] = 700
+        slice_hu[aorta] = 250
+        slice_hu += rng.normal(0, 12, (rows, columns)).astype(np.int16)
+
+        volume[z] = slice_hu
+        aorta_mask[z] = aorta
+
+    return volume, aorta_mask
+
+
+def _base_dataset(study_uid, series_uid, transfer_syntax):
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = CTImageStorage
+    file_meta.TransferSyntaxUID = ExplicitVRLittleEndian if transfer_syntax.is_compressed else transfer_syntax
+    file_meta.ImplementationClassUID = generate_uid()
+
+    ds = Dataset()
+    ds.file_meta = file_meta
+    ds.preamble = b"\0" * 128
+    if PYDICOM_MAJOR < 3:
+        ds.is_little_endian = True
+        ds.is_implicit_VR = False
+
+    ds.SOPClassUID = CTImageStorage
+    ds.StudyInstanceUID = study_uid
+    ds.SeriesInstanceUID = series_uid
+    ds.FrameOfReferenceUID = generate_uid()
+    ds.PatientID = "SYNTHETIC"
+    ds.PatientName = "Synthetic^Phantom"
+    ds.Modality = "CT"
+    ds.StudyDescription = "Synthetic abdominal CT"
+    ds.SeriesDescription = "Benchmark series"
+    ds.SeriesNumber = 1
+    return ds
+
+
+def _write_dataset(ds, path):
+    try:
+        pydicom.dcmwrite(path, ds, enforce_file_format=True)
+    except TypeError:
+        # pydicom < 3.0
+        pydicom.dcmwrite(path, ds, write_like_original=False)
+
+
+def write_dicom_series(output_dir, slices=64, rows=512, columns=512, compression=None,
+                       pixel_spacing=0.7, slice_thickness=1.0, seed=42):
+    """
+    Write a synthetic CT series as one DICOM file per slice.
+
+    Args:
+        output_dir: Directory to write the .dcm files to
+        slices, rows, columns: Volume size
+        compression: None for Explicit VR Little Endian or 'rle' for RLE Lossless
+        pixel_spacing: In-plane spacing in mm
+        slice_thickness: Slice spacing in mm
+        seed: Random seed for the image noise
+
+    Returns:
+        dict: file paths, UIDs, the HU volume and the ground-truth aorta mask
+    """
+    if compression not in COMPRESSION_SYNTAXES:
+        raise ValueError(f"Unsupported compression '{compression}'. Choose from: {', '.join(str(c) for c in COMPRESSION_SYNTAXES)}")
+    transfer_syntax = COMPRESSION_SYNTAXES[compression]
+
+    os.makedirs(output_dir, exist_ok=True)
+    volume, aorta_mask = synthetic_ct_volume(slices, rows, columns, seed)
+    # Stored values are unsigned with a rescale intercept, as most scanners write them
+    stored = (volume.astype(np.int32) - RESCALE_INTERCEPT).clip(0, 4095).astype(np.uint16)
+
+    study_uid = generate_uid()
+    series_uid = generate_uid()
+    files = []
+    for z in range(slices):
+        ds = _base_dataset(study_uid, series_uid, transfer_syntax)
+        sop_uid = generate_uid()
+        ds.file_meta.MediaStorageSOPInstanceUID = sop_uid
+        ds.SOPInstanceUID = sop_uid
+        ds.InstanceNumber = z + 1
+        ds.ImagePositionPatient = [0.0, 0.0, float(z * slice_thickness)]
+        ds.ImageOrientationPatient = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0]
+        ds.SliceLocation = float(z * slice_thickness)
+        ds.SliceThickness = slice_thickness
+        ds.PixelSpacing = [pixel_spacing, pixel_spacing]
+        ds.Rows = rows
+        ds.Columns = columns
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.BitsAllocated = 16
+        ds.BitsStored = 12
+        ds.HighBit = 11
+        ds.PixelRepresentation = 0
+        ds.RescaleIntercept = RESCALE_INTERCEPT
+        ds.RescaleSlope = 1
+        ds.WindowCenter = 40
+        ds.WindowWidth = 400
+
+        if transfer_syntax.is_compressed:
+            ds.compress(transfer_syntax, stored[z])
+        else:
+            ds.PixelData = stored[z].tobytes()
+
+        path = os.path.join(output_dir, f"slice_{z:04d}.dcm")
+        _write_dataset(ds, path)
+        files.append(path)
+
+    return {
+        "files": files,
+        "study_uid": study_uid,
+        "series_uid": series_uid,
+        "volume": volume,
+        "aorta_mask": aorta_mask
+    }
+
+
+def package_zip(files, zip_path, compression=zipfile.ZIP_DEFLATED):
+    """Package DICOM files into a ZIP archive the way users upload them."""
+    os.makedirs(os.path.dirname(zip_path) or '.', exist_ok=True)
+    with zipfile.ZipFile(zip_path, 'w', compression) as zipf:
+        for file in files:
+            zipf.write(file, os.path.basename(file))
+    return zip_path
@@ -0,0 +1,121 @@
+# Production gunicorn settings, loaded automatically by `gunicorn app:app` from the repository root.
+# The app is loaded once in the master before the workers fork, so every worker shares it copy-on-write;
+# workers are sized from the CPUs, recycled above a memory ceiling and report metrics together.
+#-----------------------------------
+import gc
+import glob
+import os
+import tempfile
+
+
+def _cpu_count():
+    """CPUs this process may run on (respects container CPU sets), at least 1."""
+    try:
+        return len(os.sched_getaffinity(0)) or 1
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+CPUS = _cpu_count()
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', 5000)}")
+
+# Processes do the CPU-bound work (one per CPU); threads overlap I/O such as uploads and file serving
+workers = int(os.environ.get('WEB_CONCURRENCY', max(2, CPUS)))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+# app.py sizes its admission limits from this, leaving some threads for pages and health checks
+os.environ['WORKER_THREADS'] = str(threads)
+
+# Import app.py in the master, before forking. TensorFlow's thread pools and locks do not survive fork(),
+# so the models are never loaded there: each worker loads them on its first prediction, or right after
+# it starts with PRELOAD_MODELS=1
+preload_app = True
+PRELOAD_MODELS = os.environ.get('PRELOAD_MODELS', '0') == '1'
+
+# Prometheus multiprocess mode: every worker writes its metrics to files in this directory and /metrics
+# adds them up. It has to be set before app.py imports prometheus_client, and emptied of a previous
+# run's files
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'aortec_prometheus'))
+os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+for _path in glob.glob(os.path.join(PROMETHEUS_MULTIPROC_DIR, '*.db')):
+    os.remove(_path)
+
+# Series conversions and training can take minutes
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 600))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 120))
+keepalive = 5
+
+# Recycling: after a number of requests (jittered so workers do not restart together), and as soon
+# as a worker's private memory passes WORKER_MAX_MEMORY_MB (0 disables the check)
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+WORKER_MAX_MEMORY_MB = int(os.environ.get('WORKER_MAX_MEMORY_MB', 2048))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = os.environ.get('GUNICORN_ERROR_LOG', '-')
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def resident_memory_mb():
+    """Current resident set size of this process in MB (peak RSS where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def private_memory_mb():
+    """
+    Memory only this process holds, in MB: resident pages minus those still shared with the
+    master (Linux smaps_rollup), so the preloaded app is not counted against every worker.
+    """
+    try:
+        private_kb = 0
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                if line.startswith(('Private_Clean:', 'Private_Dirty:')):
+                    private_kb += int(line.split()[1])
+        return private_kb / 1024
+    except (OSError, ValueError, IndexError):
+        return resident_memory_mb()
+
+
+def when_ready(server):
+    """Runs in the master after the app is loaded, just before the first workers fork."""
+    # Move everything loaded so far out of the collector's generations, so collections in the
+    # workers do not write to (and so copy) the pages shared with the master
+    gc.freeze()
+    server.log.info(f"{workers} workers x {threads} threads on {CPUS} CPUs, "
+                    f"master holds {resident_memory_mb():.0f} MB before forking")
+
+
+def post_worker_init(worker):
+    """Runs in each worker after it has forked: load the models here, never in the master."""
+    if PRELOAD_MODELS:
+        from python.growth_rate import cached_prediction_model
+        from python.rupture_risk import cached_prediction_models
+        for name, load in (('growth rate', cached_prediction_model), ('rupture risk', cached_prediction_models)):
+            try:
+                load()
+                worker.log.info(f"Worker {worker.pid} loaded the {name} models")
+            except Exception as e:
+                worker.log.error(f"Loading {name} models failed, the first prediction will retry: {e}")
+
+
+def child_exit(server, worker):
+    """Drop an exited worker's live gauges (admission in-flight and queue depth) from /metrics."""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_request(worker, req, environ, resp):
+    """Retire a worker whose memory passed the ceiling once its current requests finish."""
+    if WORKER_MAX_MEMORY_MB and worker.alive:
+        private = private_memory_mb()
+        if private > WORKER_MAX_MEMORY_MB:
+            worker.log.warning(f"Worker {worker.pid} holds {private:.0f} MB (limit {WORKER_MAX_MEMORY_MB} MB), restarting it")
+            worker.alive = False
@@ -0,0 +1,231 @@
+# Admission control for expensive services: each service class gets a concurrency limit and a bounded
+# wait queue, and requests beyond them are turned away at once with Retry-After instead of piling up
+# on the workers that cheap routes also need.
+#-----------------------------------
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+
+try:
+    from prometheus_client import Counter, Gauge, Histogram
+except ImportError:  # prometheus_client ships with prometheus_flask_exporter; stats are still kept in memory
+    Counter = Gauge = Histogram = None
+
+# Gauges are summed over the live workers in Prometheus multiprocess mode
+IN_FLIGHT = Gauge(
+    'aortec_admission_in_flight', 'Requests running per service class', ['service'], multiprocess_mode='livesum'
+) if Gauge is not None else None
+QUEUE_DEPTH = Gauge(
+    'aortec_admission_queue_depth', 'Requests waiting for a slot per service class', ['service'],
+    multiprocess_mode='livesum'
+) if Gauge is not None else None
+REJECTED = Counter(
+    'aortec_admission_rejected_total', 'Requests turned away per service class', ['service', 'reason']
+) if Counter is not None else None
+QUEUE_WAIT = Histogram(
+    'aortec_admission_wait_seconds', 'Time admitted requests waited for a slot', ['service'],
+    buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60)
+) if Histogram is not None else None
+
+# Weight of the latest request in the running average of how long a slot is held
+HOLD_TIME_SMOOTHING = 0.2
+# WSGI environ key of a Slot taken before the app was called (asgi_bridge admits requests on the event loop)
+SLOT_ENVIRON_KEY = 'admission.slot'
+
+
+def available_cpus():
+    """CPUs this process may run on (respects container CPU sets), at least 1."""
+    try:
+        return len(os.sched_getaffinity(0)) or 1
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Rejected(Exception):
+    """A request that was not admitted: status is 429 (queue full) or 503 (waited too long)."""
+
+    def __init__(self, service, status, reason, retry_after):
+        super().__init__(f"Service '{service}' is at capacity ({reason}), retry in {retry_after}s")
+        self.service = service
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def payload(self):
+        """JSON body of the rejection response."""
+        return {'error': f"The {self.service.replace('_', ' ')} service is busy, please retry later",
+                'service': self.service, 'retry_after': self.retry_after}
+
+
+class Slot:
+    """An admitted request's hold on its service; release() is safe to call more than once."""
+
+    def __init__(self, limiter, waited):
+        self._limiter = limiter
+        self._started = time.monotonic()
+        self._released = False
+        self.waited = waited
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._limiter._release(time.monotonic() - self._started)
+
+
+class ServiceLimiter:
+    """
+    At most concurrency requests of one service class at a time, and at most
+    queue_size more waiting for up to queue_timeout seconds.
+
+    A full queue is rejected immediately with 429; a request that reaches the
+    front of the queue too late gets 503. Retry-After is estimated from the
+    average time a slot is held and the work ahead.
+
+    acquire() waits on a worker thread; acquire_async() waits on an event
+    loop without holding a thread, and a freed slot is handed to the first
+    such waiter.
+    """
+
+    def __init__(self, name, concurrency, queue_size, queue_timeout):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.queue_size = max(0, queue_size)
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = {'queue_full': 0, 'timeout': 0}
+        self._hold_seconds = None
+        self._cond = threading.Condition()
+        self._async_waiters = deque()  # (loop, future) of acquire_async() calls, oldest first
+
+    def retry_after(self):
+        """Seconds until a slot is likely to be free for a new request (at least 1)."""
+        hold = self._hold_seconds or 1.0
+        return max(1, math.ceil(hold * (self.waiting + 1) / self.concurrency))
+
+    def _reject(self, status, reason):
+        self.rejected[reason] += 1
+        if REJECTED is not None:
+            REJECTED.labels(service=self.name, reason=reason).inc()
+        raise Rejected(self.name, status, reason, self.retry_after())
+
+    def _update_gauges(self):
+        if IN_FLIGHT is not None:
+            IN_FLIGHT.labels(service=self.name).set(self.active)
+            QUEUE_DEPTH.labels(service=self.name).set(self.waiting)
+
+    def acquire(self):
+        """
+        Wait for a slot.
+
+        Returns:
+            Slot: Release it when the request is finished
+
+        Raises:
+            Rejected: The queue is full, or no slot came free within queue_timeout
+        """
+        start = time.monotonic()
+        with self._cond:
+            # Requests already waiting go first
+            if self.active >= self.concurrency or self.waiting:
+                if self.waiting >= self.queue_size:
+                    self._reject(429, 'queue_full')
+                self.waiting += 1
+                self._update_gauges()
+                deadline = start + self.queue_timeout
+                try:
+                    while self.active >= self.concurrency:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._reject(503, 'timeout')
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+                    self._update_gauges()
+            self.active += 1
+            self.admitted += 1
+            self._update_gauges()
+        return self._slot(start)
+
+    async def acquire_async(self):
+        """
+        acquire() for a coroutine: waiting takes no thread.
+
+        Returns:
+            Slot: Release it when the request is finished
+
+        Raises:
+            Rejected: The queue is full, or no slot came free within queue_timeout
+        """
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        with self._cond:
+            if self.active < self.concurrency and not self.waiting:
+                self.active += 1
+                self.admitted += 1
+                self._update_gauges()
+                return self._slot(start)
+            if self.waiting >= self.queue_size:
+                self._reject(429, 'queue_full')
+            waiter = (loop, loop.create_future())
+            self._async_waiters.append(waiter)
+            self.waiting += 1
+            self._update_gauges()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter[1]), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._cond:
+                if waiter in self._async_waiters:
+                    self._async_waiters.remove(waiter)
+                    self.waiting -= 1
+                    self._update_gauges()
+                    if not isinstance(e, asyncio.CancelledError):
+                        self._reject(503, 'timeout')
+                    raise
+                # A slot was handed over just as the wait ended: keep it, unless the caller is gone
+                if isinstance(e, asyncio.CancelledError):
+                    self._free_slot()
+                    raise
+        return self._slot(start)
+
+    def _slot(self, start):
+        waited = time.monotonic() - start
+        if QUEUE_WAIT is not None:
+            QUEUE_WAIT.labels(service=self.name).observe(waited)
+        return Slot(self, waited)
+
+    def _free_slot(self):
+        """Hand a slot to the oldest acquire_async() waiter, or free it for acquire(). Call with _cond held."""
+        if self._async_waiters:
+            loop, future = self._async_waiters.popleft()
+            self.waiting -= 1
+            self.admitted += 1
+            loop.call_soon_threadsafe(_resolve, future)
+        else:
+            self.active -= 1
+            self._cond.notify()
+        self._update_gauges()
+
+    def _release(self, held_seconds):
+        with self._cond:
+            if self._hold_seconds is None:
+                self._hold_seconds = held_seconds
+            else:
+                self._hold_seconds += HOLD_TIME_SMOOTHING * (held_seconds - self._hold_seconds)
+            self._free_slot()
+
+    def stats(self):
+        with self._cond:
+            return {'concurrency': self.concurrency, 'queue_size': self.queue_size,
+                    'queue_timeout': self.queue_timeout, 'active': self.active, 'waiting': self.waiting,
+                    'admitted': self.admitted, 'rejected': dict(self.rejected),
+                    'average_hold_seconds': self._hold_seconds}
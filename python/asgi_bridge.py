@@ -0,0 +1,243 @@
+# ASGI adapter for the Flask app: each request runs the WSGI app on a thread pool chosen by its kind, so
+# heavy service calls cannot occupy the threads that serve pages, static files and quick API calls, while
+# request and response bodies are streamed between the event loop and the worker thread.
+#-----------------------------------
+import asyncio
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from .admission import Rejected, SLOT_ENVIRON_KEY
+
+READ_ALL = -1
+# Body messages received ahead of the WSGI app's reads (each is at most the ASGI server's chunk size)
+BODY_QUEUE_MESSAGES = 4
+
+
+class ReceiveStream:
+    """
+    Blocking file-like view of the ASGI request body for wsgi.input.
+
+    watch() is the only reader of receive(): it runs on the event loop for
+    the whole request and hands body messages to read() through a queue of
+    at most BODY_QUEUE_MESSAGES, so uploads are not buffered up front and
+    pipelined upload handling keeps working. It sets disconnected as soon
+    as the client goes away, even if the app never reads the body (GET
+    streams).
+    """
+
+    def __init__(self, loop, max_messages=BODY_QUEUE_MESSAGES):
+        self._loop = loop
+        self._messages = asyncio.Queue(max_messages)
+        self._buffer = bytearray()
+        self._done = False
+        self.disconnected = False
+
+    async def watch(self, receive):
+        """Queue body messages from receive() until the client disconnects (cancel it when the request ends)."""
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                self.disconnected = True
+            await self._messages.put(message)
+            if self.disconnected:
+                return
+
+    def _pull(self):
+        message = asyncio.run_coroutine_threadsafe(self._messages.get(), self._loop).result()
+        if message['type'] == 'http.disconnect':
+            self._done = True
+            return
+        self._buffer += message.get('body', b'')
+        if not message.get('more_body', False):
+            self._done = True
+
+    def _take(self, size):
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def read(self, size=READ_ALL):
+        if size is None or size < 0:
+            while not self._done:
+                self._pull()
+            return self._take(len(self._buffer))
+        while len(self._buffer) < size and not self._done:
+            self._pull()
+        return self._take(size)
+
+    def readline(self, size=READ_ALL):
+        while True:
+            end = self._buffer.find(b'\n')
+            if end >= 0 and (size is None or size < 0 or end < size):
+                return self._take(end + 1)
+            if (size is not None and 0 <= size <= len(self._buffer)) or self._done:
+                return self._take(len(self._buffer) if size is None or size < 0 else size)
+            self._pull()
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+
+def wsgi_environ(scope, body):
+    """PEP 3333 environ for an ASGI HTTP scope."""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        # The body ends where the ASGI server says it does, with or without Content-Length
+        'wsgi.input_terminated': True
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+        environ['REMOTE_PORT'] = str(scope['client'][1])
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class ExecutorASGIBridge:
+    """
+    ASGI application that serves a WSGI app from thread pools.
+
+    Requests that is_heavy(scope) selects run on a pool of heavy_workers
+    threads; everything else runs on a separate pool of light_workers
+    threads, so pages and quick calls are answered while every heavy
+    thread is busy. Responses are sent chunk by chunk as the WSGI app
+    yields them (NDJSON and server-sent event streams, streamed ZIPs),
+    waiting for each send, so a slow client slows its worker down instead
+    of filling memory.
+
+    With service_class(environ) and limiters (service class -> admission
+    ServiceLimiter), a request of a limited class waits for its slot on the
+    event loop, or is answered 429/503 from there, before it is handed to a
+    thread; admitted requests run on a pool of their class's concurrency.
+    The slot reaches the app as environ[admission.SLOT_ENVIRON_KEY] and is
+    released when the request ends at the latest.
+    """
+
+    def __init__(self, wsgi_app, is_heavy, heavy_workers=4, light_workers=16, service_class=None, limiters=None):
+        self.wsgi_app = wsgi_app
+        self.is_heavy = is_heavy
+        self.heavy_workers = heavy_workers
+        self.light_workers = light_workers
+        self.heavy = ThreadPoolExecutor(max_workers=heavy_workers, thread_name_prefix='asgi-heavy')
+        self.light = ThreadPoolExecutor(max_workers=light_workers, thread_name_prefix='asgi-light')
+        self.service_class = service_class
+        self.limiters = limiters or {}
+        self.services = {name: ThreadPoolExecutor(max_workers=limiter.concurrency, thread_name_prefix=f"asgi-{name}")
+                         for name, limiter in self.limiters.items()}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope type '{scope['type']}'")
+
+        loop = asyncio.get_running_loop()
+        body = ReceiveStream(loop)
+        environ = wsgi_environ(scope, body)
+        watcher = loop.create_task(body.watch(receive))
+        slot = None
+        try:
+            service = self.service_class(environ) if self.service_class else None
+            if service in self.limiters:
+                try:
+                    slot = await self.limiters[service].acquire_async()
+                except Rejected as e:
+                    print(f"[INFO] Rejected {scope['method']} {scope['path']}: {str(e)}")
+                    await self._reject(send, e)
+                    return
+                environ[SLOT_ENVIRON_KEY] = slot
+                executor = self.services[service]
+            else:
+                executor = self.heavy if self.is_heavy(scope) else self.light
+            await loop.run_in_executor(executor, self._run, environ, send, loop)
+        finally:
+            watcher.cancel()
+            if slot is not None:
+                slot.release()
+
+    @staticmethod
+    async def _reject(send, rejected):
+        body = json.dumps(rejected.payload()).encode('utf-8')
+        await send({'type': 'http.response.start', 'status': rejected.status,
+                    'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                                (b'retry-after', str(rejected.retry_after).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                for executor in (self.heavy, self.light, *self.services.values()):
+                    executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _run(self, environ, send, loop):
+        """Call the WSGI app on a worker thread and relay its response to the event loop."""
+        def emit(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get('started'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), str(value).encode('latin-1'))
+                                   for name, value in headers]
+            return write
+
+        def start():
+            if not response.get('started'):
+                response['started'] = True
+                emit({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+
+        def write(data):
+            start()
+            if data:
+                emit({'type': 'http.response.body', 'body': bytes(data), 'more_body': True})
+
+        body = environ['wsgi.input']
+        result = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in result:
+                # Stop generating a stream nobody is reading any more
+                if body.disconnected:
+                    break
+                write(chunk)
+            start()
+            emit({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            close = getattr(result, 'close', None)
+            if close:
+                close()
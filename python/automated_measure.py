@@ -4,9 +4,13 @@ import numpy as np
 from skimage import measure, morphology
 from skimage.filters import threshold_otsu
 from skimage.segmentation import clear_border
-from scipy.spatial.distance import euclidean
+from scipy.spatial import ConvexHull
+from scipy.spatial.distance import pdist
 from matplotlib import pyplot as plt
 
+from .multiresolution import segment
+from .roi import find_roi
+
 
 def load_dicom_images(input_path):
     """Load DICOM images from a folder or single file."""
@@ -28,11 +32,22 @@ def load_dicom_images(input_path):
     return slices, np.array(images)
 
 
-def segment_aaa(image):
-    """Segment the AAA region in a single DICOM image."""
+def segment_aaa(image, roi=None, method='full'):
+    """
+    Segment the AAA region in a single DICOM image.
+
+    With roi ((y, x) slices, e.g. from roi.find_roi) only that region is
+    segmented; the returned bbox is in full-image coordinates either way.
+    method is 'full' or 'coarse_to_fine' (see multiresolution.segment).
+    """
+    offset = (0, 0)
+    if roi is not None:
+        image = image[roi]
+        offset = (roi[0].start, roi[1].start)
+
     # Thresholding
     thresh = threshold_otsu(image)
-    binary_image = image > thresh
+    binary_image = segment(image, lambda values: values > thresh, method)
 
     # Remove small objects and clear borders
     cleared = clear_border(binary_image)
@@ -45,7 +60,9 @@ def segment_aaa(image):
         return None
 
     largest_region = max(regions, key=lambda r: r.area)
-    return largest_region.convex_image, largest_region.bbox
+    min_row, min_col, max_row, max_col = largest_region.bbox
+    bbox = (min_row + offset[0], min_col + offset[1], max_row + offset[0], max_col + offset[1])
+    return largest_region.convex_image, bbox
 
 
 def calculate_aaa_metrics(segmented_images, pixel_spacing):
@@ -60,8 +77,12 @@ def calculate_aaa_metrics(segmented_images, pixel_spacing):
         # Compute diameter
         coords = np.argwhere(image)
         if len(coords) > 1:
-            dists = [euclidean(p1, p2) for p1 in coords for p2 in coords]
-            max_diameter = max(max_diameter, max(dists) * spacing)
+            # The farthest pair of pixels lies on the convex hull, so only its vertices are compared
+            try:
+                coords = coords[ConvexHull(coords).vertices]
+            except Exception:
+                pass  # collinear pixels have no 2D hull
+            max_diameter = max(max_diameter, pdist(coords).max() * spacing)
 
         # Compute volume (number of pixels times pixel area)
         volume += np.sum(image) * spacing**2
@@ -98,19 +119,35 @@ def visualize_segmentation(input_images, segmented_images, output_path):
         plt.close()
 
 
-def automated_measure(input_path, output_path):
-    """Main function to perform automated measurement."""
+def automated_measure(input_path, output_path, crop_to_roi=False):
+    """
+    Main function to perform automated measurement.
+
+    The maximum diameter is taken from the whole slices by default: a sac
+    clipped by the crop would be dropped by clear_border, so crop_to_roi
+    stays opt-in until the ROI is validated for measurement.
+    """
     # Load DICOM images
     slices, images = load_dicom_images(input_path)
 
     # Extract pixel spacing (assume square pixels for simplicity)
     pixel_spacing = [float(slice.PixelSpacing[0]) for slice in slices]
 
-    # Segment images
+    # Segment images, only around the aorta candidate (found on a downsampled pass)
+    roi = None
+    if crop_to_roi:
+        first = slices[0]
+        spacing = (float(first.PixelSpacing[1]), float(first.PixelSpacing[0]), float(first.get('SliceThickness', 1) or 1))
+        roi = find_roi(images, spacing, slope=float(first.get('RescaleSlope', 1)),
+                       intercept=float(first.get('RescaleIntercept', 0)))
+
     segmented_images = []
-    for image in images:
-        segmented, bbox = segment_aaa(image)
-        segmented_images.append(segmented)
+    for z, image in enumerate(images):
+        if roi is not None and not roi[0].start <= z < roi[0].stop:
+            segmented_images.append(None)
+            continue
+        result = segment_aaa(image, roi[1:] if roi else None)
+        segmented_images.append(result[0] if result else None)
 
     # Calculate metrics
     max_diameter, volume = calculate_aaa_metrics(segmented_images, pixel_spacing)
@@ -0,0 +1,229 @@
+# Binary masks packed 8 voxels to a byte, with set operations, popcount-based counting, 6-connected
+# morphology on the packed bits, connected components and run-length encoding.
+#-----------------------------------
+import numpy as np
+import SimpleITK as sitk
+
+# Bits set in every byte value, for numpy versions without np.bitwise_count
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def _popcount(bits):
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(bits).sum(dtype=np.int64))
+    return int(_POPCOUNT[bits].sum(dtype=np.int64))
+
+
+class PackedMask:
+    """
+    A 2D or 3D binary mask stored as bits along the last axis (1/8 of a bool array).
+
+    Every row is padded to whole bytes, so masks[z] and other leading-axis
+    slices are cheap and set operations work byte by byte. geometry
+    (spacing, origin, direction as in mesh_export.image_geometry) is kept
+    for conversion back to SimpleITK and for physical volumes.
+    """
+
+    __slots__ = ('shape', 'bits', 'geometry')
+
+    def __init__(self, shape, bits, geometry=None):
+        self.shape = tuple(shape)
+        self.bits = bits
+        self.geometry = geometry
+
+    @classmethod
+    def from_array(cls, mask, geometry=None):
+        """Pack a bool (or non-zero) array."""
+        return cls(mask.shape, np.packbits(np.asarray(mask, dtype=bool), axis=-1, bitorder='little'), geometry)
+
+    @classmethod
+    def zeros(cls, shape, geometry=None):
+        shape = tuple(shape)
+        return cls(shape, np.zeros(shape[:-1] + ((shape[-1] + 7) // 8,), dtype=np.uint8), geometry)
+
+    @classmethod
+    def from_image(cls, image, label=None):
+        """Pack a SimpleITK label image: voxels equal to label, or every non-zero voxel."""
+        array = sitk.GetArrayViewFromImage(image)
+        mask = array == label if label is not None else array != 0
+        return cls.from_array(mask, {'spacing': list(image.GetSpacing()), 'origin': list(image.GetOrigin()),
+                                     'direction': list(image.GetDirection())})
+
+    def to_array(self):
+        """Unpack to a bool array."""
+        return np.unpackbits(self.bits, axis=-1, count=self.shape[-1], bitorder='little').view(bool)
+
+    def to_image(self, label=1):
+        """A SimpleITK uint8 label image (label inside, 0 outside) with the mask's geometry."""
+        image = sitk.GetImageFromArray(self.to_array().astype(np.uint8) * np.uint8(label))
+        if self.geometry:
+            image.SetSpacing(self.geometry['spacing'])
+            image.SetOrigin(self.geometry['origin'])
+            image.SetDirection(self.geometry['direction'])
+        return image
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def _tail(self):
+        """Byte mask that clears the padding bits at the end of every row."""
+        valid = self.shape[-1] % 8
+        tail = np.full(self.bits.shape[-1], 0xFF, dtype=np.uint8)
+        if valid:
+            tail[-1] = (1 << valid) - 1
+        return tail
+
+    def _like(self, bits):
+        return PackedMask(self.shape, bits, self.geometry)
+
+    def _check(self, other):
+        if self.shape != other.shape:
+            raise ValueError(f"Mask shapes differ: {self.shape} and {other.shape}")
+
+    def __or__(self, other):
+        self._check(other)
+        return self._like(self.bits | other.bits)
+
+    def __and__(self, other):
+        self._check(other)
+        return self._like(self.bits & other.bits)
+
+    def __xor__(self, other):
+        self._check(other)
+        return self._like(self.bits ^ other.bits)
+
+    def __sub__(self, other):
+        """Voxels in self but not in other."""
+        self._check(other)
+        return self._like(self.bits & ~other.bits)
+
+    def __invert__(self):
+        return self._like(~self.bits & self._tail())
+
+    def __eq__(self, other):
+        return isinstance(other, PackedMask) and self.shape == other.shape and np.array_equal(self.bits, other.bits)
+
+    __hash__ = None
+
+    def __getitem__(self, index):
+        """Leading-axis indexing (e.g. one slice of a volume), without unpacking."""
+        bits = self.bits[index]
+        if bits.ndim < 1:
+            raise IndexError("Only leading axes can be indexed")
+        shape = bits.shape[:-1] + (self.shape[-1],)
+        return PackedMask(shape, bits, self.geometry)
+
+    def count(self):
+        """Number of voxels inside the mask (popcount of the packed bits)."""
+        return _popcount(self.bits)
+
+    def any(self):
+        return bool(self.bits.any())
+
+    def area_mm2(self, spacing=None):
+        """Area of a 2D mask; spacing (x, y) defaults to the geometry's."""
+        spacing = spacing or self.geometry['spacing']
+        return self.count() * float(spacing[0]) * float(spacing[1])
+
+    def volume_mm3(self, spacing=None):
+        """Volume of a 3D mask; spacing (x, y, z) defaults to the geometry's."""
+        spacing = spacing or self.geometry['spacing']
+        return self.count() * float(np.prod(spacing[:3]))
+
+    def counts_per_slice(self):
+        """Voxels inside the mask in every slice along the first axis."""
+        if hasattr(np, 'bitwise_count'):
+            counts = np.bitwise_count(self.bits)
+        else:
+            counts = _POPCOUNT[self.bits]
+        return counts.reshape(self.shape[0], -1).sum(axis=1, dtype=np.int64)
+
+    def _shifted(self, axis, step):
+        """The mask moved one voxel along axis (step +1 or -1), with zeros shifted in."""
+        bits = self.bits
+        out = np.zeros_like(bits)
+        last = bits.ndim - 1
+        if axis != last:
+            source = [slice(None)] * bits.ndim
+            target = [slice(None)] * bits.ndim
+            source[axis] = slice(None, -1) if step > 0 else slice(1, None)
+            target[axis] = slice(1, None) if step > 0 else slice(None, -1)
+            out[tuple(target)] = bits[tuple(source)]
+            return out
+        # Along the packed axis: shift within bytes and carry the edge bit into the neighbouring byte
+        if step > 0:
+            out[...] = bits << 1
+            out[..., 1:] |= bits[..., :-1] >> 7
+        else:
+            out[...] = bits >> 1
+            out[..., :-1] |= bits[..., 1:] << 7
+        return out & self._tail()
+
+    def dilate(self, iterations=1):
+        """Dilation with the 6-connected (4-connected in 2D) cross, as scipy's default binary_dilation."""
+        mask = self
+        for _ in range(iterations):
+            bits = mask.bits.copy()
+            for axis in range(bits.ndim):
+                bits |= mask._shifted(axis, 1)
+                bits |= mask._shifted(axis, -1)
+            mask = self._like(bits)
+        return mask
+
+    def erode(self, iterations=1):
+        """Erosion with the 6-connected (4-connected in 2D) cross; voxels outside the mask's box count as empty."""
+        mask = self
+        for _ in range(iterations):
+            bits = mask.bits.copy()
+            for axis in range(bits.ndim):
+                bits &= mask._shifted(axis, 1)
+                bits &= mask._shifted(axis, -1)
+            mask = self._like(bits)
+        return mask
+
+    def boundary(self):
+        """Voxels of the mask with at least one neighbour outside it."""
+        return self - self.erode()
+
+    def components(self, fully_connected=False):
+        """
+        Connected components, largest first.
+
+        Returns:
+            list: One PackedMask per component
+        """
+        labels = sitk.RelabelComponent(sitk.ConnectedComponent(self.to_image(), fully_connected))
+        array = sitk.GetArrayViewFromImage(labels)
+        return [PackedMask.from_array(array == label, self.geometry) for label in range(1, int(array.max()) + 1)]
+
+    def largest_component(self, fully_connected=False):
+        """The largest connected component (an empty mask if there is none)."""
+        labels = sitk.RelabelComponent(sitk.ConnectedComponent(self.to_image(), fully_connected))
+        return PackedMask.from_array(sitk.GetArrayViewFromImage(labels) == 1, self.geometry)
+
+    def to_rle(self):
+        """
+        Run lengths of the mask in C order, starting with a (possibly empty) run of zeros.
+
+        Returns:
+            np.ndarray: int64 run lengths alternating outside/inside
+        """
+        flat = self.to_array().ravel()
+        changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+        edges = np.concatenate(([0], changes, [flat.size]))
+        runs = np.diff(edges)
+        if flat.size and flat[0]:
+            runs = np.concatenate(([0], runs))
+        return runs.astype(np.int64)
+
+    @classmethod
+    def from_rle(cls, runs, shape, geometry=None):
+        """Inverse of to_rle()."""
+        runs = np.asarray(runs, dtype=np.int64)
+        values = np.zeros(len(runs), dtype=bool)
+        values[1::2] = True
+        flat = np.repeat(values, runs)
+        if flat.size != int(np.prod(shape)):
+            raise ValueError(f"Run lengths cover {flat.size} voxels, shape {tuple(shape)} has {int(np.prod(shape))}")
+        return cls.from_array(flat.reshape(shape), geometry)
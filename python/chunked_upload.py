@@ -0,0 +1,239 @@
+# Resumable chunked uploads written directly to the upload folder, with per-chunk checksums.
+#-----------------------------------
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent PUTs for the same upload are not guarded
+    fcntl = None
+
+from .instrumentation import span
+
+COPY_BUFFER_SIZE = 1024 * 1024
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _meta_path(upload_dir, upload_id):
+    return os.path.join(upload_dir, f"{upload_id}.upload.json")
+
+
+def _part_path(upload_dir, upload_id):
+    return os.path.join(upload_dir, f"{upload_id}.part")
+
+
+def _save_meta(upload_dir, meta):
+    # Write-then-rename so a crash never leaves a half-written offset behind
+    path = _meta_path(upload_dir, meta['upload_id'])
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, path)
+
+
+def init_upload(upload_dir, filename, size, service=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Start a resumable upload.
+
+    Args:
+        upload_dir: Folder the file is assembled in (UPLOAD_FOLDER)
+        filename: Sanitized name the finished file gets
+        size: Total size in bytes
+        service: Processing to run on finalize (see CHUNKED_UPLOAD_SERVICES in app.py)
+        chunk_size: Suggested chunk size for the client
+
+    Returns:
+        dict: The upload record (upload_id, filename, size, offset, chunk_size, ...)
+    """
+    os.makedirs(upload_dir, exist_ok=True)
+    meta = {
+        'upload_id': uuid.uuid4().hex,
+        'filename': filename,
+        'size': int(size),
+        'offset': 0,
+        'chunk_size': chunk_size,
+        'chunks': 0,
+        'service': service,
+        'created': time.time()
+    }
+    open(_part_path(upload_dir, meta['upload_id']), 'wb').close()
+    _save_meta(upload_dir, meta)
+    return meta
+
+
+def get_upload(upload_dir, upload_id):
+    """Load an upload record, or None if the ID is unknown."""
+    if not UPLOAD_ID_PATTERN.match(upload_id or ''):
+        return None
+    try:
+        with open(_meta_path(upload_dir, upload_id), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_chunk(upload_dir, upload_id, offset, stream, length, sha256=None, total=None):
+    """
+    Append one chunk from a request stream straight into the partial file.
+
+    The chunk must start at the upload's verified offset. It is hashed while
+    it is written; on a checksum or length mismatch (or a dropped connection)
+    the file is truncated back so the client can resend the same chunk.
+
+    Args:
+        upload_dir: Upload folder
+        upload_id: Upload ID from init_upload
+        offset: Byte offset the chunk starts at
+        stream: File-like object to read the chunk from (request.stream)
+        length: Number of bytes in the chunk
+        sha256: Expected hex SHA-256 of the chunk (optional but recommended)
+        total: Total file size the client declared for this chunk (Content-Range), checked against init
+
+    Returns:
+        dict: The updated upload record, or {'error', 'status', 'offset'} on failure
+    """
+    meta = get_upload(upload_dir, upload_id)
+    if meta is None:
+        return {'error': 'Unknown upload', 'status': 404}
+    if total is not None and total != meta['size']:
+        return {'error': f"Content-Range total {total} does not match the upload size {meta['size']}",
+                'status': 416, 'offset': meta['offset']}
+    if offset != meta['offset']:
+        return {'error': f"Chunk offset {offset} does not match upload offset {meta['offset']}",
+                'status': 409, 'offset': meta['offset']}
+    if length is None or length <= 0 or offset + length > meta['size']:
+        return {'error': 'Chunk length missing or past the end of the file', 'status': 400, 'offset': meta['offset']}
+
+    with open(_part_path(upload_dir, upload_id), 'r+b') as f:
+        if fcntl is not None:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return {'error': 'Another chunk is being written to this upload', 'status': 409, 'offset': meta['offset']}
+            # A chunk may have completed between reading the record and taking the lock
+            meta = get_upload(upload_dir, upload_id)
+            if meta is None or offset != meta['offset']:
+                return {'error': 'Upload changed while waiting for the lock', 'status': 409,
+                        'offset': meta['offset'] if meta else None}
+
+        # Drop anything past the verified offset (left over from an interrupted chunk)
+        f.truncate(offset)
+        f.seek(offset)
+        digest = hashlib.sha256()
+        written = 0
+        try:
+            with span('chunked_upload', 'write_chunk'):
+                while written < length:
+                    block = stream.read(min(COPY_BUFFER_SIZE, length - written))
+                    if not block:
+                        break
+                    digest.update(block)
+                    f.write(block)
+                    written += len(block)
+        except Exception as e:
+            f.truncate(offset)
+            return {'error': f"Chunk transfer interrupted: {str(e)}", 'status': 400, 'offset': offset}
+
+        if written != length:
+            f.truncate(offset)
+            return {'error': f"Received {written} of {length} bytes", 'status': 400, 'offset': offset}
+        if sha256 and digest.hexdigest() != sha256.lower():
+            f.truncate(offset)
+            return {'error': 'Chunk checksum mismatch', 'status': 422, 'offset': offset}
+
+        f.flush()
+        os.fsync(f.fileno())
+
+    meta['offset'] = offset + written
+    meta['chunks'] += 1
+    _save_meta(upload_dir, meta)
+    return meta
+
+
+def _claim_name(upload_dir, filename, upload_id):
+    """
+    Reserve a path in upload_dir that no other file uses: filename itself if it
+    is free, otherwise prefixed with the upload ID. Returns None if both are taken.
+    """
+    for name in (filename, f"{upload_id}_{filename}"):
+        path = os.path.join(upload_dir, name)
+        try:
+            # O_EXCL makes the check and the creation one step, so two finalizes cannot pick the same name
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return path
+        except FileExistsError:
+            continue
+    return None
+
+
+def finalize_upload(upload_dir, upload_id, sha256=None):
+    """
+    Move a complete upload to its final name in upload_dir.
+
+    The rename happens in place, so the data is never copied again. An
+    existing file of the same name is never replaced: the upload then gets
+    its ID as a name prefix (see 'filename' in the returned record).
+
+    Returns:
+        dict: The upload record with 'path' set, or {'error', 'status'} on failure
+    """
+    meta = get_upload(upload_dir, upload_id)
+    if meta is None:
+        return {'error': 'Unknown upload', 'status': 404}
+    if meta['offset'] != meta['size']:
+        return {'error': f"Upload incomplete: {meta['offset']} of {meta['size']} bytes received",
+                'status': 409, 'offset': meta['offset']}
+
+    part_path = _part_path(upload_dir, upload_id)
+    if sha256:
+        digest = hashlib.sha256()
+        with span('chunked_upload', 'verify'), open(part_path, 'rb') as f:
+            for block in iter(lambda: f.read(COPY_BUFFER_SIZE), b''):
+                digest.update(block)
+        if digest.hexdigest() != sha256.lower():
+            return {'error': 'File checksum mismatch', 'status': 422}
+
+    path = _claim_name(upload_dir, meta['filename'], upload_id)
+    if path is None:
+        return {'error': f"A file named {meta['filename']} already exists", 'status': 409}
+    try:
+        os.replace(part_path, path)
+    except OSError:
+        os.remove(path)
+        raise
+    os.remove(_meta_path(upload_dir, upload_id))
+    meta['filename'] = os.path.basename(path)
+    meta['path'] = path
+    return meta
+
+
+def abort_upload(upload_dir, upload_id):
+    """Delete a partial upload. Returns False if the ID is unknown."""
+    if get_upload(upload_dir, upload_id) is None:
+        return False
+    for path in (_part_path(upload_dir, upload_id), _meta_path(upload_dir, upload_id)):
+        if os.path.exists(path):
+            os.remove(path)
+    return True
+
+
+def remove_stale_uploads(upload_dir, max_age_seconds):
+    """Delete partial uploads that have not been touched for max_age_seconds. Returns the number removed."""
+    removed = 0
+    cutoff = time.time() - max_age_seconds
+    if not os.path.isdir(upload_dir):
+        return removed
+    for name in os.listdir(upload_dir):
+        if not name.endswith('.upload.json'):
+            continue
+        upload_id = name[:-len('.upload.json')]
+        part_path = _part_path(upload_dir, upload_id)
+        last_touched = os.path.getmtime(part_path) if os.path.exists(part_path) else 0
+        if last_touched < cutoff and abort_upload(upload_dir, upload_id):
+            removed += 1
+    return removed
@@ -0,0 +1,422 @@
+# Transfer-syntax-aware decoding of DICOM pixel data: each file is routed to the fastest decoder
+# available for its syntax, files and frames are decoded on a worker pool, and throughput is
+# recorded per syntax.
+#-----------------------------------
+import importlib.util
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.encaps import encapsulate
+
+from .instrumentation import span
+from .rendering import dataset_render_params, sitk_render_params
+
+try:
+    from pydicom.encaps import get_frame
+except ImportError:  # pydicom < 3
+    from pydicom.encaps import generate_pixel_data_frame
+
+    def get_frame(buffer, index, number_of_frames=None):
+        return next(islice(generate_pixel_data_frame(buffer, number_of_frames), index, None))
+
+try:
+    from prometheus_client import Counter
+except ImportError:  # prometheus_client ships with prometheus_flask_exporter; stats are still kept in memory
+    Counter = None
+
+DEFAULT_DECODE_WORKERS = min(8, os.cpu_count() or 1)
+
+IMPLICIT_VR_LITTLE_ENDIAN = '1.2.840.10008.1.2'
+PIXEL_DATA_TAG = 0x7FE00010
+ITEM_TAG = (0xFFFE, 0xE000)
+
+# Transfer syntax UID -> (name, family)
+TRANSFER_SYNTAXES = {
+    '1.2.840.10008.1.2': ('implicit_vr_little_endian', 'native'),
+    '1.2.840.10008.1.2.1': ('explicit_vr_little_endian', 'native'),
+    '1.2.840.10008.1.2.2': ('explicit_vr_big_endian', 'native'),
+    '1.2.840.10008.1.2.1.99': ('deflated_explicit_vr_little_endian', 'deflated'),
+    '1.2.840.10008.1.2.5': ('rle_lossless', 'rle'),
+    '1.2.840.10008.1.2.4.50': ('jpeg_baseline', 'jpeg'),
+    '1.2.840.10008.1.2.4.51': ('jpeg_extended', 'jpeg'),
+    '1.2.840.10008.1.2.4.57': ('jpeg_lossless', 'jpeg_lossless'),
+    '1.2.840.10008.1.2.4.70': ('jpeg_lossless_sv1', 'jpeg_lossless'),
+    '1.2.840.10008.1.2.4.80': ('jpeg_ls_lossless', 'jpeg_ls'),
+    '1.2.840.10008.1.2.4.81': ('jpeg_ls_near_lossless', 'jpeg_ls'),
+    '1.2.840.10008.1.2.4.90': ('jpeg2000_lossless', 'jpeg2000'),
+    '1.2.840.10008.1.2.4.91': ('jpeg2000', 'jpeg2000'),
+    '1.2.840.10008.1.2.4.201': ('htj2k_lossless', 'jpeg2000'),
+    '1.2.840.10008.1.2.4.202': ('htj2k_lossless_rpcl', 'jpeg2000'),
+    '1.2.840.10008.1.2.4.203': ('htj2k', 'jpeg2000')
+}
+
+NATIVE_BYTE_ORDER = {
+    '1.2.840.10008.1.2': '<',
+    '1.2.840.10008.1.2.1': '<',
+    '1.2.840.10008.1.2.2': '>'
+}
+
+# Decoders per syntax family, fastest first. 'simpleitk' (GDCM) decodes whole files outside the GIL,
+# so it scales across the worker pool; the pydicom plugins also decode single frames.
+DECODER_PREFERENCE = {
+    'native': ('pydicom',),
+    'deflated': ('pydicom',),
+    'rle': ('pylibjpeg', 'pydicom', 'simpleitk'),
+    'jpeg': ('pylibjpeg', 'gdcm', 'simpleitk', 'pillow'),
+    'jpeg_lossless': ('pylibjpeg', 'gdcm', 'simpleitk'),
+    'jpeg_ls': ('pylibjpeg', 'gdcm', 'simpleitk'),
+    'jpeg2000': ('pylibjpeg', 'gdcm', 'simpleitk', 'pillow')
+}
+
+# Optional modules each decoder needs for a family
+DECODER_MODULES = {
+    ('pylibjpeg', 'rle'): ('pylibjpeg', 'rle'),
+    ('pylibjpeg', 'jpeg'): ('pylibjpeg', 'libjpeg'),
+    ('pylibjpeg', 'jpeg_lossless'): ('pylibjpeg', 'libjpeg'),
+    ('pylibjpeg', 'jpeg_ls'): ('pylibjpeg', 'libjpeg'),
+    ('pylibjpeg', 'jpeg2000'): ('pylibjpeg', 'openjpeg'),
+    ('gdcm', None): ('gdcm',),
+    ('simpleitk', None): ('SimpleITK',)
+}
+
+# Attributes copied to the one-frame dataset used to decode a compressed frame
+PIXEL_MODULE_KEYWORDS = ('Rows', 'Columns', 'SamplesPerPixel', 'BitsAllocated', 'BitsStored', 'HighBit',
+                         'PixelRepresentation', 'PhotometricInterpretation', 'PlanarConfiguration')
+
+DECODED_BYTES = Counter(
+    'aortec_decoded_bytes_total', 'Decoded DICOM pixel data', ['transfer_syntax', 'decoder']
+) if Counter is not None else None
+DECODE_SECONDS = Counter(
+    'aortec_decode_seconds_total', 'Time spent decoding DICOM pixel data', ['transfer_syntax', 'decoder']
+) if Counter is not None else None
+DECODED_FRAMES = Counter(
+    'aortec_decoded_frames_total', 'Decoded DICOM frames', ['transfer_syntax', 'decoder']
+) if Counter is not None else None
+
+
+class DecodeStats:
+    """Per transfer syntax and decoder: files, frames, bytes in/out, time and failures."""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, syntax_name, decoder, frames, compressed_bytes, decoded_bytes, seconds):
+        with self._lock:
+            entry = self._stats.setdefault((syntax_name, decoder), {
+                'files': 0, 'frames': 0, 'compressed_bytes': 0, 'decoded_bytes': 0, 'seconds': 0.0, 'failures': 0})
+            entry['files'] += 1
+            entry['frames'] += frames
+            entry['compressed_bytes'] += compressed_bytes
+            entry['decoded_bytes'] += decoded_bytes
+            entry['seconds'] += seconds
+        if DECODED_BYTES is not None:
+            DECODED_BYTES.labels(transfer_syntax=syntax_name, decoder=decoder).inc(decoded_bytes)
+            DECODE_SECONDS.labels(transfer_syntax=syntax_name, decoder=decoder).inc(seconds)
+            DECODED_FRAMES.labels(transfer_syntax=syntax_name, decoder=decoder).inc(frames)
+
+    def record_failure(self, syntax_name, decoder):
+        with self._lock:
+            entry = self._stats.setdefault((syntax_name, decoder), {
+                'files': 0, 'frames': 0, 'compressed_bytes': 0, 'decoded_bytes': 0, 'seconds': 0.0, 'failures': 0})
+            entry['failures'] += 1
+
+    def snapshot(self):
+        """
+        Returns:
+            list: One dict per (transfer_syntax, decoder) with totals and
+                  frames_per_second / decoded_mb_per_second throughput
+        """
+        with self._lock:
+            items = [(key, dict(entry)) for key, entry in self._stats.items()]
+        result = []
+        for (syntax_name, decoder), entry in sorted(items):
+            seconds = entry['seconds']
+            entry.update({
+                'transfer_syntax': syntax_name,
+                'decoder': decoder,
+                'seconds': round(seconds, 4),
+                'frames_per_second': round(entry['frames'] / seconds, 1) if seconds else None,
+                'decoded_mb_per_second': round(entry['decoded_bytes'] / seconds / 1e6, 1) if seconds else None
+            })
+            result.append(entry)
+        return result
+
+
+STATS = DecodeStats()
+
+
+def _module_available(name):
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def _decoder_available(decoder, family):
+    if decoder == 'pydicom':
+        return True
+    if decoder == 'pillow':
+        from PIL import features
+        return features.check('jpg_2000' if family == 'jpeg2000' else 'jpg')
+    modules = DECODER_MODULES.get((decoder, family)) or DECODER_MODULES.get((decoder, None), ())
+    return bool(modules) and all(_module_available(m) for m in modules)
+
+
+_available_cache = {}
+
+
+def available_decoders(family):
+    """Installed decoders for a syntax family, fastest first (checked once per family)."""
+    if family not in _available_cache:
+        _available_cache[family] = [d for d in DECODER_PREFERENCE.get(family, ('pydicom',))
+                                    if _decoder_available(d, family)] or ['pydicom']
+    return _available_cache[family]
+
+
+def transfer_syntax_of(path):
+    """TransferSyntaxUID from the file meta information only (implicit VR little endian if there is none)."""
+    try:
+        meta = pydicom.filereader.read_file_meta_info(path)
+        syntax = meta.get('TransferSyntaxUID')
+        return str(syntax) if syntax else IMPLICIT_VR_LITTLE_ENDIAN
+    except Exception:
+        return IMPLICIT_VR_LITTLE_ENDIAN
+
+
+def syntax_info(uid):
+    """(name, family) of a transfer syntax; unknown syntaxes are left to pydicom."""
+    return TRANSFER_SYNTAXES.get(uid, (uid, 'other'))
+
+
+def _pydicom_pixels(ds, decoder):
+    """ds.pixel_array decoded by a specific pydicom plugin ('pydicom' lets pydicom choose)."""
+    if decoder != 'pydicom':
+        if hasattr(ds, 'pixel_array_options'):  # pydicom >= 3
+            ds.pixel_array_options(decoding_plugin=decoder)
+        else:
+            ds.convert_pixel_data(handler_name=decoder)
+    return ds.pixel_array
+
+
+def _decode_with_simpleitk(path):
+    import SimpleITK as sitk
+    image = sitk.ReadImage(path)
+    pixels = sitk.GetArrayFromImage(image)
+    if pixels.ndim >= 3 and pixels.shape[0] == 1:
+        pixels = pixels[0]
+    params = sitk_render_params(image)
+    params['samples'] = image.GetNumberOfComponentsPerPixel()
+    return pixels, params
+
+
+def _decode_with_pydicom(path, decoder):
+    ds = pydicom.dcmread(path, force=True)
+    if 'PixelData' not in ds:
+        raise ValueError(f"File does not contain pixel data: {path}")
+    pixels = _pydicom_pixels(ds, decoder)
+    params = dataset_render_params(ds)
+    params['samples'] = int(ds.get('SamplesPerPixel', 1) or 1)
+    return pixels, params
+
+
+def decode_file(path, stored_values=False):
+    """
+    Decode every frame of a DICOM file with the fastest decoder available for its transfer syntax.
+
+    Decoders are tried in DECODER_PREFERENCE order until one succeeds.
+    SimpleITK returns rescaled (HU) values; stored_values=True skips it.
+
+    Returns:
+        dict: pixels (frames x rows x columns [x samples], or rows x columns),
+              slope, intercept, dicom_window, invert (for rendering.render()),
+              samples, transfer_syntax and decoder
+    """
+    uid = transfer_syntax_of(path)
+    syntax_name, family = syntax_info(uid)
+    compressed_bytes = os.path.getsize(path)
+    last_error = None
+
+    decoders = [d for d in available_decoders(family) if not (stored_values and d == 'simpleitk')] or ['pydicom']
+    for decoder in decoders:
+        start = time.perf_counter()
+        try:
+            with span('dicom_decoding', f"decode_{family}"):
+                if decoder == 'simpleitk':
+                    pixels, params = _decode_with_simpleitk(path)
+                else:
+                    pixels, params = _decode_with_pydicom(path, decoder)
+        except Exception as e:
+            STATS.record_failure(syntax_name, decoder)
+            print(f"[DEBUG] {decoder} could not decode {os.path.basename(path)} ({syntax_name}): {str(e)}")
+            last_error = e
+            continue
+
+        colour = params['samples'] > 1
+        frames = pixels.shape[0] if pixels.ndim == (4 if colour else 3) else 1
+        STATS.record(syntax_name, decoder, frames, compressed_bytes, pixels.nbytes, time.perf_counter() - start)
+        params.update({'pixels': pixels, 'transfer_syntax': uid, 'decoder': decoder})
+        return params
+
+    raise last_error or ValueError(f"No decoder available for {syntax_name}")
+
+
+def decode_files(paths, max_workers=DEFAULT_DECODE_WORKERS):
+    """
+    Decode files on a thread pool.
+
+    Yields:
+        tuple: (path, decode_file() result or the exception raised), in input order
+    """
+    def safe_decode(path):
+        try:
+            return decode_file(path)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        yield from zip(paths, pool.map(safe_decode, paths))
+
+
+def _raw_pixel_element(ds):
+    """The PixelData element of a dataset read with defer_size, without loading its value."""
+    try:
+        return ds.get_item(PIXEL_DATA_TAG, keep_deferred=True)
+    except TypeError:  # pydicom < 3 has no keep_deferred and get_item() would load the value
+        return ds._dict.get(PIXEL_DATA_TAG)
+
+
+def _read_native_frame(f, ds, value_offset, index, syntax):
+    rows, columns = int(ds.Rows), int(ds.Columns)
+    samples = int(ds.get('SamplesPerPixel', 1) or 1)
+    bits = int(ds.BitsAllocated)
+    frame_bytes = rows * columns * samples * bits // 8
+
+    f.seek(value_offset + index * frame_bytes)
+    data = f.read(frame_bytes)
+    if len(data) != frame_bytes:
+        raise ValueError(f"Pixel data ends before frame {index + 1}")
+
+    signed = int(ds.get('PixelRepresentation', 0) or 0) == 1
+    dtype = np.dtype(f"{NATIVE_BYTE_ORDER[syntax]}{'i' if signed else 'u'}{bits // 8}")
+    pixels = np.frombuffer(data, dtype).astype(dtype.newbyteorder('='), copy=False)
+
+    bits_stored = int(ds.get('BitsStored', bits) or bits)
+    if signed and bits_stored < bits:
+        # Sign-extend values stored in fewer bits than allocated (e.g. 12 of 16)
+        shift = bits - bits_stored
+        pixels = (pixels << shift) >> shift
+
+    if samples == 1:
+        return pixels.reshape(rows, columns)
+    if int(ds.get('PlanarConfiguration', 0) or 0) == 1:
+        return pixels.reshape(samples, rows, columns).transpose(1, 2, 0)
+    return pixels.reshape(rows, columns, samples)
+
+
+def _read_encapsulated_frame(f, value_offset, index, frames):
+    """
+    Bytes of one compressed frame.
+
+    With a Basic Offset Table only that frame's fragments are read from
+    disk. Without one, the fragments are read and walked up to the frame.
+    """
+    f.seek(value_offset)
+    group, element, length = struct.unpack('<HHI', f.read(8))
+    if (group, element) != ITEM_TAG:
+        raise ValueError("Malformed encapsulated pixel data")
+
+    if length and frames > 1:
+        offsets = struct.unpack(f'<{length // 4}I', f.read(length))
+        first_fragment = value_offset + 8 + length
+        f.seek(first_fragment + offsets[index])
+        if index + 1 < len(offsets):
+            chunk = f.read(offsets[index + 1] - offsets[index])
+        else:
+            chunk = f.read()
+        # Re-wrap the frame's fragments behind an empty offset table
+        return get_frame(struct.pack('<HHI', *ITEM_TAG, 0) + chunk, 0, number_of_frames=1)
+
+    f.seek(value_offset)
+    return get_frame(f.read(), index, number_of_frames=frames)
+
+
+def _decode_encapsulated(ds, fragment, syntax):
+    """Decode one compressed frame through a one-frame copy of the dataset's pixel module."""
+    single = Dataset()
+    single.file_meta = FileMetaDataset()
+    single.file_meta.TransferSyntaxUID = syntax
+    for keyword in PIXEL_MODULE_KEYWORDS:
+        if keyword in ds:
+            setattr(single, keyword, ds[keyword].value)
+    single.NumberOfFrames = 1
+    single.PixelData = encapsulate([fragment])
+    single['PixelData'].VR = 'OB'
+
+    syntax_name, family = syntax_info(syntax)
+    last_error = None
+    # SimpleITK only reads whole files, so frames go through the pydicom plugins
+    for decoder in [d for d in available_decoders(family) if d != 'simpleitk'] or ['pydicom']:
+        start = time.perf_counter()
+        try:
+            pixels = _pydicom_pixels(single, decoder)
+        except Exception as e:
+            STATS.record_failure(syntax_name, decoder)
+            last_error = e
+            continue
+        STATS.record(syntax_name, decoder, 1, len(fragment), pixels.nbytes, time.perf_counter() - start)
+        return pixels
+    raise last_error
+
+
+def decode_frame(path, index):
+    """
+    Decode one frame (0-based) of a DICOM instance without decoding the others.
+
+    Uncompressed frames are read directly from their offset in the file;
+    compressed frames have only their own fragments decoded, by the fastest
+    pydicom plugin for the syntax. Anything else (e.g. 1-bit or deflated
+    data) falls back to decode_file() and picks the frame.
+
+    Returns:
+        np.ndarray: Stored pixel values of the frame (rows x columns [x samples])
+    """
+    ds = pydicom.dcmread(path, defer_size=1024, force=True)
+    frames = int(ds.get('NumberOfFrames', 1) or 1)
+    if not 0 <= index < frames:
+        raise IndexError(f"Frame {index + 1} out of range (1-{frames})")
+
+    file_meta = getattr(ds, 'file_meta', None)
+    syntax = str(file_meta.get('TransferSyntaxUID') or IMPLICIT_VR_LITTLE_ENDIAN) if file_meta is not None else IMPLICIT_VR_LITTLE_ENDIAN
+    element = _raw_pixel_element(ds)
+    bits = int(ds.get('BitsAllocated', 0) or 0)
+    try:
+        if element is not None and element.value_tell is not None:
+            with open(path, 'rb') as f:
+                if syntax in NATIVE_BYTE_ORDER and bits in (8, 16, 32):
+                    start = time.perf_counter()
+                    pixels = _read_native_frame(f, ds, element.value_tell, index, syntax)
+                    STATS.record(syntax_info(syntax)[0], 'pydicom', 1, pixels.nbytes, pixels.nbytes,
+                                 time.perf_counter() - start)
+                    return pixels
+                if syntax not in NATIVE_BYTE_ORDER and element.length == 0xFFFFFFFF:
+                    fragment = _read_encapsulated_frame(f, element.value_tell, index, frames)
+                    return _decode_encapsulated(ds, fragment, syntax)
+    except (ValueError, struct.error) as e:
+        print(f"[DEBUG] Per-frame decoding of {path} failed ({str(e)}), decoding all frames")
+
+    pixels = decode_file(path, stored_values=True)['pixels']
+    return pixels[index] if frames > 1 else pixels
+
+
+def decode_frames(path, indices, max_workers=DEFAULT_DECODE_WORKERS):
+    """Decode several frames of one instance on a thread pool; returns the arrays in the order of indices."""
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(lambda index: decode_frame(path, index), indices))
@@ -6,6 +6,11 @@ import pydicom
 import numpy as np
 from PIL import Image
 import SimpleITK as sitk
+from .instrumentation import span
+from .rendering import render
+from .dicom_decoding import (decode_file, decode_files, available_decoders, syntax_info, transfer_syntax_of,
+                             DEFAULT_DECODE_WORKERS)
+from concurrent.futures import ThreadPoolExecutor
 
 def read_dicom_folder(folder_path):
     """Reads all DICOM files from a folder."""
@@ -24,31 +29,41 @@ def extract_zip(zip_path, extract_to):
         zip_ref.extractall(extract_to)
     return extract_to
 
-def convert_dicom_to_images(dicom_files, output_folder, image_format="jpg"):
-    """Converts a list of DICOM files to images."""
+def convert_dicom_to_images(dicom_files, output_folder, image_format="jpg", window=None,
+                            max_workers=DEFAULT_DECODE_WORKERS):
+    """
+    Converts a list of DICOM files to images, windowed for display (see rendering.get_window).
+    Files are decoded on a pool of max_workers threads.
+    """
     os.makedirs(output_folder, exist_ok=True)
-    for dicom_file in dicom_files:
+    for dicom_file, decoded in decode_files(dicom_files, max_workers):
         try:
-            ds = pydicom.dcmread(dicom_file)
-            if not hasattr(ds, "pixel_array"):
-                raise ValueError(f"File {dicom_file} has no pixel data.")
-            pixel_array = ds.pixel_array
-            image = Image.fromarray((pixel_array / np.max(pixel_array) * 255).astype(np.uint8))
+            if isinstance(decoded, Exception):
+                raise decoded
+            with span('dicom_processor', 'normalize'):
+                if decoded['samples'] > 1:
+                    image = Image.fromarray(decoded['pixels'].astype(np.uint8, copy=False))
+                else:
+                    image = Image.fromarray(render(decoded['pixels'], window, decoded['slope'], decoded['intercept'],
+                                                   decoded['dicom_window'], decoded['invert']))
             output_file = os.path.join(
                 output_folder, os.path.splitext(os.path.basename(dicom_file))[0] + f".{image_format}"
             )
-            image.save(output_file)
+            with span('dicom_processor', 'encode'):
+                image.save(output_file)
         except Exception as e:
             print(f"Error converting {dicom_file}: {e}")
     return output_folder
 
-def process_dicom_file(filepath, output_path):
+def process_dicom_file(filepath, output_path, window=None):
     """
     Process a DICOM file and save it as an image with improved error handling.
     
     Args:
         filepath: Path to the DICOM file (with or without extension)
         output_path: Path to save the processed image
+        window: Display window: a preset ('abdomen', 'angio', 'bone'), (center, width)
+                in HU, or None for the file's own window (min..max if it has none)
     """
     # Import PIL at the top level to ensure it's available throughout the function
     from PIL import Image
@@ -62,82 +77,35 @@ def process_dicom_file(filepath, output_path):
         file_size = os.path.getsize(filepath)
         print(f"Processing file: {filepath}, Size: {file_size} bytes")
         
-        # Try to read the file as DICOM using SimpleITK
-        try:
-            import SimpleITK as sitk
-            dicom_image = sitk.ReadImage(filepath)
-            
-            # Get and print image properties for debugging
-            size = dicom_image.GetSize()
-            spacing = dicom_image.GetSpacing()
-            print(f"DICOM image loaded. Size: {size}, Spacing: {spacing}")
-            
-            # Extract the image data
-            dicom_array = sitk.GetArrayFromImage(dicom_image)
-            
-            # Check array shape and content
-            print(f"Array shape: {dicom_array.shape}, Min: {dicom_array.min()}, Max: {dicom_array.max()}")
-            
-            if dicom_array.min() == dicom_array.max():
-                raise ValueError("Image has no contrast (min value equals max value)")
-                
-            # Normalize to 0-255 for standard image format
-            if dicom_array.max() != dicom_array.min():  # Avoid division by zero
-                dicom_array = ((dicom_array - dicom_array.min()) / 
-                            (dicom_array.max() - dicom_array.min()) * 255).astype(np.uint8)
-            else:
-                dicom_array = np.zeros_like(dicom_array, dtype=np.uint8)
-            
-            # Save as image
-            if len(dicom_array.shape) > 2:  # If it's 3D data, take the middle slice
-                print(f"3D DICOM with {dicom_array.shape[0]} slices, using middle slice")
-                middle_slice = dicom_array.shape[0] // 2
-                img = Image.fromarray(dicom_array[middle_slice])
-            else:
-                img = Image.fromarray(dicom_array)
-            
-            # Create output directory if it doesn't exist
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            
-            img.save(output_path)
-            print(f"Image saved to {output_path}")
-            return output_path
-            
-        except Exception as sitk_error:
-            print(f"SimpleITK failed: {str(sitk_error)}")
-            
-            # Fallback to pydicom
-            print("Trying pydicom as fallback...")
-            import pydicom
-            
-            # Force reading even if issues
-            dicom_data = pydicom.dcmread(filepath, force=True)
-            
-            # Check if pixel data exists
-            if not hasattr(dicom_data, 'PixelData'):
-                raise ValueError(f"File does not contain pixel data: {filepath}")
-                
-            # Convert to image
-            pixel_array = dicom_data.pixel_array
-            
-            # Check array shape and content
-            print(f"Array shape: {pixel_array.shape}, Min: {pixel_array.min()}, Max: {pixel_array.max()}")
-            
-            # Normalize to 0-255 for standard image format
-            if pixel_array.max() != pixel_array.min():  # Avoid division by zero
-                pixel_array = ((pixel_array - pixel_array.min()) / 
-                             (pixel_array.max() - pixel_array.min()) * 255).astype(np.uint8)
+        # Decode with the fastest decoder for the file's transfer syntax (SimpleITK, pydicom plugins, ...)
+        with span('dicom_processor', 'dicom_read'):
+            decoded = decode_file(filepath)
+            dicom_array = decoded['pixels']
+        
+        # Check array shape and content
+        print(f"Array shape: {dicom_array.shape}, Min: {dicom_array.min()}, Max: {dicom_array.max()}, "
+              f"decoded by {decoded['decoder']}")
+        
+        # If it's 3D data (multi-frame), take the middle slice
+        if dicom_array.ndim > (3 if decoded['samples'] > 1 else 2):
+            print(f"3D DICOM with {dicom_array.shape[0]} slices, using middle slice")
+            dicom_array = dicom_array[dicom_array.shape[0] // 2]
+        
+        # Convert to HU and window to 0-255 for standard image format (colour images are kept as they are)
+        with span('dicom_processor', 'normalize'):
+            if decoded['samples'] > 1:
+                img = Image.fromarray(dicom_array.astype(np.uint8, copy=False))
             else:
-                pixel_array = np.zeros_like(pixel_array, dtype=np.uint8)
-            
-            # Create output directory if it doesn't exist
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            
-            # Save as image
-            img = Image.fromarray(pixel_array)
+                img = Image.fromarray(render(dicom_array, window, decoded['slope'], decoded['intercept'],
+                                             decoded['dicom_window'], decoded['invert']))
+        
+        # Create output directory if it doesn't exist
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        
+        with span('dicom_processor', 'encode'):
             img.save(output_path)
-            print(f"Image saved to {output_path} using pydicom")
-            return output_path
+        print(f"Image saved to {output_path}")
+        return output_path
     
     except Exception as e:
         # Create detailed error message
@@ -167,43 +135,50 @@ def process_dicom_file(filepath, output_path):
             raise Exception(error_message)
     
 
-def process_zip_file(zip_filepath, output_folder):
+def process_zip_file(zip_filepath, output_folder, max_workers=DEFAULT_DECODE_WORKERS):
     """
     Extract files from a ZIP file and process them as DICOM files.
     
     Args:
         zip_filepath: Path to the ZIP file containing DICOM files
         output_folder: Path to save the processed images
+        max_workers: Files decoded and converted in parallel
         
     Returns:
         List of paths to the processed images
     """
     import zipfile
     import tempfile
+    import shutil
     import os
     
     # Create a temporary directory for extraction
     temp_dir = tempfile.mkdtemp()
     
-    # Extract ZIP file
-    with zipfile.ZipFile(zip_filepath, 'r') as zip_ref:
-        zip_ref.extractall(temp_dir)
-    
-    # Process all files in the extracted folder as potential DICOM files
-    processed_files = []
-    for root, _, files in os.walk(temp_dir):
-        for file in files:
-            file_path = os.path.join(root, file)
-            output_path = os.path.join(output_folder, f"{file}.jpg")
-            
+    try:
+        # Extract ZIP file
+        with span('dicom_processor', 'zip_extract'), zipfile.ZipFile(zip_filepath, 'r') as zip_ref:
+            zip_ref.extractall(temp_dir)
+        
+        # Process all files in the extracted folder as potential DICOM files
+        jobs = [(os.path.join(root, file), os.path.join(output_folder, f"{file}.jpg"))
+                for root, _, files in os.walk(temp_dir) for file in files]
+        
+        def convert(job):
+            file_path, output_path = job
             try:
                 # Try to process as DICOM file
-                process_dicom_file(file_path, output_path)
-                processed_files.append(output_path)
+                return process_dicom_file(file_path, output_path)
             except Exception as e:
-                print(f"Error processing {file}: {str(e)}")
-    
-    return processed_files
+                print(f"Error processing {os.path.basename(file_path)}: {str(e)}")
+                return None
+        
+        # Decoding (compressed syntaxes especially) dominates, so files are converted on a worker pool
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return [path for path in pool.map(convert, jobs) if path]
+    finally:
+        # Extracted files are no longer needed once converted
+        shutil.rmtree(temp_dir, ignore_errors=True)
 
 def inspect_dicom_file(filepath):
     """
@@ -214,8 +189,6 @@ def inspect_dicom_file(filepath):
         filepath: Path to the DICOM file
     """
     try:
-        import pydicom
-        
         # Try to read the file
         print(f"Attempting to read: {filepath}")
         try:
@@ -227,6 +200,8 @@ def inspect_dicom_file(filepath):
         # Basic file info
         print(f"File successfully read with pydicom")
         print(f"Transfer Syntax: {ds.file_meta.TransferSyntaxUID if hasattr(ds, 'file_meta') else 'Not available'}")
+        syntax_name, family = syntax_info(transfer_syntax_of(filepath))
+        print(f"Decoders for {syntax_name} (fastest first): {', '.join(available_decoders(family))}")
         
         # Check for pixel data
         if hasattr(ds, 'PixelData'):
@@ -261,8 +236,13 @@ def inspect_dicom_file(filepath):
         print(f"Inspection error: {str(e)}")
 
 
-def create_zip_archive(files_to_zip, output_zip_path):
-    """Create a ZIP archive with improved error handling."""
+def create_zip_archive(files_to_zip, output_zip_path, base_dir=None):
+    """
+    Create a ZIP archive with improved error handling.
+
+    Files are stored under their basename, or under their path relative to
+    base_dir when given (so same-named files from different series don't collide).
+    """
     try:
         # Ensure output directory exists
         os.makedirs(os.path.dirname(output_zip_path), exist_ok=True)
@@ -271,8 +251,9 @@ def create_zip_archive(files_to_zip, output_zip_path):
         with zipfile.ZipFile(output_zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
             for file in files_to_zip:
                 if os.path.exists(file):
-                    # Add file to the zip with just its basename
-                    zipf.write(file, os.path.basename(file))
+                    # Add file to the zip with just its basename (or its path under base_dir)
+                    arcname = os.path.relpath(file, base_dir) if base_dir else os.path.basename(file)
+                    zipf.write(file, arcname)
         
         # Verify the zip file was created successfully
         if not os.path.exists(output_zip_path):
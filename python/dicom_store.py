@@ -0,0 +1,290 @@
+# Store of uploaded DICOM instances indexed by Study/Series/SOP Instance UID, with per-frame decoding
+# and an LRU cache of decoded frames for the WADO-RS style retrieval routes.
+#-----------------------------------
+import io
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pydicom
+from PIL import Image
+
+from .dicom_decoding import decode_frame, transfer_syntax_of
+from .instrumentation import span
+from .rendering import dataset_render_params, render
+
+# Dot-separated numeric components, at most 64 characters (so never '.' or '..' as a path component)
+UID_PATTERN = re.compile(r'(?=[0-9.]{1,64}\Z)[0-9]+(?:\.[0-9]+)*')
+RENDERED_FORMATS = {'jpeg': 'image/jpeg', 'png': 'image/png'}
+
+
+def _uid(ds, keyword):
+    return str(ds.get(keyword, '') or '').strip('\0 ')
+
+
+class FrameCache:
+    """LRU cache of decoded frames, bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._frames = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            pixels = self._frames.get(key)
+            if pixels is None:
+                self.misses += 1
+                return None
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return pixels
+
+    def put(self, key, pixels):
+        if pixels.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._frames.pop(key, None)
+            if previous is not None:
+                self._size -= previous.nbytes
+            self._frames[key] = pixels
+            self._size += pixels.nbytes
+            while self._size > self.max_bytes:
+                _, evicted = self._frames.popitem(last=False)
+                self._size -= evicted.nbytes
+
+    def discard_instance(self, sop_uid):
+        with self._lock:
+            for key in [k for k in self._frames if k[0] == sop_uid]:
+                self._size -= self._frames.pop(key).nbytes
+
+    def stats(self):
+        with self._lock:
+            return {'frames': len(self._frames), 'bytes': self._size, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+class DicomStore:
+    """
+    Uploaded DICOM instances, filed as <root>/<StudyInstanceUID>/<SeriesInstanceUID>/<SOPInstanceUID>.dcm.
+
+    The index holds header fields only. Several processes (gunicorn workers)
+    may share one root, so the disk stays the source of truth: listings
+    re-list the series folders whose mtime changed since they were indexed,
+    a lookup that misses the index checks the instance's path directly, and
+    an instance replaced on disk is re-read. Decoded frames are kept in a
+    FrameCache of cache_bytes.
+    """
+
+    def __init__(self, root, cache_bytes=256 * 1024 * 1024):
+        self.root = root
+        self.frames = FrameCache(cache_bytes)
+        self._instances = {}
+        self._series_mtimes = {}  # series folder -> its mtime when its files were last indexed
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    @staticmethod
+    def _record(path, ds):
+        params = dataset_render_params(ds)
+        return {
+            'study_uid': _uid(ds, 'StudyInstanceUID'),
+            'series_uid': _uid(ds, 'SeriesInstanceUID'),
+            'sop_uid': _uid(ds, 'SOPInstanceUID'),
+            'path': path,
+            'mtime_ns': os.stat(path).st_mtime_ns,
+            'frames': int(ds.get('NumberOfFrames', 1) or 1),
+            'rows': int(ds.Rows),
+            'columns': int(ds.Columns),
+            'samples': int(ds.get('SamplesPerPixel', 1) or 1),
+            'instance_number': int(ds.get('InstanceNumber', 0) or 0),
+            'modality': str(ds.get('Modality', '')),
+            'transfer_syntax': transfer_syntax_of(path),
+            'slope': params['slope'],
+            'intercept': params['intercept'],
+            'dicom_window': params['dicom_window'],
+            'invert': params['invert']
+        }
+
+    @staticmethod
+    def _read_header(path):
+        ds = pydicom.dcmread(path, stop_before_pixels=True, force=True)
+        for keyword in ('StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID'):
+            if not UID_PATTERN.fullmatch(_uid(ds, keyword)):
+                raise ValueError(f"Missing or invalid {keyword}")
+        if 'Rows' not in ds or 'Columns' not in ds:
+            raise ValueError("Not an image instance")
+        return ds
+
+    def _load(self, path):
+        """Read a stored file's header into the index. Returns its record, or None if it is unreadable."""
+        try:
+            record = self._record(path, self._read_header(path))
+        except Exception as e:
+            print(f"[ERROR] Skipping stored instance {path}: {str(e)}")
+            return None
+        with self._lock:
+            previous = self._instances.get(record['sop_uid'])
+            self._instances[record['sop_uid']] = record
+        if previous is not None and previous['mtime_ns'] != record['mtime_ns']:
+            self.frames.discard_instance(record['sop_uid'])
+        return record
+
+    def _series_folders(self):
+        if not os.path.isdir(self.root):
+            return
+        for study in os.scandir(self.root):
+            if study.is_dir():
+                for series in os.scandir(study.path):
+                    if series.is_dir():
+                        yield series.path
+
+    def _index_series(self, folder):
+        """Re-list one series folder: read new or changed files and drop records of removed ones."""
+        with self._lock:
+            known = {r['path']: r for r in self._instances.values() if os.path.dirname(r['path']) == folder}
+        present = set()
+        for entry in os.scandir(folder):
+            if not entry.name.endswith('.dcm') or not entry.is_file():
+                continue
+            present.add(entry.path)
+            record = known.get(entry.path)
+            if record is None or record['mtime_ns'] != entry.stat().st_mtime_ns:
+                self._load(entry.path)
+        self._forget(path for path in known if path not in present)
+
+    def _forget(self, paths):
+        paths = set(paths)
+        with self._lock:
+            gone = [sop for sop, record in self._instances.items() if record['path'] in paths]
+            for sop in gone:
+                del self._instances[sop]
+        for sop in gone:
+            self.frames.discard_instance(sop)
+
+    def _refresh(self):
+        """Bring the index up to date with the series folders on disk (only changed folders are listed)."""
+        with self._refresh_lock, span('dicom_store', 'index'):
+            folders = set()
+            for folder in self._series_folders():
+                folders.add(folder)
+                mtime = os.stat(folder).st_mtime_ns
+                if self._series_mtimes.get(folder) != mtime:
+                    self._index_series(folder)
+                    self._series_mtimes[folder] = mtime
+            for folder in set(self._series_mtimes) - folders:
+                del self._series_mtimes[folder]
+                with self._lock:
+                    gone = [r['path'] for r in self._instances.values() if os.path.dirname(r['path']) == folder]
+                self._forget(gone)
+        return self._instances
+
+    def store(self, path):
+        """
+        Move a DICOM file into the store and index it (replacing an instance with the same SOP UID).
+
+        Returns:
+            dict: The instance record
+
+        Raises:
+            ValueError: The file is not a DICOM image with valid UIDs
+        """
+        ds = self._read_header(path)
+        study, series, sop = (_uid(ds, k) for k in ('StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID'))
+        target_dir = os.path.join(self.root, study, series)
+        os.makedirs(target_dir, exist_ok=True)
+        target = os.path.join(target_dir, f"{sop}.dcm")
+        shutil.move(path, target)
+
+        record = self._record(target, ds)
+        with self._lock:
+            self._instances[sop] = record
+        self.frames.discard_instance(sop)
+        return record
+
+    def studies(self):
+        studies = {}
+        for record in list(self._refresh().values()):
+            study = studies.setdefault(record['study_uid'], {'study_uid': record['study_uid'], 'series': set(), 'instances': 0})
+            study['series'].add(record['series_uid'])
+            study['instances'] += 1
+        return [{'study_uid': s['study_uid'], 'series_count': len(s['series']), 'instance_count': s['instances']}
+                for s in sorted(studies.values(), key=lambda s: s['study_uid'])]
+
+    def series(self, study_uid):
+        series = {}
+        for record in list(self._refresh().values()):
+            if record['study_uid'] == study_uid:
+                entry = series.setdefault(record['series_uid'], {'series_uid': record['series_uid'], 'modality': record['modality'],
+                                                                 'instance_count': 0, 'frame_count': 0})
+                entry['instance_count'] += 1
+                entry['frame_count'] += record['frames']
+        return sorted(series.values(), key=lambda s: s['series_uid'])
+
+    def instances(self, study_uid, series_uid):
+        """Instance records of a series in InstanceNumber order."""
+        records = [r for r in list(self._refresh().values())
+                   if r['study_uid'] == study_uid and r['series_uid'] == series_uid]
+        return sorted(records, key=lambda r: (r['instance_number'], r['sop_uid']))
+
+    def get_instance(self, study_uid, series_uid, sop_uid):
+        """
+        Record of one instance. An instance stored by another process since this one
+        indexed is found at its path on disk, and one replaced on disk is re-read.
+        """
+        if not all(UID_PATTERN.fullmatch(uid or '') for uid in (study_uid, series_uid, sop_uid)):
+            return None
+        path = os.path.join(self.root, study_uid, series_uid, f"{sop_uid}.dcm")
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        record = self._instances.get(sop_uid)
+        if record is None or record['path'] != path or record['mtime_ns'] != mtime:
+            record = self._load(path)
+        if record is None or record['study_uid'] != study_uid or record['series_uid'] != series_uid:
+            return None
+        return record
+
+    def frame(self, record, index):
+        """Decoded stored values of frame index (0-based), from the cache when possible."""
+        key = (record['sop_uid'], index)
+        pixels = self.frames.get(key)
+        if pixels is None:
+            with span('dicom_store', 'decode_frame'):
+                pixels = decode_frame(record['path'], index)
+            self.frames.put(key, pixels)
+        return pixels
+
+
+def render_frame(pixels, record, window=None, image_format='jpeg', quality=90):
+    """
+    Encode a decoded frame as JPEG or PNG with a display window (colour frames are encoded as they are).
+
+    Returns:
+        bytes: The encoded image
+    """
+    if record['samples'] > 1:
+        image = pixels.astype(np.uint8, copy=False)
+    else:
+        image = render(pixels, window, record['slope'], record['intercept'], record['dicom_window'], record['invert'])
+
+    buffer = io.BytesIO()
+    with span('dicom_store', 'encode'):
+        if image_format == 'png':
+            Image.fromarray(image).save(buffer, format='PNG', compress_level=3)
+        else:
+            Image.fromarray(image).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def raw_frame(pixels):
+    """Stored values of a frame as little-endian bytes, with the numpy dtype string describing them."""
+    little_endian = pixels.astype(pixels.dtype.newbyteorder('<'), copy=False)
+    return np.ascontiguousarray(little_endian).tobytes(), little_endian.dtype.str
@@ -0,0 +1,165 @@
+# Batch processing of server-side DICOM directories: parallel scanning and per-series processing
+# with results yielded as each series finishes.
+#-----------------------------------
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .dicom_processor import process_dicom_file
+from .segmentation import process_dicom_folder_for_segmentation
+from .mesh_export import export_series_mesh, mesh_path
+from .instrumentation import span
+
+DICOM_EXTENSIONS = ('.dcm', '.ima')
+LOCAL_SERVICES = ('image_conversion', 'segmentation', '3d_model')
+
+
+def is_dicom_file(path):
+    """DICOM by extension, or by the 'DICM' marker after the 128-byte preamble (PACS exports often have no extension)."""
+    if path.lower().endswith(DICOM_EXTENSIONS):
+        return True
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(132)
+        return len(header) == 132 and header[128:] == b'DICM'
+    except OSError:
+        return False
+
+
+def _scan_tree(root):
+    """Walk root and return {directory: sorted DICOM files} for directories that directly contain DICOM files."""
+    series = {}
+    for dirpath, _, filenames in os.walk(root):
+        files = sorted(os.path.join(dirpath, name) for name in filenames
+                       if is_dicom_file(os.path.join(dirpath, name)))
+        if files:
+            series[dirpath] = files
+    return series
+
+
+def scan_series_directories(root, max_workers=4):
+    """
+    Find every series directory under root.
+
+    A series is a directory that directly contains DICOM files, which is how
+    PACS exports and apply_segmentation's series reader lay them out. The
+    top-level subdirectories are walked in parallel.
+
+    Returns:
+        dict: {series directory: sorted list of DICOM file paths}
+    """
+    if not os.path.isdir(root):
+        raise ValueError(f"Directory not found: {root}")
+
+    series = {}
+    with os.scandir(root) as it:
+        entries = list(it)
+    top_files = sorted(e.path for e in entries if e.is_file() and is_dicom_file(e.path))
+    if top_files:
+        series[root] = top_files
+
+    subdirs = [e.path for e in entries if e.is_dir(follow_symlinks=False)]
+    with span('directory_ingest', 'scan'), ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for found in pool.map(_scan_tree, subdirs):
+            series.update(found)
+
+    if not series:
+        raise ValueError("No DICOM files found in the specified folder.")
+    return dict(sorted(series.items()))
+
+
+def series_key(series_dir, root):
+    """Filesystem-safe output name for a series directory, derived from its path under root."""
+    relative = os.path.relpath(series_dir, root)
+    if relative == '.':
+        relative = os.path.basename(os.path.normpath(root)) or 'series'
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', relative.replace(os.sep, '__')).strip('._') or 'series'
+
+
+def process_series(series_dir, files, output_dir, service_type='image_conversion',
+                   lower_threshold=100, upper_threshold=300, mesh_root=None):
+    """
+    Process one series directory.
+
+    Args:
+        series_dir: Directory holding the series
+        files: DICOM files of the series (from scan_series_directories)
+        output_dir: Directory for this series' outputs
+        service_type: 'image_conversion' converts every slice to JPG; 'segmentation'
+                      and '3d_model' run process_dicom_folder_for_segmentation, and
+                      '3d_model' also exports an STL surface of the segmentation
+        lower_threshold, upper_threshold: Segmentation thresholds
+        mesh_root: Mesh cache folder (see mesh_export.export_mesh), default output_dir
+
+    Returns:
+        dict: series_dir, file_count, outputs and error (None on success)
+    """
+    result = {'series_dir': series_dir, 'file_count': len(files), 'outputs': [], 'error': None}
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        if service_type == 'image_conversion':
+            for path in files:
+                output_path = os.path.join(output_dir, f"{os.path.basename(path)}.jpg")
+                try:
+                    result['outputs'].append(process_dicom_file(path, output_path))
+                except Exception as e:
+                    print(f"Error processing {path}: {str(e)}")
+        else:
+            result['outputs'] = process_dicom_folder_for_segmentation(
+                series_dir, output_dir, lower_threshold, upper_threshold) or []
+            if service_type == '3d_model':
+                mesh = export_series_mesh(series_dir, mesh_root or output_dir, lower_threshold, upper_threshold)
+                model_path = mesh_path(output_dir, 'stl')
+                shutil.copyfile(mesh['path'], model_path)
+                result['outputs'].append(model_path)
+
+        if not result['outputs']:
+            result['error'] = "No valid files could be processed"
+    except Exception as e:
+        print(f"[ERROR] Series {series_dir} failed: {str(e)}")
+        result['error'] = str(e)
+    return result
+
+
+def ingest_directory(root, output_root, service_type='image_conversion', lower_threshold=100,
+                     upper_threshold=300, max_workers=4, mesh_root=None):
+    """
+    Scan root for series and process them concurrently.
+
+    This is a generator so callers can stream progress: it yields a 'scan'
+    event once the tree has been scanned, then a 'series' event per series
+    in completion order. Series still queued are cancelled if the consumer
+    stops iterating (e.g. the client disconnected).
+
+    Yields:
+        dict: {'event': 'scan', 'series_count', 'file_count'} followed by
+              {'event': 'series', 'series', 'output_dir', ...process_series result}
+    """
+    if service_type not in LOCAL_SERVICES:
+        raise ValueError(f"Unknown service '{service_type}'. Choose from: {', '.join(LOCAL_SERVICES)}")
+
+    series = scan_series_directories(root, max_workers)
+    yield {
+        'event': 'scan',
+        'series_count': len(series),
+        'file_count': sum(len(files) for files in series.values())
+    }
+
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {}
+        for series_dir, files in series.items():
+            key = series_key(series_dir, root)
+            output_dir = os.path.join(output_root, key)
+            future = pool.submit(process_series, series_dir, files, output_dir, service_type,
+                                 lower_threshold, upper_threshold, mesh_root)
+            futures[future] = (key, output_dir)
+
+        for future in as_completed(futures):
+            key, output_dir = futures[future]
+            event = {'event': 'series', 'series': key, 'output_dir': output_dir}
+            event.update(future.result())
+            yield event
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
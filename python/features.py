@@ -0,0 +1,169 @@
+# Shared feature engineering for the prediction models. Turns raw patient columns into model matrices.
+#-----------------------------------
+import numpy as np
+import pandas as pd
+
+# Column order expected by the rupture risk and AAA growth models
+RISK_FEATURE_COLUMNS = [
+    "Axial Diameter (mm)",
+    "ILT Volume (mL)",
+    "Peak Wall Stress (kPa)",
+    "Blood Pressure (mmHg)",
+    "Age",
+    "Smoking History",
+    "Gender"
+]
+
+# Column order expected by the growth rate model
+GROWTH_FEATURE_COLUMNS = ["Current Axial Diameter (mm)", "ILT Volume (mL)"]
+
+# Alternative column names found in uploaded spreadsheets
+RISK_COLUMN_ALIASES = {
+    "AneurysmSize": "Axial Diameter (mm)",
+    "Diameter": "Axial Diameter (mm)",
+    "AxialDiameter": "Axial Diameter (mm)",
+    "AAA_Size": "Axial Diameter (mm)",
+    "ILT_Volume": "ILT Volume (mL)",
+    "Wall_Stress": "Peak Wall Stress (kPa)",
+    "WallStress": "Peak Wall Stress (kPa)",
+    "BP": "Blood Pressure (mmHg)",
+    "BloodPressure": "Blood Pressure (mmHg)",
+    "Smoking": "Smoking History",
+    "PatientID": "Patient ID",
+    "ID": "Patient ID"
+}
+
+GROWTH_COLUMN_ALIASES = {
+    "AneurysmSize": "Current Axial Diameter (mm)",
+    "CurrentDiameter": "Current Axial Diameter (mm)",
+    "Diameter": "Current Axial Diameter (mm)",
+    "AAA_Diameter": "Current Axial Diameter (mm)",
+    "ILT": "ILT Volume (mL)",
+    "Thrombus": "ILT Volume (mL)",
+    "ThrombusVolume": "ILT Volume (mL)"
+}
+
+# Precompiled categorical mappings (keys are lower-cased and stripped)
+SMOKING_MAPPING = {"yes": 1.0, "y": 1.0, "true": 1.0, "1": 1.0, "1.0": 1.0}
+GENDER_MAPPING = {"m": 1.0, "male": 1.0}
+
+# Defaults for missing optional values
+DEFAULT_BLOOD_PRESSURE = 140.0
+DEFAULT_AGE = 65.0
+DEFAULT_SMOKING = 0.0
+DEFAULT_GENDER = 1.0  # Male (more common for AAA)
+WALL_STRESS_PER_MM = 3.0  # Wall stress estimated from diameter when not measured
+
+
+def apply_column_aliases(df, aliases):
+    """Copy alternative column names onto their standard names (in place)."""
+    for alt_name, std_name in aliases.items():
+        if alt_name in df.columns and std_name not in df.columns:
+            df[std_name] = df[alt_name]
+    return df
+
+
+def _as_column(values, n):
+    """Return values as a 1-D float64 array of length n (NaN marks missing)."""
+    if values is None:
+        return np.full(n, np.nan)
+    array = pd.to_numeric(pd.Series(np.atleast_1d(values), dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+    if array.size == 1 and n > 1:
+        return np.full(n, array[0])
+    return array
+
+
+def encode_categorical(values, mapping, default, n):
+    """
+    Encode categorical values to 0/1 using a precompiled mapping.
+
+    Missing values (None, NaN, empty string) get the default; unrecognised
+    values encode to 0.
+    """
+    if values is None:
+        return np.full(n, default)
+    series = pd.Series(np.atleast_1d(values), dtype=object)
+    if len(series) == 1 and n > 1:
+        series = pd.Series(np.repeat(series.to_numpy(), n), dtype=object)
+    keys = series.astype(str).str.strip().str.lower()
+    encoded = keys.map(mapping).to_numpy(dtype=np.float64, na_value=0.0)
+    missing = series.isna().to_numpy() | (keys == "").to_numpy()
+    return np.where(missing, default, encoded)
+
+
+def build_risk_features(diameter, ilt_volume, wall_stress=None, blood_pressure=None,
+                        age=None, smoking=None, gender=None):
+    """
+    Build the rupture risk / AAA growth model matrix from raw values.
+
+    Every argument may be a scalar, a sequence or a pandas Series. Optional
+    values may be None or contain missing entries, which are filled with the
+    shared defaults (wall stress is estimated as diameter * 3).
+
+    Returns:
+        numpy.ndarray: float64 matrix of shape (n, 7) in RISK_FEATURE_COLUMNS order
+    """
+    diameter = np.atleast_1d(np.asarray(diameter, dtype=np.float64))
+    n = diameter.shape[0]
+
+    features = np.empty((n, len(RISK_FEATURE_COLUMNS)), dtype=np.float64)
+    features[:, 0] = diameter
+    features[:, 1] = _as_column(ilt_volume, n)
+    features[:, 2] = _as_column(wall_stress, n)
+    features[:, 3] = _as_column(blood_pressure, n)
+    features[:, 4] = _as_column(age, n)
+    features[:, 5] = encode_categorical(smoking, SMOKING_MAPPING, DEFAULT_SMOKING, n)
+    features[:, 6] = encode_categorical(gender, GENDER_MAPPING, DEFAULT_GENDER, n)
+
+    # Fill missing numeric values in place
+    stress = features[:, 2]
+    missing_stress = np.isnan(stress)
+    stress[missing_stress] = diameter[missing_stress] * WALL_STRESS_PER_MM
+    np.copyto(features[:, 3], DEFAULT_BLOOD_PRESSURE, where=np.isnan(features[:, 3]))
+    np.copyto(features[:, 4], DEFAULT_AGE, where=np.isnan(features[:, 4]))
+
+    return features
+
+
+def risk_features_from_frame(df):
+    """Build the rupture risk model matrix from a DataFrame with standard column names."""
+    def column(name):
+        return df[name] if name in df.columns else None
+
+    return build_risk_features(
+        df["Axial Diameter (mm)"],
+        df["ILT Volume (mL)"],
+        column("Peak Wall Stress (kPa)"),
+        column("Blood Pressure (mmHg)"),
+        column("Age"),
+        column("Smoking History"),
+        column("Gender")
+    )
+
+
+def build_growth_features(current_diameter, ilt_volume):
+    """
+    Build the growth rate model matrix from raw values.
+
+    Returns:
+        numpy.ndarray: float64 matrix of shape (n, 2) in GROWTH_FEATURE_COLUMNS order
+    """
+    current_diameter = np.atleast_1d(np.asarray(current_diameter, dtype=np.float64))
+    n = current_diameter.shape[0]
+
+    features = np.empty((n, len(GROWTH_FEATURE_COLUMNS)), dtype=np.float64)
+    features[:, 0] = current_diameter
+    features[:, 1] = _as_column(ilt_volume, n)
+    return features
+
+
+def growth_features_from_frame(df):
+    """Build the growth rate model matrix from a DataFrame with standard column names."""
+    return build_growth_features(df[GROWTH_FEATURE_COLUMNS[0]], df[GROWTH_FEATURE_COLUMNS[1]])
+
+
+def read_patient_table(path):
+    """Read an uploaded patient table (CSV by extension, Excel otherwise)."""
+    if path.endswith('.csv'):
+        return pd.read_csv(path)
+    return pd.read_excel(path)
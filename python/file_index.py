@@ -0,0 +1,133 @@
+# In-memory index of the processed output folder, used to resolve download paths with as few disk lookups as possible.
+#-----------------------------------
+import fnmatch
+import glob
+import os
+import posixpath
+import re
+import threading
+
+from .instrumentation import span
+
+# Outputs whose names carry a timestamp (20250726-193226, 20250726_193226) or a job/upload ID
+# never change once written, so they can be cached for good
+UNIQUE_NAME_PATTERN = re.compile(r'(\d{8}[-_]\d{6})|(^|/)[0-9a-f]{12,}(/|$)')
+
+
+class ProcessedFileIndex:
+    """
+    Index of files under a root folder, keyed by their '/'-separated relative paths.
+
+    Files are registered as they are written (add()). A lookup that misses
+    the index stats the requested name in each search folder directly (and
+    lists only the folders a glob search folder matches), so other code
+    paths' outputs are found without ever walking the whole root. Lookups
+    only ever return files that are inside the root.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self._files = set()
+        self._by_name = {}
+        self._lock = threading.Lock()
+
+    def _relative(self, path):
+        real_path = os.path.realpath(path)
+        if not real_path.startswith(self.root + os.sep):
+            return None
+        return os.path.relpath(real_path, self.root).replace(os.sep, '/')
+
+    def add(self, path):
+        """Register a file that was just written under the root."""
+        rel = self._relative(path)
+        if rel is None:
+            return
+        with self._lock:
+            if rel not in self._files:
+                self._files.add(rel)
+                self._by_name.setdefault(posixpath.basename(rel), []).append(rel)
+
+    def discard(self, rel):
+        with self._lock:
+            if rel in self._files:
+                self._files.discard(rel)
+                self._by_name[posixpath.basename(rel)].remove(rel)
+
+    def _lookup(self, filename, search_dirs):
+        for search_dir in search_dirs:
+            if any(c in search_dir for c in '*?['):
+                # Glob over folder names, e.g. 'temp_*'
+                for rel in list(self._by_name.get(posixpath.basename(filename), ())):
+                    if rel.endswith('/' + filename) and fnmatch.fnmatchcase(rel[:-len(filename) - 1], search_dir):
+                        return rel
+            else:
+                rel = posixpath.join(search_dir, filename) if search_dir else filename
+                if rel in self._files:
+                    return rel
+        return None
+
+    def _probe(self, filename, search_dirs):
+        """Stat filename in each search folder on disk; returns the first file inside the root, or None."""
+        with span('file_index', 'probe'):
+            for search_dir in search_dirs:
+                if any(c in search_dir for c in '*?['):
+                    folders = sorted(glob.glob(os.path.join(glob.escape(self.root), *search_dir.split('/'))))
+                else:
+                    folders = [os.path.join(self.root, *search_dir.split('/')) if search_dir else self.root]
+                for folder in folders:
+                    path = os.path.join(folder, *filename.split('/'))
+                    if os.path.isfile(path) and self._relative(path) is not None:
+                        return path
+        return None
+
+    def resolve(self, filename, search_dirs=('',)):
+        """
+        Find a file by its path relative to the root, trying each search folder in turn.
+
+        Args:
+            filename: Requested path, e.g. 'results.csv' or 'growth_rate/results.csv'
+            search_dirs: Folders (relative to the root, glob patterns allowed) to look in
+
+        Returns:
+            str: Absolute path of the first match, or None
+        """
+        filename = posixpath.normpath(filename.replace('\\', '/')).lstrip('/')
+        if filename.startswith('..') or filename == '.':
+            return None
+
+        rel = self._lookup(filename, search_dirs)
+        if rel is not None:
+            path = os.path.join(self.root, *rel.split('/'))
+            if os.path.isfile(path):
+                return path
+            # Deleted since it was indexed
+            self.discard(rel)
+
+        path = self._probe(filename, search_dirs)
+        if path is not None:
+            self.add(path)
+        return path
+
+    def relative_path(self, path):
+        """'/'-separated path of a file relative to the root (for X-Accel-Redirect), or None."""
+        return self._relative(path)
+
+
+def file_etag(path):
+    """
+    ETag for a file from its size and modification time (nanoseconds), like nginx's.
+
+    It is computed from one stat() without reading the file, so large ZIPs are
+    never hashed by the workers. Outputs are written once and replaced whole,
+    so a changed file always gets a new size or mtime.
+
+    Returns:
+        str: The ETag value without quotes
+    """
+    stat = os.stat(path)
+    return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+
+def is_uniquely_named(relative_path):
+    """True for outputs whose path carries a timestamp or generated ID (safe to cache as immutable)."""
+    return bool(UNIQUE_NAME_PATTERN.search(relative_path or ''))
@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 import os
+import threading
 import joblib
 import matplotlib.pyplot as plt
 from sklearn.preprocessing import StandardScaler
@@ -12,12 +13,18 @@ from tensorflow.keras.layers import Dense, Dropout
 from tensorflow.keras.callbacks import EarlyStopping
 import warnings
 warnings.filterwarnings('ignore')
+from .instrumentation import span, timed
+from .features import (GROWTH_COLUMN_ALIASES, GROWTH_FEATURE_COLUMNS, apply_column_aliases,
+                       build_growth_features, growth_features_from_frame, read_patient_table)
 
 # Define paths
 MODEL_PATH = 'models/growth_rate_model.h5'
 SCALER_PATH = 'models/growth_rate_scaler.pkl'
 DATA_PATH = 'data/correct_dataset.csv'  # Updated to use corrected dataset
 
+GROWTH_RISK_THRESHOLDS = np.array([1, 3, 5], dtype=np.float64)
+GROWTH_RISK_LABELS = np.array(["Low", "Moderate", "High", "Very High"], dtype=object)
+
 def validate_and_clean_data(df):
     """
     Validate and clean the dataset to ensure medical accuracy.
@@ -74,6 +81,7 @@ def create_medically_constrained_model(input_dim):
     
     return model
 
+@timed('growth_rate', 'train')
 def train_model():
     """Train the growth rate prediction model with medical constraints."""
     
@@ -186,6 +194,7 @@ def train_model():
         print(traceback.format_exc())
         raise
 
+@timed('growth_rate', 'model_load')
 def load_prediction_model():
     """Load the trained model and scaler."""
     try:
@@ -211,6 +220,39 @@ def load_prediction_model():
     # If loading fails or files don't exist, train a new model
     return train_model()
 
+# Model and scaler loaded once per process, reloaded when their files change: /train_growth_model in
+# one worker rewrites them, and every other worker picks up the new model on its next prediction
+_model_cache = {}
+_model_lock = threading.Lock()
+
+
+def _model_version():
+    """st_mtime_ns of the model and scaler files (None if missing)."""
+    versions = []
+    for path in (MODEL_PATH, SCALER_PATH):
+        try:
+            versions.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            versions.append(None)
+    return tuple(versions)
+
+
+def cached_prediction_model():
+    """load_prediction_model(), cached in this process until the model or scaler file changes."""
+    with _model_lock:
+        cached = _model_cache.get('growth')
+        if cached is None or cached[0] != _model_version():
+            model = load_prediction_model()
+            # Read after loading, which trains and writes the files if they were unusable
+            _model_cache['growth'] = cached = (_model_version(), model)
+        return cached[1]
+
+
+def clear_model_cache():
+    """Drop the cached model, e.g. after retraining, so the next prediction loads the new one."""
+    with _model_lock:
+        _model_cache.clear()
+
 def apply_medical_constraints(prediction):
     """
     Apply additional medical constraints to predictions as a safety measure.
@@ -223,22 +265,32 @@ def apply_medical_constraints(prediction):
     
     return prediction
 
+def apply_medical_constraints_batch(predictions):
+    """Vectorized apply_medical_constraints for an array of predictions."""
+    return np.clip(predictions, 0.0, 20.0)
+
+def growth_risk_levels(yearly_growth):
+    """Risk level per yearly growth rate: >1 Moderate, >3 High, >5 Very High (mm/year)."""
+    return GROWTH_RISK_LABELS[np.searchsorted(GROWTH_RISK_THRESHOLDS, yearly_growth, side='left')]
+
 def predict_growth_rate_from_input(current_diameter, ilt_volume, output_dir):
     """
     Predict growth rate based on manual user input with medical constraints.
     """
     try:
         # Load model and scaler
-        model, scaler = load_prediction_model()
+        model, scaler = cached_prediction_model()
         
         # Prepare input data
-        input_data = np.array([[float(current_diameter), float(ilt_volume)]])
+        input_data = build_growth_features(current_diameter, ilt_volume)
         
         # Scale input
-        input_scaled = scaler.transform(input_data)
+        with span('growth_rate', 'scale'):
+            input_scaled = scaler.transform(input_data)
         
         # Make prediction
-        raw_prediction = model.predict(input_scaled, verbose=0)[0][0]
+        with span('growth_rate', 'predict'):
+            raw_prediction = model.predict(input_scaled, verbose=0)[0][0]
         
         # Apply additional medical constraints as safety measure
         monthly_growth = apply_medical_constraints(float(raw_prediction))
@@ -347,12 +399,12 @@ def predict_growth_rate_from_input(current_diameter, ilt_volume, output_dir):
             color=risk_colors.get(risk_level, 'black')
         )
         
-        plt.tight_layout()
-        
         # Save the plot
         plot_path = os.path.join(output_dir, "growth_projection.png")
-        plt.savefig(plot_path, dpi=150, bbox_inches='tight')
-        plt.close()
+        with span('growth_rate', 'plot'):
+            plt.tight_layout()
+            plt.savefig(plot_path, dpi=150, bbox_inches='tight')
+            plt.close()
         
         # Create results structure
         results = {
@@ -411,6 +463,63 @@ def predict_growth_rate_from_input(current_diameter, ilt_volume, output_dir):
         print(f"[ERROR] Failed to process growth rate prediction: {str(e)}\n{error_details}")
         return {"error": str(e)}
 
+def predict_growth_frame(df, model, scaler):
+    """
+    Add predicted growth rates, risk levels and 1-year projections to a patient table (in place).
+
+    Raises:
+        ValueError: Required columns are missing
+    """
+    # Map alternative column names
+    apply_column_aliases(df, GROWTH_COLUMN_ALIASES)
+    
+    # Check required columns
+    required_cols = GROWTH_FEATURE_COLUMNS
+    missing_cols = [col for col in required_cols if col not in df.columns]
+    if missing_cols:
+        raise ValueError(f"Missing required columns: {', '.join(missing_cols)}")
+    
+    # Extract features
+    with span('growth_rate', 'features'):
+        X = growth_features_from_frame(df)
+    
+    # Scale features
+    with span('growth_rate', 'scale'):
+        X_scaled = scaler.transform(X)
+    
+    # Make predictions (model already has ReLU constraint)
+    with span('growth_rate', 'predict'):
+        raw_predictions = model.predict(X_scaled, verbose=0).reshape(-1)
+    
+    # Apply additional medical constraints as safety measure
+    predictions = apply_medical_constraints_batch(raw_predictions)
+    
+    # Add predictions to dataframe
+    df["Predicted Growth Rate (mm/month)"] = predictions
+    df["Predicted Growth Rate (mm/year)"] = df["Predicted Growth Rate (mm/month)"] * 12
+    
+    # Updated risk assessment with more appropriate medical thresholds
+    df["Risk Level"] = growth_risk_levels(df["Predicted Growth Rate (mm/year)"].to_numpy())
+    
+    # Add projected size after 1 year
+    df["Projected Size (1 year)"] = df["Current Axial Diameter (mm)"] + df["Predicted Growth Rate (mm/year)"]
+    
+    # Ensure no negative growth rates in final output
+    negative_count = sum(df["Predicted Growth Rate (mm/month)"] < 0)
+    if negative_count > 0:
+        print(f"[WARNING] Found {negative_count} negative predictions - applying medical constraints")
+        df.loc[df["Predicted Growth Rate (mm/month)"] < 0, "Predicted Growth Rate (mm/month)"] = 0.0
+        df.loc[df["Predicted Growth Rate (mm/year)"] < 0, "Predicted Growth Rate (mm/year)"] = 0.0
+    return df
+
+def write_growth_predictions(df, output_dir):
+    """Save a predicted patient table as growth_predictions.csv in output_dir and return its path."""
+    os.makedirs(output_dir, exist_ok=True)
+    results_path = os.path.join(output_dir, "growth_predictions.csv")
+    with span('growth_rate', 'write_csv'):
+        df.to_csv(results_path, index=False)
+    return results_path
+
 def predict_growth_rate_from_excel(excel_path, output_dir):
     """
     Process patient data from Excel file and predict growth rates with medical constraints.
@@ -419,82 +528,25 @@ def predict_growth_rate_from_excel(excel_path, output_dir):
         print(f"[INFO] Beginning medically-constrained prediction from Excel file: {excel_path}")
         
         # Load model and scaler
-        model, scaler = load_prediction_model()
+        model, scaler = cached_prediction_model()
         
         # Load data from Excel
-        if excel_path.endswith('.csv'):
-            df = pd.read_csv(excel_path)
-        else:
-            df = pd.read_excel(excel_path)
+        with span('growth_rate', 'read_input'):
+            df = read_patient_table(excel_path)
         
         print(f"[INFO] Loaded data with shape: {df.shape}")
         print(f"[INFO] Columns: {', '.join(df.columns)}")
         
-        # Column mapping for alternative names
-        column_mapping = {
-            "AneurysmSize": "Current Axial Diameter (mm)",
-            "CurrentDiameter": "Current Axial Diameter (mm)",
-            "Diameter": "Current Axial Diameter (mm)",
-            "AAA_Diameter": "Current Axial Diameter (mm)",
-            "ILT": "ILT Volume (mL)",
-            "Thrombus": "ILT Volume (mL)",
-            "ThrombusVolume": "ILT Volume (mL)"
-        }
-        
-        # Map alternative column names
-        for alt_name, std_name in column_mapping.items():
-            if alt_name in df.columns and std_name not in df.columns:
-                df[std_name] = df[alt_name]
-                print(f"[INFO] Mapped column {alt_name} to {std_name}")
-        
-        # Check required columns
-        required_cols = ["Current Axial Diameter (mm)", "ILT Volume (mL)"]
-        missing_cols = [col for col in required_cols if col not in df.columns]
-        if missing_cols:
-            error_msg = f"Missing required columns: {', '.join(missing_cols)}"
-            return {"error": error_msg}
-        
-        # Extract features
-        X = df[required_cols].values
-        
-        # Scale features
-        X_scaled = scaler.transform(X)
-        
-        # Make predictions (model already has ReLU constraint)
-        raw_predictions = model.predict(X_scaled, verbose=0).flatten()
-        
-        # Apply additional medical constraints as safety measure
-        predictions = [apply_medical_constraints(pred) for pred in raw_predictions]
-        
-        # Add predictions to dataframe
-        df["Predicted Growth Rate (mm/month)"] = predictions
-        df["Predicted Growth Rate (mm/year)"] = df["Predicted Growth Rate (mm/month)"] * 12
-        
-        # Updated risk assessment with more appropriate medical thresholds
-        df["Risk Level"] = "Low"
-        df.loc[df["Predicted Growth Rate (mm/year)"] > 1, "Risk Level"] = "Moderate"
-        df.loc[df["Predicted Growth Rate (mm/year)"] > 3, "Risk Level"] = "High"  
-        df.loc[df["Predicted Growth Rate (mm/year)"] > 5, "Risk Level"] = "Very High"
-        
-        # Add projected size after 1 year
-        df["Projected Size (1 year)"] = df["Current Axial Diameter (mm)"] + df["Predicted Growth Rate (mm/year)"]
-        
-        # Ensure no negative growth rates in final output
-        negative_count = sum(df["Predicted Growth Rate (mm/month)"] < 0)
-        if negative_count > 0:
-            print(f"[WARNING] Found {negative_count} negative predictions - applying medical constraints")
-            df.loc[df["Predicted Growth Rate (mm/month)"] < 0, "Predicted Growth Rate (mm/month)"] = 0.0
-            df.loc[df["Predicted Growth Rate (mm/year)"] < 0, "Predicted Growth Rate (mm/year)"] = 0.0
+        try:
+            predict_growth_frame(df, model, scaler)
+        except ValueError as e:
+            return {"error": str(e)}
         
         print(f"[INFO] ✓ All predictions are medically valid (non-negative growth)")
         print(f"[INFO] Growth rate range: {df['Predicted Growth Rate (mm/year)'].min():.3f} to {df['Predicted Growth Rate (mm/year)'].max():.3f} mm/year")
         
-        # Create results directory
-        os.makedirs(output_dir, exist_ok=True)
-        
         # Save results to CSV
-        results_path = os.path.join(output_dir, "growth_predictions.csv")
-        df.to_csv(results_path, index=False)
+        results_path = write_growth_predictions(df, output_dir)
         
         # Determine visualization type
         is_single_patient = len(df) == 1
@@ -511,6 +563,7 @@ def predict_growth_rate_from_excel(excel_path, output_dir):
         return {"error": str(e)}
 
 # Keep the existing visualization functions but add medical constraint indicators
+@timed('growth_rate', 'plot')
 def create_single_patient_visualization(df, output_dir, results_path):
     """Create visualization for a single patient with medical constraint indicators."""
     try:
@@ -652,6 +705,7 @@ def create_single_patient_visualization(df, output_dir, results_path):
         print(f"[ERROR] Failed to create single patient visualization: {str(e)}\n{error_details}")
         return {"error": f"Failed to create visualization: {str(e)}"}
 
+@timed('growth_rate', 'plot')
 def create_multiple_patients_visualization(df, output_dir, results_path):
     """Create visualization for multiple patients with medical constraint indicators."""
     try:
@@ -0,0 +1,106 @@
+# Per-stage timing spans exported as Prometheus histograms, with an optional per-request trace.
+#-----------------------------------
+import contextvars
+import functools
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    from prometheus_client import Histogram
+except ImportError:  # prometheus_client ships with prometheus_flask_exporter; spans still trace without it
+    Histogram = None
+
+# Buckets cover fast per-slice stages as well as model training and large cohort runs
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+STAGE_DURATION = Histogram(
+    'aortec_stage_duration_seconds',
+    'Time spent in internal processing stages',
+    ['component', 'stage'],
+    buckets=STAGE_BUCKETS
+) if Histogram is not None else None
+
+# Trace of the request currently being handled (None when tracing is off)
+_current_trace = contextvars.ContextVar('aortec_trace', default=None)
+
+
+@contextmanager
+def span(component, stage):
+    """
+    Time a processing stage.
+
+    The duration is observed in the aortec_stage_duration_seconds histogram
+    labelled by component (e.g. 'rupture_risk') and stage (e.g. 'predict'),
+    and appended to the current request trace when one is active.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if STAGE_DURATION is not None:
+            STAGE_DURATION.labels(component=component, stage=stage).observe(elapsed)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace['spans'].append({
+                'component': component,
+                'stage': stage,
+                'start_ms': round((start - trace['start']) * 1000, 3),
+                'duration_ms': round(elapsed * 1000, 3)
+            })
+
+
+def start_trace(request_id=None, **fields):
+    """Start collecting spans for the current request. Returns the request ID."""
+    request_id = request_id or uuid.uuid4().hex
+    _current_trace.set({
+        'request_id': request_id,
+        'start': time.perf_counter(),
+        'fields': fields,
+        'spans': []
+    })
+    return request_id
+
+
+def finish_trace(**fields):
+    """
+    Stop collecting spans for the current request.
+
+    Returns:
+        dict: The trace record (request_id, duration_ms, extra fields and spans),
+              or None if no trace was active
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    _current_trace.set(None)
+
+    record = {
+        'request_id': trace['request_id'],
+        'duration_ms': round((time.perf_counter() - trace['start']) * 1000, 3)
+    }
+    record.update(trace['fields'])
+    record.update(fields)
+    record['spans'] = trace['spans']
+    return record
+
+
+def write_trace(record, log_path):
+    """Append a trace record to a JSON-lines log file."""
+    os.makedirs(os.path.dirname(log_path) or '.', exist_ok=True)
+    with open(log_path, 'a') as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def timed(component, stage):
+    """Decorator form of span() for functions that make up a whole stage."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(component, stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,416 @@
+# Surface meshes of segmentation masks: marching cubes at physical spacing, smoothing and quadric
+# decimation, written as binary STL or quantized binary glTF (single or coarse-to-fine levels of
+# detail) and cached by mask hash.
+#-----------------------------------
+import hashlib
+import json
+import os
+import struct
+import uuid
+
+import numpy as np
+import SimpleITK as sitk
+from vtkmodules.util.numpy_support import numpy_to_vtk, vtk_to_numpy
+from vtkmodules.vtkCommonDataModel import vtkImageData
+from vtkmodules.vtkFiltersCore import (vtkFlyingEdges3D, vtkPolyDataNormals, vtkQuadricDecimation,
+                                       vtkWindowedSincPolyDataFilter)
+
+from .instrumentation import span
+from .multiresolution import segment_threshold
+from .roi import crop_image, image_roi
+
+MESH_FORMATS = {'stl': 'model/stl', 'glb': 'model/gltf-binary'}
+MESH_INFO_NAME = 'mesh.json'
+DEFAULT_TARGET_TRIANGLES = 200000
+DEFAULT_SMOOTHING_ITERATIONS = 20
+SMOOTHING_PASSBAND = 0.1
+LOD_MANIFEST_NAME = 'lods.json'
+LOD_RATIO = 4
+LOD_MIN_TRIANGLES = 2000
+
+
+def series_mask(input_folder, lower_threshold=100, upper_threshold=300, crop_to_roi=False, method='full'):
+    """
+    Threshold a DICOM series in HU, as apply_segmentation does. With crop_to_roi
+    the mask covers the aorta candidate's box only (see roi.find_roi) and the
+    geometry's origin is moved with it. method is 'full' or 'coarse_to_fine'
+    (see multiresolution.segment).
+
+    Returns:
+        tuple: (mask as a uint8 (z, y, x) array, geometry dict with spacing, origin and direction)
+    """
+    reader = sitk.ImageSeriesReader()
+    dicom_names = reader.GetGDCMSeriesFileNames(input_folder)
+    if not dicom_names:
+        raise ValueError(f"No DICOM series found in {input_folder}")
+    reader.SetFileNames(dicom_names)
+    with span('mesh_export', 'dicom_read'):
+        image = reader.Execute()
+    if crop_to_roi:
+        image = crop_image(image, image_roi(image, lower_threshold, upper_threshold))
+    with span('mesh_export', 'threshold'):
+        mask = segment_threshold(sitk.GetArrayViewFromImage(image), lower_threshold, upper_threshold, method=method)
+    return mask.astype(np.uint8), image_geometry(image)
+
+
+def image_mask(path):
+    """Read a label image (e.g. segment_aneurysm's NIfTI output); every non-zero voxel is inside."""
+    image = sitk.ReadImage(path)
+    return (sitk.GetArrayViewFromImage(image) > 0).astype(np.uint8), image_geometry(image)
+
+
+def image_geometry(image):
+    return {'spacing': list(image.GetSpacing()), 'origin': list(image.GetOrigin()),
+            'direction': list(image.GetDirection())}
+
+
+def mask_id(mask, geometry, target_triangles=DEFAULT_TARGET_TRIANGLES,
+            smoothing_iterations=DEFAULT_SMOOTHING_ITERATIONS):
+    """Content hash of a mask, its geometry and the mesh settings, so the same mask is only meshed once."""
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(f"{mask.shape}|{geometry}|{target_triangles}|{smoothing_iterations}".encode('utf-8'))
+    digest.update(np.packbits(np.ascontiguousarray(mask, dtype=bool)).tobytes())
+    return digest.hexdigest()
+
+
+def _mask_to_vtk(mask, spacing):
+    """vtkImageData of the mask padded by one empty voxel on every side, so the surface is closed."""
+    padded = np.pad(mask.astype(np.uint8, copy=False), 1)
+    image = vtkImageData()
+    image.SetDimensions(padded.shape[2], padded.shape[1], padded.shape[0])
+    image.SetSpacing(*spacing)
+    image.SetOrigin(-spacing[0], -spacing[1], -spacing[2])
+    scalars = numpy_to_vtk(padded.ravel(), deep=True)
+    image.GetPointData().SetScalars(scalars)
+    return image
+
+
+def surface_polydata(mask, geometry, smoothing_iterations=DEFAULT_SMOOTHING_ITERATIONS):
+    """
+    Full-resolution smoothed surface of a binary mask as vtkPolyData, in voxel axes (mm).
+
+    Marching cubes (VTK's flying edges) runs at the voxel spacing and a
+    windowed-sinc filter removes the voxel staircase without shrinking the
+    surface.
+
+    Raises:
+        ValueError: The mask is empty
+    """
+    if not mask.any():
+        raise ValueError("The segmentation mask is empty")
+
+    with span('mesh_export', 'marching_cubes'):
+        contour = vtkFlyingEdges3D()
+        contour.SetInputData(_mask_to_vtk(mask, geometry['spacing']))
+        contour.SetValue(0, 0.5)
+        contour.ComputeNormalsOff()
+        contour.ComputeGradientsOff()
+        contour.ComputeScalarsOff()
+        contour.Update()
+        surface = contour.GetOutput()
+
+    if smoothing_iterations > 0:
+        with span('mesh_export', 'smooth'):
+            smoother = vtkWindowedSincPolyDataFilter()
+            smoother.SetInputData(surface)
+            smoother.SetNumberOfIterations(smoothing_iterations)
+            smoother.SetPassBand(SMOOTHING_PASSBAND)
+            smoother.BoundarySmoothingOff()
+            smoother.FeatureEdgeSmoothingOff()
+            smoother.NonManifoldSmoothingOn()
+            smoother.NormalizeCoordinatesOn()
+            smoother.Update()
+            surface = smoother.GetOutput()
+    return surface
+
+
+def decimate(surface, target_triangles):
+    """Quadric decimation of a surface down to about target_triangles (returned unchanged if already smaller)."""
+    triangles = surface.GetNumberOfPolys()
+    if not target_triangles or triangles <= target_triangles:
+        return surface
+    with span('mesh_export', 'decimate'):
+        decimation = vtkQuadricDecimation()
+        decimation.SetInputData(surface)
+        decimation.SetTargetReduction(1.0 - target_triangles / triangles)
+        decimation.VolumePreservationOn()
+        decimation.Update()
+        return decimation.GetOutput()
+
+
+def surface_arrays(surface, geometry):
+    """
+    Vertices, faces and vertex normals of a surface in patient coordinates (mm).
+
+    Returns:
+        tuple: (vertices float32 (n, 3), faces uint32 (m, 3), normals float32 (n, 3))
+    """
+    with span('mesh_export', 'normals'):
+        normals = vtkPolyDataNormals()
+        normals.SetInputData(surface)
+        normals.SplittingOff()
+        normals.ConsistencyOn()
+        normals.AutoOrientNormalsOn()
+        normals.ComputePointNormalsOn()
+        normals.Update()
+        surface = normals.GetOutput()
+
+    vertices = vtk_to_numpy(surface.GetPoints().GetData()).astype(np.float64)
+    faces = vtk_to_numpy(surface.GetPolys().GetConnectivityArray()).reshape(-1, 3).astype(np.uint32)
+    point_normals = vtk_to_numpy(surface.GetPointData().GetNormals()).astype(np.float64)
+
+    # Voxel axes to patient coordinates; a mirroring direction matrix flips the triangle winding
+    direction = np.asarray(geometry['direction'], dtype=np.float64).reshape(3, 3)
+    vertices = vertices @ direction.T + np.asarray(geometry['origin'], dtype=np.float64)
+    point_normals = point_normals @ direction.T
+    if np.linalg.det(direction) < 0:
+        faces = faces[:, ::-1].copy()
+    return vertices.astype(np.float32), faces, point_normals.astype(np.float32)
+
+
+def extract_surface(mask, geometry, target_triangles=DEFAULT_TARGET_TRIANGLES,
+                    smoothing_iterations=DEFAULT_SMOOTHING_ITERATIONS):
+    """
+    Triangle surface of a binary mask in patient coordinates (mm), smoothed
+    (see surface_polydata) and decimated to target_triangles.
+
+    Returns:
+        tuple: (vertices float32 (n, 3), faces uint32 (m, 3), normals float32 (n, 3))
+    """
+    surface = decimate(surface_polydata(mask, geometry, smoothing_iterations), target_triangles)
+    return surface_arrays(surface, geometry)
+
+
+def write_stl(path, vertices, faces):
+    """Binary STL with per-facet normals."""
+    triangles = vertices[faces]
+    facet_normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    lengths = np.linalg.norm(facet_normals, axis=1, keepdims=True)
+    facet_normals = np.divide(facet_normals, lengths, out=np.zeros_like(facet_normals), where=lengths > 0)
+
+    records = np.zeros(len(faces), dtype=[('normal', '<f4', 3), ('vertices', '<f4', (3, 3)), ('attributes', '<u2')])
+    records['normal'] = facet_normals
+    records['vertices'] = triangles
+    with open(path, 'wb') as f:
+        f.write(b'AORTEC surface mesh'.ljust(80, b' '))
+        f.write(struct.pack('<I', len(faces)))
+        f.write(records.tobytes())
+
+
+def _quantize_normals(normals):
+    """Unit normals as signed normalized bytes, padded to 4 bytes per vertex as glTF requires."""
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    unit = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+    packed = np.zeros((len(normals), 4), dtype=np.int8)
+    packed[:, :3] = np.round(unit * 127)
+    return packed
+
+
+def quantize_positions(vertices):
+    """
+    16-bit positions over the bounding box (KHR_mesh_quantization).
+
+    The scale is the same on every axis (the largest extent): viewers shade
+    with the inverse-transpose of the node matrix, so a per-axis scale would
+    skew the normals, which are stored in patient space.
+
+    Returns:
+        tuple: (uint16 (n, 4) array padded to 8 bytes per vertex, translation, scale)
+    """
+    low = vertices.min(axis=0).astype(np.float64)
+    extent = max(float((vertices.max(axis=0) - low).max()), 1e-6)
+    packed = np.zeros((len(vertices), 4), dtype=np.uint16)
+    packed[:, :3] = np.round((vertices - low) / extent * 65535)
+    return packed, low.tolist(), [extent] * 3
+
+
+def glb_bytes(vertices, faces, normals):
+    """
+    A binary glTF holding one mesh, with quantized attributes: 16-bit positions
+    scaled back to mm by the node transform and 8-bit normals (8 + 4 bytes per
+    vertex instead of 24).
+    """
+    positions, translation, scale = quantize_positions(vertices)
+    index_type = np.uint16 if len(vertices) < 65536 else np.uint32
+    chunks = [positions.tobytes(), _quantize_normals(normals).tobytes(), faces.astype(index_type).tobytes()]
+
+    buffer_views = []
+    offset = 0
+    for data, stride, target in zip(chunks, (8, 4, None), (34962, 34962, 34963)):
+        view = {'buffer': 0, 'byteOffset': offset, 'byteLength': len(data), 'target': target}
+        if stride:
+            view['byteStride'] = stride
+        buffer_views.append(view)
+        offset += (len(data) + 3) // 4 * 4
+
+    document = {
+        'asset': {'version': '2.0', 'generator': 'AORTEC'},
+        'extensionsUsed': ['KHR_mesh_quantization'],
+        'extensionsRequired': ['KHR_mesh_quantization'],
+        'scene': 0,
+        'scenes': [{'nodes': [0]}],
+        'nodes': [{'mesh': 0, 'translation': translation, 'scale': scale}],
+        'meshes': [{'primitives': [{'attributes': {'POSITION': 0, 'NORMAL': 1}, 'indices': 2, 'material': 0}]}],
+        'materials': [{'pbrMetallicRoughness': {'baseColorFactor': [0.8, 0.25, 0.25, 1.0],
+                                                'metallicFactor': 0.0, 'roughnessFactor': 0.6}}],
+        'accessors': [
+            {'bufferView': 0, 'componentType': 5123, 'normalized': True, 'count': len(vertices), 'type': 'VEC3',
+             'min': positions[:, :3].min(axis=0).tolist(), 'max': positions[:, :3].max(axis=0).tolist()},
+            {'bufferView': 1, 'componentType': 5120, 'normalized': True, 'count': len(vertices), 'type': 'VEC3'},
+            {'bufferView': 2, 'componentType': 5123 if index_type is np.uint16 else 5125,
+             'count': int(faces.size), 'type': 'SCALAR'}
+        ],
+        'bufferViews': buffer_views,
+        'buffers': [{'byteLength': offset}]
+    }
+
+    json_chunk = json.dumps(document, separators=(',', ':')).encode('utf-8')
+    json_chunk += b' ' * (-len(json_chunk) % 4)
+    binary_chunk = b''.join(data + b'\0' * (-len(data) % 4) for data in chunks)
+    length = 12 + 8 + len(json_chunk) + 8 + len(binary_chunk)
+    return b''.join([struct.pack('<4sII', b'glTF', 2, length),
+                     struct.pack('<I4s', len(json_chunk), b'JSON'), json_chunk,
+                     struct.pack('<I4s', len(binary_chunk), b'BIN\0'), binary_chunk])
+
+
+def write_glb(path, vertices, faces, normals):
+    with open(path, 'wb') as f:
+        f.write(glb_bytes(vertices, faces, normals))
+
+
+def mesh_path(mesh_dir, mesh_format):
+    return os.path.join(mesh_dir, f"surface.{mesh_format}")
+
+
+def _write_json(path, document):
+    temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(document, f)
+    os.replace(temp_path, path)
+
+
+def load_mesh_info(mesh_dir):
+    """The recorded info of a mesh folder, or None if nothing has been written yet."""
+    try:
+        with open(os.path.join(mesh_dir, MESH_INFO_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def export_mesh(mask, geometry, output_root, mesh_format='stl', target_triangles=DEFAULT_TARGET_TRIANGLES,
+                smoothing_iterations=DEFAULT_SMOOTHING_ITERATIONS):
+    """
+    Mesh a mask and write it as <output_root>/<mesh_id>/surface.<format>, or
+    return the mesh already written for the same mask and settings.
+
+    Returns:
+        dict: mesh_id, format, path, vertices, triangles and cached
+    """
+    if mesh_format not in MESH_FORMATS:
+        raise ValueError(f"Unknown mesh format '{mesh_format}'. Choose from: {', '.join(MESH_FORMATS)}")
+
+    with span('mesh_export', 'hash'):
+        mesh_id = mask_id(mask, geometry, target_triangles, smoothing_iterations)
+    mesh_dir = os.path.join(output_root, mesh_id)
+    path = mesh_path(mesh_dir, mesh_format)
+    info = load_mesh_info(mesh_dir)
+    if info is not None and os.path.exists(path):
+        return dict(info, format=mesh_format, path=path, cached=True)
+
+    vertices, faces, normals = extract_surface(mask, geometry, target_triangles, smoothing_iterations)
+    os.makedirs(mesh_dir, exist_ok=True)
+    # Written under a temporary name and renamed, so concurrent requests never serve a partial file
+    temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with span('mesh_export', 'write'):
+        if mesh_format == 'stl':
+            write_stl(temp_path, vertices, faces)
+        else:
+            write_glb(temp_path, vertices, faces, normals)
+    os.replace(temp_path, path)
+
+    info = {'mesh_id': mesh_id, 'vertices': len(vertices), 'triangles': len(faces),
+            'voxels': int(np.count_nonzero(mask)), 'spacing': geometry['spacing'],
+            'target_triangles': target_triangles, 'smoothing_iterations': smoothing_iterations}
+    _write_json(os.path.join(mesh_dir, MESH_INFO_NAME), info)
+    print(f"[INFO] Mesh {mesh_id}: {len(faces)} triangles written to {path}")
+    return dict(info, format=mesh_format, path=path, cached=False)
+
+
+def export_series_mesh(input_folder, output_root, lower_threshold=100, upper_threshold=300, mesh_format='stl',
+                       target_triangles=DEFAULT_TARGET_TRIANGLES, smoothing_iterations=DEFAULT_SMOOTHING_ITERATIONS):
+    """Threshold a DICOM series (see series_mask) and export its surface mesh (see export_mesh)."""
+    mask, geometry = series_mask(input_folder, lower_threshold, upper_threshold)
+    return export_mesh(mask, geometry, output_root, mesh_format, target_triangles, smoothing_iterations)
+
+
+def lod_targets(triangles, finest=DEFAULT_TARGET_TRIANGLES, ratio=LOD_RATIO, coarsest=LOD_MIN_TRIANGLES):
+    """Triangle budgets of the levels of detail, coarsest first: each level has ratio times the triangles of the one before."""
+    targets = [min(finest, triangles)]
+    while targets[-1] // ratio >= coarsest:
+        targets.append(targets[-1] // ratio)
+    return targets[::-1]
+
+
+def lod_path(mesh_dir, level):
+    return os.path.join(mesh_dir, 'lod', f"{level}.glb")
+
+
+def load_lod_manifest(mesh_dir):
+    """The manifest of a mesh's levels of detail, or None if they have not been built."""
+    try:
+        with open(os.path.join(mesh_dir, LOD_MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def export_lods(mask, geometry, output_root, target_triangles=DEFAULT_TARGET_TRIANGLES,
+                smoothing_iterations=DEFAULT_SMOOTHING_ITERATIONS):
+    """
+    Mesh a mask at several levels of detail for progressive display, written
+    as quantized binary glTF files <output_root>/<mesh_id>/lod/<level>.glb,
+    or return the levels already built for the same mask and settings.
+
+    Level 0 is the coarsest (a few thousand triangles, a few tens of kB), so
+    a viewer can draw it at once and fetch finer levels as needed; the last
+    level has target_triangles. Each level is decimated from the next finer
+    one, so building all of them costs little more than the finest alone.
+
+    Returns:
+        dict: The manifest (mesh_id, bounds, levels [{level, triangles, vertices, bytes}]) and cached
+    """
+    with span('mesh_export', 'hash'):
+        mesh_id = mask_id(mask, geometry, target_triangles, smoothing_iterations)
+    mesh_dir = os.path.join(output_root, mesh_id)
+    manifest = load_lod_manifest(mesh_dir)
+    if manifest is not None:
+        return dict(manifest, cached=True)
+
+    surface = surface_polydata(mask, geometry, smoothing_iterations)
+    targets = lod_targets(surface.GetNumberOfPolys(), target_triangles)
+    os.makedirs(os.path.dirname(lod_path(mesh_dir, 0)), exist_ok=True)
+
+    levels = []
+    bounds = None
+    for level in reversed(range(len(targets))):
+        surface = decimate(surface, targets[level])
+        vertices, faces, normals = surface_arrays(surface, geometry)
+        if bounds is None:
+            bounds = {'min': vertices.min(axis=0).tolist(), 'max': vertices.max(axis=0).tolist()}
+        with span('mesh_export', 'write'):
+            data = glb_bytes(vertices, faces, normals)
+            path = lod_path(mesh_dir, level)
+            temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        levels.append({'level': level, 'triangles': len(faces), 'vertices': len(vertices), 'bytes': len(data)})
+
+    manifest = {'mesh_id': mesh_id, 'bounds': bounds, 'levels': levels[::-1],
+                'voxels': int(np.count_nonzero(mask)), 'spacing': geometry['spacing'],
+                'target_triangles': target_triangles, 'smoothing_iterations': smoothing_iterations}
+    _write_json(os.path.join(mesh_dir, LOD_MANIFEST_NAME), manifest)
+    print(f"[INFO] Mesh {mesh_id}: {len(levels)} levels of detail, "
+          f"{levels[-1]['triangles']} to {levels[0]['triangles']} triangles")
+    return dict(manifest, cached=False)
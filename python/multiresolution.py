@@ -0,0 +1,103 @@
+# Coarse-to-fine segmentation: classify a downsampled volume, then reclassify at full resolution only
+# the band of blocks along the coarse boundary, so the number of classified voxels follows the surface
+# area, not the volume. This pays off for expensive classifiers; thresholds use the full pass.
+#-----------------------------------
+import numpy as np
+from scipy import ndimage
+
+from .instrumentation import span
+from .rendering import threshold_mask
+
+SEGMENTATION_METHODS = ('full', 'coarse_to_fine')
+COARSE_FACTOR = 4
+BAND_BLOCKS = 1
+
+
+def threshold_classifier(lower, upper, slope=1.0, intercept=0.0):
+    """Voxel classifier for lower < HU < upper (see rendering.threshold_mask)."""
+    return lambda values: threshold_mask(values, lower, upper, slope, intercept)
+
+
+def _block_offsets(factor, ndim):
+    """Offsets of every voxel inside one block, shape (factor ** ndim, ndim)."""
+    return np.stack(np.meshgrid(*[np.arange(factor)] * ndim, indexing='ij'), axis=-1).reshape(-1, ndim)
+
+
+def coarse_to_fine(volume, classify, factor=COARSE_FACTOR, band=BAND_BLOCKS):
+    """
+    Segment volume (2D or 3D) by classifying one voxel per factor-sized block,
+    then reclassifying every voxel of the blocks within band blocks of the
+    coarse boundary.
+
+    Blocks away from the boundary take their sample's label, so structures
+    smaller than a block that do not touch the boundary (isolated noise
+    voxels) are not reproduced.
+
+    Args:
+        volume: Array to segment
+        classify: Function mapping an array of voxel values to a bool array of the same shape
+        factor: Block edge in voxels
+        band: Width of the refined band, in blocks on each side of the boundary
+
+    Returns:
+        np.ndarray: bool mask of volume's shape
+    """
+    shape = volume.shape
+    blocks = [(n + factor - 1) // factor for n in shape]
+
+    with span('multiresolution', 'coarse'):
+        # The centre voxel of each block (the last one clamped for partial blocks)
+        centres = [np.minimum(np.arange(b) * factor + factor // 2, n - 1) for b, n in zip(blocks, shape)]
+        coarse = np.asarray(classify(volume[np.ix_(*centres)]), dtype=bool)
+
+        structure = ndimage.generate_binary_structure(volume.ndim, volume.ndim)
+        uncertain = (ndimage.binary_dilation(coarse, structure, iterations=band)
+                     & ~ndimage.binary_erosion(coarse, structure, iterations=band, border_value=1))
+
+        # Each block label repeated over its voxels: np.repeat on the inner axes, which are
+        # small, then one broadcast copy along the first axis
+        plane = coarse
+        for axis in range(1, volume.ndim):
+            plane = np.repeat(plane, factor, axis=axis)
+        mask = np.empty((blocks[0], factor) + plane.shape[1:], dtype=bool)
+        mask[:] = plane[:, None]
+        mask = mask.reshape((blocks[0] * factor,) + plane.shape[1:])
+        mask = np.ascontiguousarray(mask[tuple(slice(0, n) for n in shape)])
+
+    with span('multiresolution', 'refine'):
+        band_blocks = np.argwhere(uncertain)
+        if len(band_blocks):
+            # Full-resolution indices of every voxel in the band, gathered and classified in one pass
+            voxels = (band_blocks[:, None, :] * factor + _block_offsets(factor, volume.ndim)[None]).reshape(-1, volume.ndim)
+            voxels = np.minimum(voxels, np.asarray(shape) - 1)
+            index = tuple(voxels.T)
+            mask[index] = classify(volume[index])
+    return mask
+
+
+def segment(volume, classify, method='full', factor=COARSE_FACTOR):
+    """
+    Segment volume with a voxel classifier, shared by the threshold-based entry points.
+
+    Args:
+        volume: Array to segment
+        classify: Function mapping voxel values to a bool array (e.g. threshold_classifier())
+        method: 'full' (classify every voxel) or 'coarse_to_fine' (see coarse_to_fine).
+                coarse_to_fine only pays off when classify is expensive per voxel: a
+                threshold is one vectorised compare, cheaper than gathering the band
+                (see benchmarks/bench_segmentation.py)
+
+    Returns:
+        np.ndarray: bool mask of volume's shape
+    """
+    if method not in SEGMENTATION_METHODS:
+        raise ValueError(f"Unknown segmentation method '{method}'. Choose from: {', '.join(SEGMENTATION_METHODS)}")
+    if method == 'full' or min(volume.shape) < 2 * factor:
+        with span('multiresolution', 'full'):
+            return np.asarray(classify(volume), dtype=bool)
+    return coarse_to_fine(volume, classify, factor)
+
+
+def segment_threshold(volume, lower, upper, slope=1.0, intercept=0.0, method='full'):
+    """Threshold segmentation (lower < HU < upper) through segment()."""
+    return segment(volume, threshold_classifier(lower, upper, slope, intercept), method)
@@ -0,0 +1,168 @@
+# On-demand profiling helpers for live workers: stack sampling, cProfile and tracemalloc reports.
+#-----------------------------------
+import collections
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PYTHON_MODULES_DIR = os.path.join(APP_ROOT, 'python')
+
+# Leaf functions of threads that are blocked waiting rather than doing work
+IDLE_FUNCTIONS = {'wait', 'select', 'poll', 'epoll', 'accept', 'sleep', 'recv', 'recv_into',
+                  'readinto', '_recv_bytes', 'get', 'serve_forever', '_wait_for_tstate_lock'}
+
+MAX_SAMPLE_SECONDS = 120
+PROFILE_MODES = ('cprofile', 'tracemalloc')
+
+
+def _frame_label(code):
+    """Label a frame as 'function (path:line)', with paths relative to the app root."""
+    filename = code.co_filename
+    if filename.startswith(APP_ROOT):
+        filename = os.path.relpath(filename, APP_ROOT)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds, interval=0.005, include_idle=False):
+    """
+    Sample the Python stacks of every other thread in this process.
+
+    Args:
+        seconds: How long to sample for (capped at MAX_SAMPLE_SECONDS)
+        interval: Delay between samples in seconds
+        include_idle: Keep stacks of threads that are blocked waiting
+
+    Returns:
+        tuple: (Counter of root-first stacks joined with ';', number of sampling rounds)
+    """
+    seconds = min(max(float(seconds), 0.0), MAX_SAMPLE_SECONDS)
+    counts = collections.Counter()
+    sampler_id = threading.get_ident()
+    deadline = time.monotonic() + seconds
+    rounds = 0
+
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == sampler_id:
+                continue
+            if not include_idle and frame.f_code.co_name in IDLE_FUNCTIONS:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            counts[';'.join(stack)] += 1
+        rounds += 1
+        time.sleep(interval)
+
+    return counts, rounds
+
+
+def format_folded(counts):
+    """Format sampled stacks in the folded format read by flamegraph.pl and speedscope."""
+    return "\n".join(f"{stack} {count}" for stack, count in counts.most_common()) + "\n"
+
+
+class RequestProfiler:
+    """
+    Profile a single request with cProfile (CPU time) or tracemalloc (memory).
+
+    Call start() before the view runs and stop() after it, on the same thread.
+    The report lists the top functions, and a second section keeps only
+    functions from the python/ processing modules.
+    """
+
+    def __init__(self, mode, limit=30):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode '{mode}'. Choose from: {', '.join(PROFILE_MODES)}")
+        self.mode = mode
+        self.limit = limit
+        self.profile_id = uuid.uuid4().hex
+        self._profiler = None
+        self._snapshot = None
+        self._started_tracemalloc = False
+
+    def start(self):
+        if self.mode == 'cprofile':
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(25)
+                self._started_tracemalloc = True
+            self._snapshot = tracemalloc.take_snapshot()
+
+    def stop(self, output_dir):
+        """
+        Stop profiling and write the report to output_dir.
+
+        Returns:
+            dict: profile_id, mode, report text and the paths written
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        paths = {}
+        if self.mode == 'cprofile':
+            self._profiler.disable()
+            report = self._cprofile_report()
+            paths['pstats'] = os.path.join(output_dir, f"{self.profile_id}.prof")
+            self._profiler.dump_stats(paths['pstats'])
+        else:
+            report = self._tracemalloc_report()
+
+        paths['report'] = os.path.join(output_dir, f"{self.profile_id}.txt")
+        with open(paths['report'], 'w') as f:
+            f.write(report)
+
+        return {
+            'profile_id': self.profile_id,
+            'mode': self.mode,
+            'report': report,
+            'paths': paths
+        }
+
+    def _cprofile_report(self):
+        out = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=out)
+        stats.sort_stats('cumulative')
+        out.write("=== Top functions by cumulative time ===\n")
+        stats.print_stats(self.limit)
+        out.write("\n=== python/ modules by cumulative time ===\n")
+        stats.print_stats(re.escape(os.path.join(PYTHON_MODULES_DIR, '')), self.limit)
+        return out.getvalue()
+
+    def _tracemalloc_report(self):
+        snapshot = tracemalloc.take_snapshot()
+        _, traced_peak = tracemalloc.get_traced_memory()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+        # Leave out the profiler's own bookkeeping
+        own_files = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        snapshot = snapshot.filter_traces(own_files)
+        baseline = self._snapshot.filter_traces(own_files)
+
+        out = io.StringIO()
+        out.write(f"Peak traced memory: {traced_peak / (1024 * 1024):.1f} MB\n\n")
+        out.write("=== Memory still held after the request (by line) ===\n")
+        for stat in snapshot.compare_to(baseline, 'lineno')[:self.limit]:
+            out.write(f"{stat}\n")
+
+        # all_frames attributes allocations made inside numpy/pandas to the python/ caller
+        module_filter = [tracemalloc.Filter(True, os.path.join(PYTHON_MODULES_DIR, '*'), all_frames=True)]
+        out.write("\n=== python/ modules (by traceback) ===\n")
+        module_stats = snapshot.filter_traces(module_filter).compare_to(
+            baseline.filter_traces(module_filter), 'traceback')
+        for stat in module_stats[:self.limit]:
+            out.write(f"{stat}\n")
+            for line in stat.traceback.format(limit=5):
+                out.write(f"    {line}\n")
+        return out.getvalue()
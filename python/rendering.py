@@ -0,0 +1,339 @@
+# Rendering of DICOM pixel data for display: Hounsfield conversion and windowing through cached lookup tables.
+#-----------------------------------
+from functools import lru_cache
+
+import numpy as np
+
+from .instrumentation import span
+
+# Named windows as (center, width) in Hounsfield units
+WINDOW_PRESETS = {
+    'abdomen': (40, 400),
+    'angio': (300, 600),
+    'bone': (500, 2000)
+}
+
+# Palette index of segmentation overlays in overlay_lut() images (greys use 0-254)
+OVERLAY_INDEX = 255
+
+# Integer pixel types up to 16 bits are rendered through a lookup table indexed by the stored value
+LUT_MAX_BITS = 16
+
+# SimpleITK metadata keys for the tags rendering needs
+SITK_WINDOW_CENTER = '0028|1050'
+SITK_WINDOW_WIDTH = '0028|1051'
+SITK_PHOTOMETRIC = '0028|0004'
+
+
+def _first_value(value):
+    """First number of a (possibly multi-valued) DICOM attribute such as WindowCenter, or None."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.split('\\')[0].strip()
+    elif not isinstance(value, (int, float)):
+        try:
+            value = value[0]
+        except (TypeError, IndexError):
+            return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_window(value):
+    """
+    Window from a request parameter: a preset name, 'dicom', 'auto' or 'center,width'.
+
+    Returns:
+        str, tuple or None: A window specification for get_window()
+    """
+    if not value or not value.strip():
+        return None
+    value = value.strip().lower()
+    if ',' in value:
+        center, width = value.split(',', 1)
+        try:
+            return float(center), float(width)
+        except ValueError:
+            raise ValueError(f"Invalid window '{value}'. Use center,width in HU, e.g. 40,400")
+    if value not in WINDOW_PRESETS and value not in ('dicom', 'auto'):
+        raise ValueError(f"Unknown window '{value}'. Choose from: {', '.join(WINDOW_PRESETS)}, dicom, auto")
+    return value
+
+
+def get_window(window=None, pixels=None, slope=1.0, intercept=0.0, dicom_window=None):
+    """
+    Resolve a window specification to (center, width) in Hounsfield units.
+
+    Args:
+        window: A preset name from WINDOW_PRESETS, a (center, width) pair,
+                'dicom'/None for the file's own WindowCenter/WindowWidth, or
+                'auto' to stretch the data's min..max (the old normalization)
+        pixels: Stored pixel values, needed for 'auto' and as the fallback when
+                the file has no window
+        slope, intercept: RescaleSlope/RescaleIntercept of the stored values
+        dicom_window: (center, width) from the file, or None
+
+    Returns:
+        tuple: (center, width)
+    """
+    if isinstance(window, str) and window.lower() in WINDOW_PRESETS:
+        return WINDOW_PRESETS[window.lower()]
+    if isinstance(window, (tuple, list)) and len(window) == 2:
+        return float(window[0]), float(window[1])
+    if window not in (None, 'dicom', 'auto'):
+        raise ValueError(f"Unknown window '{window}'. Choose from: {', '.join(WINDOW_PRESETS)}, dicom, auto")
+
+    if window != 'auto' and dicom_window and dicom_window[0] is not None and dicom_window[1]:
+        return dicom_window
+    if pixels is None:
+        raise ValueError("Pixel data is required for an automatic window")
+
+    # Stretch min..max over 0..255: with the DICOM linear function below that is
+    # width - 1 = max - min and center - 0.5 = min + (width - 1) / 2
+    low = float(pixels.min()) * slope + intercept
+    high = float(pixels.max()) * slope + intercept
+    low, high = min(low, high), max(low, high)
+    width = high - low + 1
+    return low + (high - low) / 2 + 0.5, width
+
+
+def _window_values(hu, center, width):
+    """DICOM PS3.3 C.11.2.1.2 linear VOI function, for building tables (float64 is fine here)."""
+    if width <= 1:
+        return np.where(hu <= center - 0.5, 0, 255).astype(np.uint8)
+    scaled = ((hu - (center - 0.5)) / (width - 1) + 0.5) * 255
+    return np.rint(np.clip(scaled, 0, 255)).astype(np.uint8)
+
+
+@lru_cache(maxsize=64)
+def window_lut(dtype_str, slope, intercept, center, width, invert=False):
+    """
+    Lookup table from every stored value of an integer pixel type to its windowed 8-bit value.
+
+    The table is indexed by the stored value reinterpreted as unsigned, so
+    signed data is looked up through a same-sized unsigned view without a copy.
+
+    Args:
+        dtype_str: numpy dtype of the stored pixels, e.g. 'int16' or 'uint16'
+        slope, intercept: Rescale to Hounsfield units
+        center, width: Window in Hounsfield units
+        invert: True for MONOCHROME1 (low values white)
+
+    Returns:
+        np.ndarray: Read-only uint8 table of 2**bits entries
+    """
+    dtype = np.dtype(dtype_str)
+    index = np.arange(1 << (8 * dtype.itemsize), dtype=np.uint64).astype(f'u{dtype.itemsize}')
+    stored = index.view(dtype).astype(np.float64)
+    lut = _window_values(stored * slope + intercept, center, width)
+    if invert:
+        lut = 255 - lut
+    lut.setflags(write=False)
+    return lut
+
+
+@lru_cache(maxsize=64)
+def threshold_lut(dtype_str, slope, intercept, lower, upper):
+    """Boolean table marking the stored values whose Hounsfield value lies strictly between lower and upper."""
+    dtype = np.dtype(dtype_str)
+    index = np.arange(1 << (8 * dtype.itemsize), dtype=np.uint64).astype(f'u{dtype.itemsize}')
+    hu = index.view(dtype).astype(np.float64) * slope + intercept
+    lut = (hu > lower) & (hu < upper)
+    lut.setflags(write=False)
+    return lut
+
+
+@lru_cache(maxsize=32)
+def overlay_lut(dtype_str, slope, intercept, center, width, invert, lower, upper):
+    """
+    Palette-index table for segmentation overlays: every stored value maps to its
+    windowed grey (capped at 254), or OVERLAY_INDEX where lower < HU < upper.
+
+    One gather through this table gives an image for overlay_palette(), as
+    apply_window() followed by threshold_mask() would, in a third of the bytes
+    of an RGB image.
+
+    Returns:
+        np.ndarray: Read-only uint8 table of 2**bits entries
+    """
+    lut = np.minimum(window_lut(dtype_str, slope, intercept, center, width, invert), OVERLAY_INDEX - 1)
+    lut[threshold_lut(dtype_str, slope, intercept, lower, upper)] = OVERLAY_INDEX
+    lut.setflags(write=False)
+    return lut
+
+
+@lru_cache(maxsize=8)
+def overlay_palette(color=(255, 0, 0)):
+    """PIL palette for overlay_lut() images: greys 0-254, then color."""
+    return tuple(int(v) for v in np.repeat(np.arange(OVERLAY_INDEX), 3)) + tuple(color)
+
+
+def _lut_index(pixels):
+    """Unsigned view of integer pixels usable as a table index, or None if the type needs the fallback path."""
+    dtype = pixels.dtype
+    if dtype.kind not in 'iu' or dtype.itemsize * 8 > LUT_MAX_BITS:
+        return None
+    if not dtype.isnative:
+        pixels = pixels.astype(dtype.newbyteorder('='))
+    return pixels.view(f'u{pixels.dtype.itemsize}')
+
+
+def apply_window(pixels, center, width, slope=1.0, intercept=0.0, invert=False):
+    """
+    Map stored pixel values to 8-bit display values.
+
+    Integer data up to 16 bits (CT, MR, CR) goes through window_lut() in a
+    single gather with no intermediate arrays. Anything else (e.g. float32
+    from a fractional RescaleSlope already applied by SimpleITK) is windowed
+    in one float32 buffer updated in place.
+
+    Returns:
+        np.ndarray: uint8 array of the same shape
+    """
+    pixels = np.asarray(pixels)
+    index = _lut_index(pixels)
+    if index is not None:
+        lut = window_lut(pixels.dtype.newbyteorder('=').name, float(slope), float(intercept),
+                         float(center), float(width), bool(invert))
+        return np.take(lut, index)
+
+    buffer = pixels.astype(np.float32)
+    if slope != 1 or intercept != 0:
+        buffer *= slope
+        buffer += intercept
+    if width <= 1:
+        result = np.where(buffer <= center - 0.5, 0, 255).astype(np.uint8)
+    else:
+        buffer -= center - 0.5
+        buffer *= 255 / (width - 1)
+        buffer += 127.5
+        np.clip(buffer, 0, 255, out=buffer)
+        np.rint(buffer, out=buffer)
+        result = buffer.astype(np.uint8)
+    if invert:
+        np.subtract(255, result, out=result)
+    return result
+
+
+def render(pixels, window=None, slope=1.0, intercept=0.0, dicom_window=None, invert=False):
+    """
+    Window stored pixel values for display.
+
+    Args:
+        pixels: Stored values of a slice or a whole volume (a volume shares one window)
+        window: See get_window(); defaults to the file's window, else min..max
+        slope, intercept: RescaleSlope/RescaleIntercept (1/0 for SimpleITK arrays, which are already in HU)
+        dicom_window: (center, width) from the file
+        invert: True for MONOCHROME1
+
+    Returns:
+        np.ndarray: uint8 image of the same shape
+    """
+    with span('rendering', 'window'):
+        center, width = get_window(window, pixels, slope, intercept, dicom_window)
+        return apply_window(pixels, center, width, slope, intercept, invert)
+
+
+def threshold_mask(pixels, lower, upper, slope=1.0, intercept=0.0):
+    """
+    Boolean mask of pixels with lower < HU < upper, computed on the stored values.
+
+    Returns:
+        np.ndarray: bool array of the same shape
+    """
+    pixels = np.asarray(pixels)
+    with span('rendering', 'threshold'):
+        index = _lut_index(pixels)
+        if index is not None:
+            lut = threshold_lut(pixels.dtype.newbyteorder('=').name, float(slope), float(intercept),
+                                float(lower), float(upper))
+            return np.take(lut, index)
+        if slope == 1 and intercept == 0:
+            return (pixels > lower) & (pixels < upper)
+        # Move the thresholds into stored-value space instead of rescaling the pixels
+        low, high = (lower - intercept) / slope, (upper - intercept) / slope
+        if slope < 0:
+            low, high = high, low
+        return (pixels > low) & (pixels < high)
+
+
+def render_overlay(pixels, center, width, lower, upper, slope=1.0, intercept=0.0, invert=False):
+    """
+    Overlay palette indices (see overlay_lut) of stored pixel values windowed to (center, width).
+
+    Returns:
+        np.ndarray: uint8 array of the same shape
+    """
+    pixels = np.asarray(pixels)
+    with span('rendering', 'overlay'):
+        index = _lut_index(pixels)
+        if index is not None:
+            lut = overlay_lut(pixels.dtype.newbyteorder('=').name, float(slope), float(intercept), float(center),
+                              float(width), bool(invert), float(lower), float(upper))
+            return np.take(lut, index)
+        result = np.minimum(apply_window(pixels, center, width, slope, intercept, invert), OVERLAY_INDEX - 1)
+        result[threshold_mask(pixels, lower, upper, slope, intercept)] = OVERLAY_INDEX
+        return result
+
+
+def dataset_render_params(ds):
+    """
+    Rendering parameters of a pydicom dataset, whose pixel_array holds raw stored values.
+
+    Returns:
+        dict: slope, intercept, dicom_window and invert, for render()/threshold_mask()
+    """
+    slope = _first_value(ds.get('RescaleSlope'))
+    intercept = _first_value(ds.get('RescaleIntercept'))
+    return {
+        'slope': 1.0 if slope in (None, 0) else slope,
+        'intercept': intercept or 0.0,
+        'dicom_window': (_first_value(ds.get('WindowCenter')), _first_value(ds.get('WindowWidth'))),
+        'invert': str(ds.get('PhotometricInterpretation', '')).strip() == 'MONOCHROME1'
+    }
+
+
+def sitk_render_params(source, slice_index=None):
+    """
+    Rendering parameters from SimpleITK metadata.
+
+    SimpleITK already applies RescaleSlope/Intercept, so slope and intercept
+    are 1 and 0.
+
+    Args:
+        source: An sitk.Image, or an ImageSeriesReader run with
+                MetaDataDictionaryArrayUpdateOn()
+        slice_index: Slice whose metadata to read when source is a series reader
+
+    Returns:
+        dict: slope, intercept, dicom_window and invert, for render()/threshold_mask()
+    """
+    def lookup(key):
+        try:
+            if slice_index is None:
+                return source.GetMetaData(key) if source.HasMetaDataKey(key) else None
+            return source.GetMetaData(slice_index, key) if source.HasMetaDataKey(slice_index, key) else None
+        except Exception:
+            return None
+
+    return {
+        'slope': 1.0,
+        'intercept': 0.0,
+        'dicom_window': (_first_value(lookup(SITK_WINDOW_CENTER)), _first_value(lookup(SITK_WINDOW_WIDTH))),
+        'invert': (lookup(SITK_PHOTOMETRIC) or '').strip() == 'MONOCHROME1'
+    }
+
+
+def render_dataset(ds, window=None):
+    """
+    Display image of a pydicom dataset (all frames for multi-frame objects).
+
+    Colour images (SamplesPerPixel > 1) are returned unchanged.
+    """
+    pixel_array = ds.pixel_array
+    if int(ds.get('SamplesPerPixel', 1) or 1) > 1:
+        return pixel_array.astype(np.uint8, copy=False)
+    return render(pixel_array, window, **dataset_render_params(ds))
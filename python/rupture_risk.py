@@ -1,5 +1,6 @@
 import numpy as np
 import os
+import threading
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib
@@ -11,6 +12,9 @@ from tensorflow import keras
 from tensorflow.keras.models import Sequential, load_model
 from tensorflow.keras.layers import Dense, Dropout
 import time
+from .instrumentation import span, timed
+from .features import (RISK_COLUMN_ALIASES, apply_column_aliases, build_risk_features,
+                       read_patient_table, risk_features_from_frame)
 
 # Define paths
 MODEL_PATH = 'models/rupture_risk_model.h5'
@@ -18,6 +22,14 @@ SCALER_PATH = 'models/rupture_risk_scaler.pkl'
 GROWTH_MODEL_PATH = 'models/aaa_growth_model.h5'
 GROWTH_SCALER_PATH = 'models/aaa_growth_scaler.pkl'
 
+# Diameter risk component: >=30mm 5%, >=35mm 10%, ... >=55mm (critical threshold) 30%
+DIAMETER_RISK_THRESHOLDS = np.array([30, 35, 40, 45, 50, 55], dtype=np.float64)
+DIAMETER_RISK_COMPONENTS = np.array([0, 0.05, 0.1, 0.15, 0.2, 0.25, 0.3], dtype=np.float64)
+
+RISK_CATEGORY_THRESHOLDS = np.array([15, 35, 65], dtype=np.float64)
+RISK_CATEGORY_LABELS = np.array(["Low", "Moderate", "High", "Very High"], dtype=object)
+
+@timed('rupture_risk', 'train')
 def train_model(force=False):
     """Train the rupture risk prediction model if it doesn't exist already."""
     
@@ -114,6 +126,7 @@ def train_model(force=False):
         print(f"[ERROR] Failed to train rupture risk model: {str(e)}")
         raise
 
+@timed('rupture_risk', 'train')
 def train_growth_model(force=False):
     """Train a simplified growth prediction model if it doesn't exist already."""
     
@@ -211,6 +224,7 @@ def train_growth_model(force=False):
         raise
 
 
+@timed('rupture_risk', 'model_load')
 def load_prediction_models():
     """Load both the rupture risk and growth prediction models"""
     try:
@@ -265,6 +279,97 @@ def load_prediction_models():
         
         return rupture_model, rupture_scaler, growth_model, growth_scaler
 
+# Models and scalers loaded once per process, reloaded when any of their files change (e.g. rewritten
+# by training in another worker)
+_model_cache = {}
+_model_lock = threading.Lock()
+
+
+def _model_version():
+    """st_mtime_ns of the model and scaler files (None if missing)."""
+    versions = []
+    for path in (MODEL_PATH, SCALER_PATH, GROWTH_MODEL_PATH, GROWTH_SCALER_PATH):
+        try:
+            versions.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            versions.append(None)
+    return tuple(versions)
+
+
+def cached_prediction_models():
+    """load_prediction_models(), cached in this process until one of the model or scaler files changes."""
+    with _model_lock:
+        cached = _model_cache.get('rupture')
+        if cached is None or cached[0] != _model_version():
+            models = load_prediction_models()
+            # Read after loading, which retrains and rewrites the files if they were unusable
+            _model_cache['rupture'] = cached = (_model_version(), models)
+        return cached[1]
+
+
+def clear_model_cache():
+    """Drop the cached models, e.g. after retraining, so the next prediction loads the new ones."""
+    with _model_lock:
+        _model_cache.clear()
+
+def _risk_from_features(features, raw_prediction):
+    """Combine model output with the diameter and ILT components (vectorized)."""
+    diameter = features[:, 0]
+    ilt_volume = features[:, 1]
+
+    # Base model prediction (50%)
+    risk_score = raw_prediction * 0.5
+
+    # Diameter component (30%)
+    risk_score += DIAMETER_RISK_COMPONENTS[np.searchsorted(DIAMETER_RISK_THRESHOLDS, diameter, side='right')]
+
+    # ILT volume component (20%)
+    risk_score += np.minimum(0.2, (ilt_volume / 100) * 0.2)
+
+    # Ensure risk is between 0-100%
+    return np.clip(risk_score * 100, 0, 100)
+
+
+def calculate_rupture_risk_batch(features, model, scaler):
+    """
+    Calculate rupture risk percentages for a prepared feature matrix.
+
+    Args:
+        features: Matrix built by features.build_risk_features
+        model: Pre-loaded prediction model
+        scaler: Pre-loaded feature scaler
+
+    Returns:
+        numpy.ndarray: Rupture risk percentages
+    """
+    with span('rupture_risk', 'scale'):
+        scaled = scaler.transform(features)
+    with span('rupture_risk', 'predict'):
+        raw_prediction = model.predict(scaled, verbose=0).reshape(-1)
+    return _risk_from_features(features, raw_prediction)
+
+
+def predict_growth_rate_batch(features, model, scaler):
+    """
+    Predict annual growth rates (mm/year) for a prepared feature matrix.
+
+    Args:
+        features: Matrix built by features.build_risk_features
+        model: Pre-loaded prediction model
+        scaler: Pre-loaded feature scaler
+
+    Returns:
+        numpy.ndarray: Predicted growth rates in mm/year
+    """
+    with span('rupture_risk', 'scale'):
+        scaled = scaler.transform(features)
+    with span('rupture_risk', 'predict'):
+        predicted_growth = model.predict(scaled, verbose=0).reshape(-1)
+
+    # Ensure growth rate is non-negative and reasonable
+    return np.clip(predicted_growth, 0, 10)
+
+
 def calculate_rupture_risk(diameter, ilt_volume, wall_stress=None, blood_pressure=None, 
                           age=None, smoking=None, gender=None, model=None, scaler=None):
     """
@@ -286,61 +391,12 @@ def calculate_rupture_risk(diameter, ilt_volume, wall_stress=None, blood_pressur
     """
     # Load model and scaler if not provided
     if model is None or scaler is None:
-        rupture_model, rupture_scaler, _, _ = load_prediction_models()
+        rupture_model, rupture_scaler, _, _ = cached_prediction_models()
         model = rupture_model
         scaler = rupture_scaler
     
-    # Set default values for missing optional fields
-    wall_stress = 150.0 if wall_stress is None else wall_stress
-    blood_pressure = 140 if blood_pressure is None else blood_pressure
-    age = 65 if age is None else age
-    smoking_numeric = 0 if smoking is None else (1 if smoking.lower() in ["yes", "y", "true", "1"] else 0)
-    gender_numeric = 1 if gender is None else (1 if gender.lower() in ["m", "male"] else 0)
-    
-    # Create input data
-    input_data = np.array([[
-        float(diameter),
-        float(ilt_volume),
-        float(wall_stress),
-        float(blood_pressure),
-        float(age),
-        smoking_numeric,
-        gender_numeric
-    ]])
-    
-    # Scale input
-    input_scaled = scaler.transform(input_data)
-    
-    # Get base prediction from model
-    raw_prediction = float(model.predict(input_scaled)[0][0])
-    
-    # Calculate composite risk score
-    # Base model prediction (50%)
-    model_component = raw_prediction * 0.5
-    
-    # Diameter component (30%)
-    diameter_component = 0
-    if diameter >= 55:  # Critical threshold
-        diameter_component = 0.3
-    elif diameter >= 50:
-        diameter_component = 0.25
-    elif diameter >= 45:
-        diameter_component = 0.2
-    elif diameter >= 40:
-        diameter_component = 0.15
-    elif diameter >= 35:
-        diameter_component = 0.1
-    elif diameter >= 30:
-        diameter_component = 0.05
-    
-    # ILT volume component (20%)
-    ilt_component = min(0.2, (ilt_volume / 100) * 0.2)
-    
-    # Combine components
-    risk_score = (model_component + diameter_component + ilt_component) * 100
-    
-    # Ensure risk is between 0-100%
-    return min(100, max(0, risk_score))
+    features = build_risk_features(diameter, ilt_volume, wall_stress, blood_pressure, age, smoking, gender)
+    return float(calculate_rupture_risk_batch(features, model, scaler)[0])
 
 def predict_growth_rate(diameter, ilt_volume, wall_stress=None, blood_pressure=None, 
                        age=None, smoking=None, gender=None, model=None, scaler=None):
@@ -363,36 +419,47 @@ def predict_growth_rate(diameter, ilt_volume, wall_stress=None, blood_pressure=N
     """
     # Load model and scaler if not provided
     if model is None or scaler is None:
-        _, _, growth_model, growth_scaler = load_prediction_models()
+        _, _, growth_model, growth_scaler = cached_prediction_models()
         model = growth_model
         scaler = growth_scaler
     
-    # Set default values for missing optional fields
-    wall_stress = 150.0 if wall_stress is None else wall_stress
-    blood_pressure = 140 if blood_pressure is None else blood_pressure
-    age = 65 if age is None else age
-    smoking_numeric = 0 if smoking is None else (1 if smoking.lower() in ["yes", "y", "true", "1"] else 0)
-    gender_numeric = 1 if gender is None else (1 if gender.lower() in ["m", "male"] else 0)
-    
-    # Create input data
-    input_data = np.array([[
-        float(diameter),
-        float(ilt_volume),
-        float(wall_stress),
-        float(blood_pressure),
-        float(age),
-        smoking_numeric,
-        gender_numeric
-    ]])
-    
-    # Scale input
-    input_scaled = scaler.transform(input_data)
-    
-    # Get prediction from model
-    predicted_growth = float(model.predict(input_scaled)[0][0])
-    
-    # Ensure growth rate is non-negative and reasonable
-    return max(0, min(10, predicted_growth))
+    features = build_risk_features(diameter, ilt_volume, wall_stress, blood_pressure, age, smoking, gender)
+    return float(predict_growth_rate_batch(features, model, scaler)[0])
+
+def predict_risk_progression(features, rupture_model, rupture_scaler, growth_model, growth_scaler):
+    """
+    Predict current, 1-year and 5-year rupture risk for a feature matrix.
+
+    The three time points are stacked into a single matrix so the rupture
+    model runs once for the whole cohort.
+
+    Returns:
+        dict: Arrays keyed by growth_rate, diameter_1yr, diameter_5yr,
+              current_risk, risk_1yr and risk_5yr
+    """
+    n = features.shape[0]
+    growth_rate = predict_growth_rate_batch(features, growth_model, growth_scaler)
+
+    stacked = np.empty((3 * n, features.shape[1]), dtype=np.float64)
+    stacked[:n] = features
+    stacked[n:2 * n] = features
+    stacked[2 * n:] = features
+    # Future diameters and ages (ILT kept at current value as simplification)
+    stacked[n:2 * n, 0] += growth_rate
+    stacked[n:2 * n, 4] += 1
+    stacked[2 * n:, 0] += growth_rate * 5
+    stacked[2 * n:, 4] += 5
+
+    risks = calculate_rupture_risk_batch(stacked, rupture_model, rupture_scaler)
+
+    return {
+        "growth_rate": growth_rate,
+        "diameter_1yr": stacked[n:2 * n, 0],
+        "diameter_5yr": stacked[2 * n:, 0],
+        "current_risk": risks[:n],
+        "risk_1yr": risks[n:2 * n],
+        "risk_5yr": risks[2 * n:]
+    }
 
 def risk_category(risk_percentage):
     """Determine risk category based on risk percentage"""
@@ -405,6 +472,156 @@ def risk_category(risk_percentage):
     else:
         return "Very High"
 
+def risk_categories(risk_percentages):
+    """Vectorized risk_category for an array of risk percentages."""
+    return RISK_CATEGORY_LABELS[np.searchsorted(RISK_CATEGORY_THRESHOLDS, risk_percentages, side='right')]
+
+@timed('rupture_risk', 'plot')
+def create_patient_progression_visualization(df, output_dir, timestamp):
+    """
+    Plot risk progression for up to 4 patients with a mix of risk levels.
+
+    Returns:
+        str: Path to the saved chart
+    """
+    # Choose up to 4 patients to showcase detailed progression
+    patient_count = min(4, len(df))
+    if len(df) > patient_count:
+        # Get a mix of different risk levels
+        risk_sorted = df.sort_values("Current Risk (%)")
+        sample_indices = [
+            int(i * len(df) / patient_count) for i in range(patient_count)
+        ]
+        selected_patients = risk_sorted.iloc[sample_indices]
+    else:
+        selected_patients = df
+    
+    # Create individual patient charts
+    fig, axes = plt.subplots(1, patient_count, figsize=(15, 5))
+    if patient_count == 1:
+        axes = [axes]  # Make axes iterable if only one subplot
+        
+    for i, (_, patient) in enumerate(selected_patients.iterrows()):
+        # Get patient data
+        patient_id = patient["Patient ID"]
+        risks = [
+            patient["Current Risk (%)"],
+            patient["Risk at 1 Year (%)"],
+            patient["Risk at 5 Years (%)"]
+        ]
+        diameters = [
+            patient["Axial Diameter (mm)"],
+            patient["Diameter at 1 Year (mm)"],
+            patient["Diameter at 5 Years (mm)"]
+        ]
+        
+        # Plot risk progression
+        color = 'green' if risks[0] < 35 else 'orange' if risks[0] < 65 else 'red'
+        axes[i].plot([0, 1, 5], risks, marker='o', color=color, linewidth=2)
+        
+        # Add threshold lines
+        axes[i].axhline(y=35, color='orange', linestyle='--', alpha=0.5, label='Moderate Risk')
+        axes[i].axhline(y=65, color='red', linestyle='--', alpha=0.5, label='High Risk')
+        
+        # Add current diameter info
+        for j, (year, risk, diameter) in enumerate(zip([0, 1, 5], risks, diameters)):
+            axes[i].annotate(f"{diameter:.1f}mm", 
+                            xy=(year, risk), 
+                            xytext=(0, 10), 
+                            textcoords='offset points',
+                            ha='center')
+        
+        # Set labels and title
+        axes[i].set_xlabel('Years')
+        if i == 0:
+            axes[i].set_ylabel('Rupture Risk (%)')
+        axes[i].set_title(f"Patient {patient_id}")
+        
+        # Set x and y limits
+        axes[i].set_xlim(-0.5, 5.5)
+        axes[i].set_ylim(0, 100)
+        
+        # Add risk category labels on y-axis
+        axes[i].text(-0.5, 17.5, "Low", va='center', ha='center', 
+                     bbox=dict(facecolor='green', alpha=0.2))
+        axes[i].text(-0.5, 50, "Moderate", va='center', ha='center', 
+                     bbox=dict(facecolor='orange', alpha=0.2))
+        axes[i].text(-0.5, 82.5, "High", va='center', ha='center', 
+                     bbox=dict(facecolor='red', alpha=0.2))
+    
+    # Add overall title
+    fig.suptitle("Patient-Specific AAA Rupture Risk Progression", fontsize=16)
+    plt.tight_layout(rect=[0, 0, 1, 0.95])  # Adjust for suptitle
+    
+    # Save the plot
+    patient_plot_path = os.path.join(output_dir, f"patient_risk_progression_{timestamp}.png")
+    plt.savefig(patient_plot_path)
+    plt.close()
+    
+    return patient_plot_path
+
+def predict_risk_frame(df, rupture_model, rupture_scaler, growth_model, growth_scaler):
+    """
+    Add current and projected rupture risk, growth and risk categories to a patient table (in place).
+
+    Raises:
+        ValueError: Required columns are missing
+    """
+    # Map column names to expected format if needed (handle variations in column names)
+    apply_column_aliases(df, RISK_COLUMN_ALIASES)
+    
+    # Check for required columns
+    required_columns = ["Axial Diameter (mm)", "ILT Volume (mL)"]
+    missing_columns = [col for col in required_columns if col not in df.columns]
+    
+    if missing_columns:
+        raise ValueError(f"Missing required columns: {', '.join(missing_columns)}")
+    
+    # Add Patient ID if missing (use row index)
+    if "Patient ID" not in df.columns:
+        df["Patient ID"] = [f"P{i+1:03d}" for i in range(len(df))]
+    
+    # Build the model matrix (categorical encoding and defaults for missing values)
+    with span('rupture_risk', 'features'):
+        features = risk_features_from_frame(df)
+    
+    # Store encoded and defaulted values for display and CSV output
+    df["Smoking_Numeric"] = features[:, 5].astype(np.int64)
+    df["Gender_Numeric"] = features[:, 6].astype(np.int64)
+    if "Smoking History" not in df.columns:
+        df["Smoking History"] = "No"  # For display purposes
+    if "Gender" not in df.columns:
+        df["Gender"] = "M"  # For display purposes
+    df["Peak Wall Stress (kPa)"] = features[:, 2]
+    df["Blood Pressure (mmHg)"] = features[:, 3]
+    df["Age"] = features[:, 4]
+    
+    # Predict growth and current/future rupture risk for all patients at once
+    progression = predict_risk_progression(
+        features, rupture_model, rupture_scaler, growth_model, growth_scaler
+    )
+    
+    df["Current Risk (%)"] = progression["current_risk"]
+    df["Growth Rate (mm/year)"] = progression["growth_rate"]
+    df["Diameter at 1 Year (mm)"] = progression["diameter_1yr"]
+    df["Diameter at 5 Years (mm)"] = progression["diameter_5yr"]
+    df["Risk at 1 Year (%)"] = progression["risk_1yr"]
+    df["Risk at 5 Years (%)"] = progression["risk_5yr"]
+    
+    # Determine risk categories
+    df["Current Risk Category"] = risk_categories(progression["current_risk"])
+    df["Risk Category at 1 Year"] = risk_categories(progression["risk_1yr"])
+    df["Risk Category at 5 Years"] = risk_categories(progression["risk_5yr"])
+    return df
+
+def write_risk_predictions(df, output_dir, timestamp):
+    """Save a predicted patient table as rupture_risk_predictions_<timestamp>.csv and return its path."""
+    os.makedirs(output_dir, exist_ok=True)
+    results_path = os.path.join(output_dir, f"rupture_risk_predictions_{timestamp}.csv")
+    with span('rupture_risk', 'write_csv'):
+        df.to_csv(results_path, index=False)
+    return results_path
+
 def predict_rupture_risk_from_excel(excel_path, output_dir):
     """
     Process patient data from Excel file and predict rupture risk over time.
@@ -421,230 +638,27 @@ def predict_rupture_risk_from_excel(excel_path, output_dir):
         print(f"[INFO] Processing rupture risk predictions from: {excel_path}")
         
         # Load prediction models
-        rupture_model, rupture_scaler, growth_model, growth_scaler = load_prediction_models()
+        rupture_model, rupture_scaler, growth_model, growth_scaler = cached_prediction_models()
         
         # Load data from Excel
-        if excel_path.endswith('.csv'):
-            df = pd.read_csv(excel_path)
-        else:
-            df = pd.read_excel(excel_path)
+        with span('rupture_risk', 'read_input'):
+            df = read_patient_table(excel_path)
         
         print(f"[INFO] Loaded {len(df)} records from file")
         
-        # Map column names to expected format if needed (handle variations in column names)
-        column_mapping = {
-            "AneurysmSize": "Axial Diameter (mm)",
-            "Diameter": "Axial Diameter (mm)",
-            "AxialDiameter": "Axial Diameter (mm)",
-            "AAA_Size": "Axial Diameter (mm)",
-            "ILT_Volume": "ILT Volume (mL)",
-            "Wall_Stress": "Peak Wall Stress (kPa)",
-            "WallStress": "Peak Wall Stress (kPa)",
-            "BP": "Blood Pressure (mmHg)",
-            "BloodPressure": "Blood Pressure (mmHg)",
-            "Smoking": "Smoking History",
-            "PatientID": "Patient ID",
-            "ID": "Patient ID"
-        }
-        
-        for original, target in column_mapping.items():
-            if original in df.columns and target not in df.columns:
-                df[target] = df[original]
-        
-        # Check for required columns
-        required_columns = ["Axial Diameter (mm)", "ILT Volume (mL)"]
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        
-        if missing_columns:
-            return {"error": f"Missing required columns: {', '.join(missing_columns)}"}
-        
-        # Add Patient ID if missing (use row index)
-        if "Patient ID" not in df.columns:
-            df["Patient ID"] = [f"P{i+1:03d}" for i in range(len(df))]
-            
-        # Convert categorical variables to numeric if present
-        if "Smoking History" in df.columns:
-            df["Smoking_Numeric"] = df["Smoking History"].map(
-                {"Yes": 1, "No": 0, "yes": 1, "no": 0, "Y": 1, "N": 0, "y": 1, "n": 0})
-        else:
-            df["Smoking_Numeric"] = 0  # Default if not provided
-            df["Smoking History"] = "No"  # For display purposes
-            
-        if "Gender" in df.columns:
-            df["Gender_Numeric"] = df["Gender"].map(
-                {"M": 1, "F": 0, "m": 1, "f": 0, "Male": 1, "Female": 0, "male": 1, "female": 0})
-        else:
-            df["Gender_Numeric"] = 1  # Default to male (more common for AAA)
-            df["Gender"] = "M"  # For display purposes
-            
-        # Add default values for other optional columns if missing
-        if "Peak Wall Stress (kPa)" not in df.columns:
-            # Estimate wall stress from diameter (simplified relationship)
-            df["Peak Wall Stress (kPa)"] = df["Axial Diameter (mm)"] * 3
-            
-        if "Blood Pressure (mmHg)" not in df.columns:
-            df["Blood Pressure (mmHg)"] = 140  # Default value
-            
-        if "Age" not in df.columns:
-            df["Age"] = 65  # Default value
-        
-        # Calculate current rupture risk for each patient
-        df["Current Risk (%)"] = df.apply(
-            lambda row: calculate_rupture_risk(
-                row["Axial Diameter (mm)"],
-                row["ILT Volume (mL)"],
-                row["Peak Wall Stress (kPa)"],
-                row["Blood Pressure (mmHg)"],
-                row["Age"],
-                "Yes" if "Smoking_Numeric" in row and row["Smoking_Numeric"] == 1 else "No",
-                "M" if "Gender_Numeric" in row and row["Gender_Numeric"] == 1 else "F",
-                rupture_model,
-                rupture_scaler
-            ),
-            axis=1
-        )
-        
-        # Calculate growth rate for each patient
-        df["Growth Rate (mm/year)"] = df.apply(
-            lambda row: predict_growth_rate(
-                row["Axial Diameter (mm)"],
-                row["ILT Volume (mL)"],
-                row["Peak Wall Stress (kPa)"],
-                row["Blood Pressure (mmHg)"],
-                row["Age"],
-                "Yes" if "Smoking_Numeric" in row and row["Smoking_Numeric"] == 1 else "No",
-                "M" if "Gender_Numeric" in row and row["Gender_Numeric"] == 1 else "F",
-                growth_model,
-                growth_scaler
-            ),
-            axis=1
-        )
-        
-        # Calculate predicted diameter at future time points
-        df["Diameter at 1 Year (mm)"] = df["Axial Diameter (mm)"] + df["Growth Rate (mm/year)"]
-        df["Diameter at 5 Years (mm)"] = df["Axial Diameter (mm)"] + (df["Growth Rate (mm/year)"] * 5)
-        
-        # Calculate risk at future time points
-        df["Risk at 1 Year (%)"] = df.apply(
-            lambda row: calculate_rupture_risk(
-                row["Diameter at 1 Year (mm)"],
-                row["ILT Volume (mL)"],  # ILT might also grow but using current value as simplification
-                row["Peak Wall Stress (kPa)"], 
-                row["Blood Pressure (mmHg)"],
-                row["Age"] + 1 if "Age" in df.columns else 66,
-                "Yes" if "Smoking_Numeric" in row and row["Smoking_Numeric"] == 1 else "No",
-                "M" if "Gender_Numeric" in row and row["Gender_Numeric"] == 1 else "F",
-                rupture_model,
-                rupture_scaler
-            ),
-            axis=1
-        )
-        
-        df["Risk at 5 Years (%)"] = df.apply(
-            lambda row: calculate_rupture_risk(
-                row["Diameter at 5 Years (mm)"],
-                row["ILT Volume (mL)"],  # Simplified - using current ILT
-                row["Peak Wall Stress (kPa)"],
-                row["Blood Pressure (mmHg)"],
-                row["Age"] + 5 if "Age" in df.columns else 70,
-                "Yes" if "Smoking_Numeric" in row and row["Smoking_Numeric"] == 1 else "No",
-                "M" if "Gender_Numeric" in row and row["Gender_Numeric"] == 1 else "F",
-                rupture_model,
-                rupture_scaler
-            ),
-            axis=1
-        )
-        
-        # Determine risk categories
-        df["Current Risk Category"] = df["Current Risk (%)"].apply(risk_category)
-        df["Risk Category at 1 Year"] = df["Risk at 1 Year (%)"].apply(risk_category)
-        df["Risk Category at 5 Years"] = df["Risk at 5 Years (%)"].apply(risk_category)
-        
-        # Create results directory
-        os.makedirs(output_dir, exist_ok=True)
+        try:
+            predict_risk_frame(df, rupture_model, rupture_scaler, growth_model, growth_scaler)
+        except ValueError as e:
+            return {"error": str(e)}
         
         # Generate timestamp for unique filenames
         timestamp = time.strftime("%Y%m%d-%H%M%S")
         
         # Save detailed results to CSV
-        results_path = os.path.join(output_dir, f"rupture_risk_predictions_{timestamp}.csv")
-        df.to_csv(results_path, index=False)
-    
+        results_path = write_risk_predictions(df, output_dir, timestamp)
         
-        # Create second visualization - patient-specific progression charts
-        # Choose up to 4 patients to showcase detailed progression
-        patient_count = min(4, len(df))
-        if len(df) > patient_count:
-            # Get a mix of different risk levels
-            risk_sorted = df.sort_values("Current Risk (%)")
-            sample_indices = [
-                int(i * len(df) / patient_count) for i in range(patient_count)
-            ]
-            selected_patients = risk_sorted.iloc[sample_indices]
-        else:
-            selected_patients = df
-        
-        # Create individual patient charts
-        fig, axes = plt.subplots(1, patient_count, figsize=(15, 5))
-        if patient_count == 1:
-            axes = [axes]  # Make axes iterable if only one subplot
-            
-        for i, (_, patient) in enumerate(selected_patients.iterrows()):
-            # Get patient data
-            patient_id = patient["Patient ID"]
-            risks = [
-                patient["Current Risk (%)"],
-                patient["Risk at 1 Year (%)"],
-                patient["Risk at 5 Years (%)"]
-            ]
-            diameters = [
-                patient["Axial Diameter (mm)"],
-                patient["Diameter at 1 Year (mm)"],
-                patient["Diameter at 5 Years (mm)"]
-            ]
-            
-            # Plot risk progression
-            color = 'green' if risks[0] < 35 else 'orange' if risks[0] < 65 else 'red'
-            axes[i].plot([0, 1, 5], risks, marker='o', color=color, linewidth=2)
-            
-            # Add threshold lines
-            axes[i].axhline(y=35, color='orange', linestyle='--', alpha=0.5, label='Moderate Risk')
-            axes[i].axhline(y=65, color='red', linestyle='--', alpha=0.5, label='High Risk')
-            
-            # Add current diameter info
-            for j, (year, risk, diameter) in enumerate(zip([0, 1, 5], risks, diameters)):
-                axes[i].annotate(f"{diameter:.1f}mm", 
-                                xy=(year, risk), 
-                                xytext=(0, 10), 
-                                textcoords='offset points',
-                                ha='center')
-            
-            # Set labels and title
-            axes[i].set_xlabel('Years')
-            if i == 0:
-                axes[i].set_ylabel('Rupture Risk (%)')
-            axes[i].set_title(f"Patient {patient_id}")
-            
-            # Set x and y limits
-            axes[i].set_xlim(-0.5, 5.5)
-            axes[i].set_ylim(0, 100)
-            
-            # Add risk category labels on y-axis
-            axes[i].text(-0.5, 17.5, "Low", va='center', ha='center', 
-                         bbox=dict(facecolor='green', alpha=0.2))
-            axes[i].text(-0.5, 50, "Moderate", va='center', ha='center', 
-                         bbox=dict(facecolor='orange', alpha=0.2))
-            axes[i].text(-0.5, 82.5, "High", va='center', ha='center', 
-                         bbox=dict(facecolor='red', alpha=0.2))
-        
-        # Add overall title
-        fig.suptitle("Patient-Specific AAA Rupture Risk Progression", fontsize=16)
-        plt.tight_layout(rect=[0, 0, 1, 0.95])  # Adjust for suptitle
-        
-        # Save the plot
-        patient_plot_path = os.path.join(output_dir, f"patient_risk_progression_{timestamp}.png")
-        plt.savefig(patient_plot_path)
-        plt.close()
+        # Create patient-specific progression charts
+        patient_plot_path = create_patient_progression_visualization(df, output_dir, timestamp)
         
         # Prepare summary statistics
         stats = {
@@ -708,40 +722,28 @@ def predict_rupture_risk_from_input(diameter, ilt_volume, wall_stress=None, bloo
     """
     try:
         # Load prediction models
-        rupture_model, rupture_scaler, growth_model, growth_scaler = load_prediction_models()
-        
-        # Set default values for missing optional parameters
-        wall_stress = wall_stress or diameter * 3  # Estimated relationship
-        blood_pressure = blood_pressure or 140
-        age = age or 65
-        smoking_value = 1 if smoking and smoking.lower() in ["yes", "y", "true", "1"] else 0
-        gender_value = 1 if not gender or gender.lower() in ["m", "male"] else 0
-        
-        # Calculate current risk
-        current_risk = calculate_rupture_risk(
-            diameter, ilt_volume, wall_stress, blood_pressure, 
-            age, smoking, gender, rupture_model, rupture_scaler
-        )
-        
-        # Predict growth rate
-        growth_rate = predict_growth_rate(
-            diameter, ilt_volume, wall_stress, blood_pressure,
-            age, smoking, gender, growth_model, growth_scaler
-        )
-        
-        # Calculate future diameters and risks
-        diameter_1yr = diameter + growth_rate
-        diameter_5yr = diameter + (growth_rate * 5)
-        
-        risk_1yr = calculate_rupture_risk(
-            diameter_1yr, ilt_volume, wall_stress, blood_pressure,
-            age + 1, smoking, gender, rupture_model, rupture_scaler
-        )
-        
-        risk_5yr = calculate_rupture_risk(
-            diameter_5yr, ilt_volume, wall_stress, blood_pressure,
-            age + 5, smoking, gender, rupture_model, rupture_scaler
+        rupture_model, rupture_scaler, growth_model, growth_scaler = cached_prediction_models()
+        
+        # Build the model matrix (shared defaults and categorical encoding)
+        with span('rupture_risk', 'features'):
+            features = build_risk_features(diameter, ilt_volume, wall_stress, blood_pressure,
+                                           age, smoking, gender)
+        wall_stress = float(features[0, 2])
+        blood_pressure = float(features[0, 3])
+        age = float(features[0, 4])
+        smoking_value = int(features[0, 5])
+        gender_value = int(features[0, 6])
+        
+        # Predict growth rate and current/future risks
+        progression = predict_risk_progression(
+            features, rupture_model, rupture_scaler, growth_model, growth_scaler
         )
+        current_risk = float(progression["current_risk"][0])
+        growth_rate = float(progression["growth_rate"][0])
+        diameter_1yr = float(progression["diameter_1yr"][0])
+        diameter_5yr = float(progression["diameter_5yr"][0])
+        risk_1yr = float(progression["risk_1yr"][0])
+        risk_5yr = float(progression["risk_5yr"][0])
         
         # Determine risk categories
         current_category = risk_category(current_risk)
@@ -834,9 +836,10 @@ def predict_rupture_risk_from_input(diameter, ilt_volume, wall_stress=None, bloo
             
             # Save the plot
             plot_path = os.path.join(output_dir, f"risk_progression_{timestamp}.png")
-            plt.tight_layout()
-            plt.savefig(plot_path, dpi=100)
-            plt.close()
+            with span('rupture_risk', 'plot'):
+                plt.tight_layout()
+                plt.savefig(plot_path, dpi=100)
+                plt.close()
             
             # Create results structure
             return {
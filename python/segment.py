@@ -1,7 +1,11 @@
 import SimpleITK as sitk
+import numpy as np
 import os
 
-def segment_aneurysm(dicom_folder, output_folder):
+from .multiresolution import segment
+from .roi import crop_image, image_roi, uncrop_image
+
+def segment_aneurysm(dicom_folder, output_folder, crop_to_roi=False, method='full'):
     # Placeholder for aneurysm segmentation
     # Segment other types of aneurysms based on the DICOM series
     
@@ -10,9 +14,18 @@ def segment_aneurysm(dicom_folder, output_folder):
     reader.SetFileNames(dicom_files)
     image = reader.Execute()
 
-    # Example: Segment the image using a simple threshold
-    segmented_image = sitk.BinaryThreshold(image, lowerThreshold=150, upperThreshold=500, insideValue=1, outsideValue=0)
+    # With crop_to_roi, threshold only the region around the aorta candidate and paste the result back
+    roi = image_roi(image, 150, 500) if crop_to_roi else None
+    region = crop_image(image, roi) if roi else image
+
+    # Example: Segment the image using a simple threshold (inclusive, like sitk.BinaryThreshold)
+    mask = segment(sitk.GetArrayViewFromImage(region), lambda values: (values >= 150) & (values <= 500), method)
+    segmented_image = sitk.GetImageFromArray(mask.astype(np.uint8))
+    segmented_image.CopyInformation(region)
+    if roi:
+        segmented_image = uncrop_image(segmented_image, image, roi)
     result_file = os.path.join(output_folder, "segmented_aneurysm.nii")
     
     sitk.WriteImage(segmented_image, result_file)
     print(f"[INFO] Segmentation completed. Results saved to {result_file}")
+    return result_file
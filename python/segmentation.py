@@ -11,20 +11,36 @@ import traceback
 import logging
 import matplotlib.pyplot as plt
 from .dicom_processor import read_dicom_folder, extract_zip
+from .instrumentation import span
+from .rendering import apply_window, dataset_render_params, get_window, render, sitk_render_params
+from .roi import find_roi
+from .multiresolution import segment_threshold
 
-def apply_segmentation(input_folder, output_folder, lower_threshold=100, upper_threshold=300):
+def apply_segmentation(input_folder, output_folder, lower_threshold=100, upper_threshold=300, window=None,
+                       crop_to_roi=False, method='full', session=None):
     """
     Apply segmentation to all DICOM files in a folder to highlight aortic aneurysm regions.
     
     Args:
         input_folder: Path to the folder containing DICOM files
         output_folder: Path to save segmented images
-        lower_threshold: Lower intensity threshold for segmentation
-        upper_threshold: Upper intensity threshold for segmentation
+        lower_threshold: Lower threshold for segmentation (HU)
+        upper_threshold: Upper threshold for segmentation (HU)
+        window: Display window for the background (see rendering.get_window)
+        crop_to_roi: Threshold only inside the aorta candidate's box (see roi.find_roi); off by
+                     default, since voxels outside the box are dropped
+        method: 'full' or 'coarse_to_fine' (see multiresolution.segment)
+        session: A SegmentationSession of this series for incremental mode: the
+                 series is not read again and only slices whose masks changed
+                 since the last call are re-encoded (window, crop_to_roi and
+                 method are the session's)
         
     Returns:
         List of paths to segmented images
     """
+    if session is not None:
+        return session.segment(output_folder, lower_threshold, upper_threshold)['files']
+
     import os
     import glob
     import numpy as np
@@ -43,31 +59,39 @@ def apply_segmentation(input_folder, output_folder, lower_threshold=100, upper_t
         if dicom_names:
             print(f"Found {len(dicom_names)} DICOM files in series")
             reader.SetFileNames(dicom_names)
-            image = reader.Execute()
-            image_array = sitk.GetArrayFromImage(image)
+            reader.MetaDataDictionaryArrayUpdateOn()
+            with span('segmentation', 'dicom_read'):
+                image = reader.Execute()
+                image_array = sitk.GetArrayFromImage(image)
+            
+            # One window for the whole series so slices are displayed consistently
+            # (SimpleITK has already rescaled the series to HU)
+            params = sitk_render_params(reader, 0)
+            center, width = get_window(window, image_array, dicom_window=params['dicom_window'])
+            if crop_to_roi:
+                roi = find_roi(image_array, image.GetSpacing(), lower_threshold, upper_threshold)
+            else:
+                roi = tuple(slice(0, n) for n in image_array.shape)
+            
+            # Segment the whole region at once on the HU values
+            with span('segmentation', 'threshold'):
+                region_mask = segment_threshold(image_array[roi], lower_threshold, upper_threshold, method=method)
             
             # Process each slice
             for i, slice_data in enumerate(image_array):
-                # Normalize slice for visualization
-                normalized_slice = ((slice_data - slice_data.min()) / 
-                                  (slice_data.max() - slice_data.min()) * 255).astype(np.uint8)
-                
-                # Apply threshold-based segmentation
-                binary_mask = np.logical_and(
-                    normalized_slice > lower_threshold,
-                    normalized_slice < upper_threshold
-                ).astype(np.uint8) * 255
+                # Window slice for visualization
+                with span('segmentation', 'normalize'):
+                    normalized_slice = apply_window(slice_data, center, width, invert=params['invert'])
                 
-                # Create RGB image with red overlay
+                # Create RGB image with red overlay where the slice crosses the segmented region
                 rgb_image = np.stack([normalized_slice, normalized_slice, normalized_slice], axis=2)
-                overlay_mask = binary_mask > 0
-                rgb_image[overlay_mask, 0] = 255  # Red channel
-                rgb_image[overlay_mask, 1] = 0    # Green channel
-                rgb_image[overlay_mask, 2] = 0    # Blue channel
+                if roi[0].start <= i < roi[0].stop:
+                    rgb_image[roi[1:]][region_mask[i - roi[0].start]] = (255, 0, 0)
                 
                 # Save segmented image
                 output_file = os.path.join(output_folder, f"segmented_slice_{i:03d}.png")
-                Image.fromarray(rgb_image).save(output_file)
+                with span('segmentation', 'encode'):
+                    Image.fromarray(rgb_image).save(output_file)
                 segmented_files.append(output_file)
                 
             return segmented_files
@@ -92,7 +116,7 @@ def apply_segmentation(input_folder, output_folder, lower_threshold=100, upper_t
         for i, filepath in enumerate(sorted(file_list)):
             try:
                 output_file = os.path.join(output_folder, f"segmented_{i:03d}.png")
-                segment_dicom_file(filepath, output_file)
+                segment_dicom_file(filepath, output_file, lower_threshold, upper_threshold, window, method)
                 segmented_files.append(output_file)
             except Exception as file_error:
                 print(f"Error processing file {filepath}: {str(file_error)}")
@@ -103,13 +127,18 @@ def apply_segmentation(input_folder, output_folder, lower_threshold=100, upper_t
         print(f"Error processing folder: {str(e)}")
         raise
 
-def segment_dicom_file(filepath, output_path):
+def segment_dicom_file(filepath, output_path, lower_threshold=100, upper_threshold=300, window=None,
+                       method='full'):
     """
     Apply segmentation to a DICOM file to highlight the aortic aneurysm.
     
     Args:
         filepath: Path to the DICOM file
         output_path: Path to save the segmented image
+        lower_threshold: Lower threshold for segmentation (HU)
+        upper_threshold: Upper threshold for segmentation (HU)
+        window: Display window for the background (see rendering.get_window)
+        method: 'full' or 'coarse_to_fine' (see multiresolution.segment)
     
     Returns:
         Path to the segmented image
@@ -130,7 +159,8 @@ def segment_dicom_file(filepath, output_path):
                     
                 # Apply segmentation to the extracted DICOM folder
                 output_dir = os.path.dirname(output_path)
-                segmented_files = apply_segmentation(temp_dir, output_dir)
+                segmented_files = apply_segmentation(temp_dir, output_dir, lower_threshold,
+                                                     upper_threshold, window, method=method)
                 
                 if segmented_files:
                     # Use the first segmented file as the main result
@@ -147,14 +177,17 @@ def segment_dicom_file(filepath, output_path):
         # For single DICOM file
         try:
             # Try to read with SimpleITK first
-            try:
-                dicom_image = sitk.ReadImage(filepath)
-                dicom_array = sitk.GetArrayFromImage(dicom_image)
-            except Exception as sitk_error:
-                # Fallback to pydicom
-                print(f"SimpleITK failed, using pydicom: {str(sitk_error)}")
-                dicom_data = pydicom.dcmread(filepath, force=True)
-                dicom_array = dicom_data.pixel_array
+            with span('segmentation', 'dicom_read'):
+                try:
+                    dicom_image = sitk.ReadImage(filepath)
+                    dicom_array = sitk.GetArrayFromImage(dicom_image)
+                    params = sitk_render_params(dicom_image)
+                except Exception as sitk_error:
+                    # Fallback to pydicom (raw stored values, rescaled by the rendering LUTs)
+                    print(f"SimpleITK failed, using pydicom: {str(sitk_error)}")
+                    dicom_data = pydicom.dcmread(filepath, force=True)
+                    dicom_array = dicom_data.pixel_array
+                    params = dataset_render_params(dicom_data)
             
             # Handle both 3D and 2D data
             if len(dicom_array.shape) > 2:
@@ -163,38 +196,29 @@ def segment_dicom_file(filepath, output_path):
             else:
                 slice_data = dicom_array
             
-            # Normalize data to 0-255 for visualization
-            normalized_data = ((slice_data - slice_data.min()) / 
-                            (slice_data.max() - slice_data.min()) * 255).astype(np.uint8)
-            
-            # Apply segmentation through thresholding
-            # Adjust these thresholds for AAA detection
-            lower_threshold = 100
-            upper_threshold = 300
-            
-            binary_mask = np.logical_and(
-                normalized_data > lower_threshold, 
-                normalized_data < upper_threshold
-            ).astype(np.uint8) * 255
-            
-            # Create RGB image for better visualization
-            rgb_image = np.stack([normalized_data, normalized_data, normalized_data], axis=2)
+            # Window data to 0-255 for visualization
+            with span('segmentation', 'normalize'):
+                normalized_data = render(slice_data, window, **params)
             
-            # Add red overlay for segmented regions
-            overlay_mask = binary_mask > 0
-            rgb_image[overlay_mask, 0] = 255  # Red channel
-            rgb_image[overlay_mask, 1] = 0    # Green channel
-            rgb_image[overlay_mask, 2] = 0    # Blue channel
+            # Apply segmentation through thresholding on the HU values
+            with span('segmentation', 'threshold'):
+                overlay_mask = segment_threshold(slice_data, lower_threshold, upper_threshold,
+                                                 params['slope'], params['intercept'], method)
+                
+                # Create RGB image for better visualization, red overlay for segmented regions
+                rgb_image = np.stack([normalized_data, normalized_data, normalized_data], axis=2)
+                rgb_image[overlay_mask] = (255, 0, 0)
             
             # Save the result
-            Image.fromarray(rgb_image).save(output_path)
+            with span('segmentation', 'encode'):
+                Image.fromarray(rgb_image).save(output_path)
             print(f"Segmentation saved to {output_path}")
             return output_path
             
         except Exception as e:
             # Fallback method for non-DICOM images or if segmentation fails
             try:
-                from PIL import Image, ImageEnhance
+                from PIL import ImageEnhance
                 
                 # Try to open as regular image
                 image = Image.open(filepath).convert('L')  # Convert to grayscale
@@ -240,15 +264,17 @@ def segment_dicom_file(filepath, output_path):
         print(error_message)
         raise Exception(error_message)
     
-def process_dicom_folder_for_segmentation(folder_path, output_folder):
+def process_dicom_folder_for_segmentation(folder_path, output_folder, lower_threshold=100, upper_threshold=300):
     """
     Process a folder of DICOM files for segmentation.
     
     Args:
         folder_path: Path to the folder containing DICOM files
         output_folder: Path to save segmented images
+        lower_threshold: Lower intensity threshold for segmentation
+        upper_threshold: Upper intensity threshold for segmentation
         
     Returns:
         List of paths to the segmented images
     """
-    return apply_segmentation(folder_path, output_folder)
+    return apply_segmentation(folder_path, output_folder, lower_threshold, upper_threshold)
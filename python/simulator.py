@@ -3,6 +3,8 @@ import numpy as np
 import os
 import matplotlib.pyplot as plt
 
+from .bitmask import PackedMask
+
 
 def simulate_aneurysm_growth(image, growth_rate=0.2, iterations=5):
     """
@@ -12,29 +14,25 @@ def simulate_aneurysm_growth(image, growth_rate=0.2, iterations=5):
         growth_rate (float): The rate of growth per iteration.
         iterations (int): Number of growth iterations to simulate.
     Returns:
-        List of SimpleITK.Image: Simulated growth images.
+        List of PackedMask: Simulated growth masks (bit-packed, with the image's geometry).
     """
-    simulated_images = []
-    current_image = sitk.GetArrayFromImage(image)
+    simulated_masks = []
+    current_image = sitk.Cast(image != 0, sitk.sitkUInt8)
 
     for i in range(iterations):
         # Calculate the dilation radius as an integer
         radius = int(np.ceil(growth_rate * (i + 1)))
 
-        # Apply binary dilation
-        dilated_image = sitk.BinaryDilate(
-            sitk.GetImageFromArray(current_image.astype(np.uint8)),
+        # Apply binary dilation (the dilated mask contains the current one)
+        current_image = sitk.BinaryDilate(
+            current_image,
             [radius] * image.GetDimension()  # Specify radius for each dimension
         )
 
-        # Update the binary mask
-        dilated_array = sitk.GetArrayFromImage(dilated_image)
-        current_image = np.maximum(current_image, dilated_array)
-
-        # Store the simulated image
-        simulated_images.append(sitk.GetImageFromArray(current_image))
+        # Store the simulated mask packed, at 1/8 of the memory of a uint8 volume
+        simulated_masks.append(PackedMask.from_image(current_image))
 
-    return simulated_images
+    return simulated_masks
 
 
 
@@ -42,14 +40,14 @@ def save_simulation_results(simulated_images, output_folder):
     """
     Save the simulated images as PNG files.
     Args:
-        simulated_images (list of SimpleITK.Image): The simulated growth images.
+        simulated_images (list of PackedMask): The simulated growth masks.
         output_folder (str): Directory to save the results.
     """
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
     for idx, sim_image in enumerate(simulated_images):
-        sim_array = sitk.GetArrayFromImage(sim_image)
+        sim_array = sim_image.to_array()
         for slice_idx in range(sim_array.shape[0]):
             plt.figure(figsize=(8, 8))
             plt.imshow(sim_array[slice_idx], cmap='gray')
@@ -0,0 +1,240 @@
+# Tiled multi-resolution image pyramids for the DICOM viewer: every slice of a series is rendered once
+# into downsampled levels of small PNG tiles plus a thumbnail.
+#-----------------------------------
+import hashlib
+import json
+import math
+import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pydicom
+from PIL import Image
+
+from .instrumentation import span
+from .rendering import apply_window, dataset_render_params, get_window
+
+TILE_SIZE = 256
+THUMBNAIL_SIZE = 128
+MANIFEST_NAME = 'manifest.json'
+PNG_COMPRESS_LEVEL = 3
+
+
+def read_series_headers(files):
+    """
+    Group DICOM files into series by SeriesInstanceUID, reading headers only.
+
+    Multi-frame objects contribute one slice per frame. Slices are ordered
+    by InstanceNumber, then position along the patient axis.
+
+    Returns:
+        dict: {SeriesInstanceUID: [{'path', 'frame'}, ...]} in display order
+    """
+    series = {}
+    with span('tile_pyramid', 'read_headers'):
+        for path in files:
+            try:
+                ds = pydicom.dcmread(path, stop_before_pixels=True, force=True)
+            except Exception as e:
+                print(f"[ERROR] Could not read DICOM header of {path}: {str(e)}")
+                continue
+            if 'Rows' not in ds or 'Columns' not in ds:
+                continue  # no image (e.g. a DICOMDIR or structured report)
+
+            position = ds.get('ImagePositionPatient')
+            z = float(position[2]) if position and len(position) == 3 else 0.0
+            instance = int(ds.get('InstanceNumber', 0) or 0)
+            frames = int(ds.get('NumberOfFrames', 1) or 1)
+            uid = str(ds.get('SeriesInstanceUID', '') or '')
+            for frame in range(frames):
+                series.setdefault(uid, []).append({'path': path, 'frame': frame if frames > 1 else None,
+                                                   'order': (instance, z, path, frame)})
+
+    for slices in series.values():
+        slices.sort(key=lambda s: s['order'])
+        for s in slices:
+            del s['order']
+    return series
+
+
+def pyramid_id(series_uid, slices, window=None, tile_size=TILE_SIZE):
+    """Stable ID of a series' pyramid, so uploading the same series again reuses the tiles already built."""
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(f"{series_uid}|{len(slices)}|{window!r}|{tile_size}".encode('utf-8'))
+    if not series_uid:
+        for s in slices:
+            digest.update(f"|{os.path.basename(s['path'])}:{os.path.getsize(s['path'])}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def level_sizes(width, height, tile_size=TILE_SIZE):
+    """(width, height) of every level: level 0 is full resolution, each next level is half the size, down to one tile."""
+    sizes = [(width, height)]
+    while max(width, height) > tile_size:
+        width, height = math.ceil(width / 2), math.ceil(height / 2)
+        sizes.append((width, height))
+    return sizes
+
+
+def tile_path(pyramid_dir, slice_index, level, x, y):
+    return os.path.join(pyramid_dir, 'tiles', str(slice_index), str(level), f"{x}_{y}.png")
+
+
+def thumbnail_path(pyramid_dir, slice_index):
+    return os.path.join(pyramid_dir, 'thumbnails', f"{slice_index}.png")
+
+
+def load_manifest(pyramid_dir):
+    """The manifest of a finished pyramid, or None if it has not been built."""
+    try:
+        with open(os.path.join(pyramid_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _read_pixels(ds, frame):
+    pixels = ds.pixel_array
+    return pixels[frame] if frame is not None else pixels
+
+
+def _write_slice(image, pyramid_dir, slice_index, tile_size, thumbnail_size):
+    """Cut one rendered slice into tiles for every level and write its thumbnail."""
+    with span('tile_pyramid', 'encode'):
+        level = 0
+        while True:
+            level_dir = os.path.dirname(tile_path(pyramid_dir, slice_index, level, 0, 0))
+            os.makedirs(level_dir, exist_ok=True)
+            width, height = image.size
+            for y in range(math.ceil(height / tile_size)):
+                for x in range(math.ceil(width / tile_size)):
+                    box = (x * tile_size, y * tile_size,
+                           min((x + 1) * tile_size, width), min((y + 1) * tile_size, height))
+                    image.crop(box).save(os.path.join(level_dir, f"{x}_{y}.png"),
+                                         compress_level=PNG_COMPRESS_LEVEL)
+            if max(width, height) <= tile_size:
+                break
+            # Box-filter halving, matching level_sizes() (odd sizes round up)
+            image = image.resize((math.ceil(width / 2), math.ceil(height / 2)), Image.BOX)
+            level += 1
+
+        thumbnail = image.copy()
+        thumbnail.thumbnail((thumbnail_size, thumbnail_size), Image.BILINEAR)
+        thumbnail.save(thumbnail_path(pyramid_dir, slice_index), compress_level=PNG_COMPRESS_LEVEL)
+
+
+def _render_file(path, entries, center, width, pyramid_dir, tile_size, thumbnail_size):
+    """Render every slice (frame) that comes from one file. entries: [(slice_index, frame)]."""
+    with span('tile_pyramid', 'render'):
+        ds = pydicom.dcmread(path, force=True)
+        params = dataset_render_params(ds)
+        colour = int(ds.get('SamplesPerPixel', 1) or 1) > 1
+    for slice_index, frame in entries:
+        with span('tile_pyramid', 'render'):
+            pixels = _read_pixels(ds, frame)
+            if colour:
+                image = Image.fromarray(pixels.astype(np.uint8, copy=False))
+            else:
+                image = Image.fromarray(apply_window(pixels, center, width, params['slope'],
+                                                     params['intercept'], params['invert']))
+        _write_slice(image, pyramid_dir, slice_index, tile_size, thumbnail_size)
+
+
+def build_pyramid(series_uid, slices, output_root, window=None, tile_size=TILE_SIZE,
+                  thumbnail_size=THUMBNAIL_SIZE, max_workers=4):
+    """
+    Render a series into a tile pyramid, or return the existing one.
+
+    The whole series shares one display window, taken from the middle slice
+    (see rendering.get_window). Files are rendered in parallel into a
+    temporary folder that is renamed into place when complete, so readers
+    never see a half-built pyramid.
+
+    Args:
+        series_uid: SeriesInstanceUID (may be empty)
+        slices: Ordered slices from read_series_headers()
+        output_root: Folder holding one subfolder per pyramid
+        window: Display window specification
+        tile_size: Tile edge in pixels
+        thumbnail_size: Longest edge of the thumbnails
+        max_workers: Files rendered in parallel
+
+    Returns:
+        dict: The pyramid manifest (series_id, slices, width, height, levels, ...)
+    """
+    series_id = pyramid_id(series_uid, slices, window, tile_size)
+    pyramid_dir = os.path.join(output_root, series_id)
+    manifest = load_manifest(pyramid_dir)
+    if manifest is not None:
+        return manifest
+
+    middle = slices[len(slices) // 2]
+    ds = pydicom.dcmread(middle['path'], force=True)
+    pixels = _read_pixels(ds, middle['frame'])
+    params = dataset_render_params(ds)
+    center, width = get_window(window, pixels, params['slope'], params['intercept'], params['dicom_window'])
+    rows, columns = pixels.shape[:2]
+    del ds, pixels
+
+    by_file = {}
+    for index, s in enumerate(slices):
+        by_file.setdefault(s['path'], []).append((index, s['frame']))
+
+    build_dir = f"{pyramid_dir}.building-{uuid.uuid4().hex[:8]}"
+    os.makedirs(os.path.join(build_dir, 'thumbnails'), exist_ok=True)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(_render_file, path, entries, center, width, build_dir, tile_size, thumbnail_size)
+                       for path, entries in by_file.items()]
+            for future in futures:
+                future.result()
+
+        manifest = {
+            'series_id': series_id,
+            'series_instance_uid': series_uid,
+            'slices': len(slices),
+            'width': columns,
+            'height': rows,
+            'tile_size': tile_size,
+            'thumbnail_size': thumbnail_size,
+            'levels': [
+                {'level': level, 'width': w, 'height': h,
+                 'columns': math.ceil(w / tile_size), 'rows': math.ceil(h / tile_size)}
+                for level, (w, h) in enumerate(level_sizes(columns, rows, tile_size))
+            ],
+            'window': {'center': center, 'width': width},
+            'format': 'png'
+        }
+        with open(os.path.join(build_dir, MANIFEST_NAME), 'w') as f:
+            json.dump(manifest, f)
+
+        try:
+            os.rename(build_dir, pyramid_dir)
+        except OSError:
+            # Built concurrently by another request; keep theirs
+            shutil.rmtree(build_dir, ignore_errors=True)
+        print(f"[INFO] Built tile pyramid {series_id}: {len(slices)} slices, {len(manifest['levels'])} levels")
+        return load_manifest(pyramid_dir) or manifest
+    except Exception:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+
+
+def build_series_pyramids(files, output_root, window=None, tile_size=TILE_SIZE, max_workers=4):
+    """
+    Build a pyramid for every series among files.
+
+    Returns:
+        list: One manifest per series (series that fail are reported with an 'error' key)
+    """
+    results = []
+    for series_uid, slices in read_series_headers(files).items():
+        try:
+            results.append(build_pyramid(series_uid, slices, output_root, window, tile_size,
+                                         max_workers=max_workers))
+        except Exception as e:
+            print(f"[ERROR] Tile pyramid for series {series_uid or '(no UID)'} failed: {str(e)}")
+            results.append({'series_instance_uid': series_uid, 'slices': len(slices), 'error': str(e)})
+    return results
@@ -0,0 +1,140 @@
+# Pipelined upload handling: convert each uploaded file while the rest of the request is still arriving.
+#-----------------------------------
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+from werkzeug.utils import secure_filename
+
+from .dicom_processor import process_dicom_file, process_zip_file
+from .instrumentation import span
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def convert_upload(filepath, output_folder):
+    """
+    Convert one uploaded file for the image_conversion service.
+
+    ZIP archives are extracted and every member converted; anything else is
+    treated as a single DICOM file.
+
+    Returns:
+        list: Paths of the converted images
+    """
+    if filepath.lower().endswith('.zip'):
+        return process_zip_file(filepath, output_folder)
+    output_path = os.path.join(output_folder, f"{os.path.basename(filepath)}.jpg")
+    return [process_dicom_file(filepath, output_path)]
+
+
+def unique_filename(filename, used_names):
+    """Return filename, or a numbered variant of it that is not in used_names, and record it there."""
+    candidate = filename
+    number = 1
+    while candidate in used_names:
+        candidate = f"{number}_{filename}"
+        number += 1
+    used_names.add(candidate)
+    return candidate
+
+
+class ConversionPipeline:
+    """
+    Convert files on a bounded thread pool as soon as they are submitted.
+
+    submit() blocks once max_pending files are queued or converting, which
+    stops reading the request body and applies backpressure to the client
+    instead of buffering the whole upload on disk.
+    """
+
+    def __init__(self, output_folder, max_workers=4, max_pending=None):
+        self.output_folder = output_folder
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_pending or max_workers * 2)
+        self._jobs = []
+
+    def _convert(self, filepath):
+        try:
+            with span('upload_pipeline', 'convert'):
+                return convert_upload(filepath, self.output_folder), None
+        except Exception as e:
+            print(f"Error processing {os.path.basename(filepath)}: {str(e)}")
+            return [], str(e)
+        finally:
+            self._slots.release()
+
+    def submit(self, filepath):
+        with span('upload_pipeline', 'backpressure_wait'):
+            self._slots.acquire()
+        self._jobs.append((os.path.basename(filepath), self._executor.submit(self._convert, filepath)))
+
+    def results(self):
+        """
+        Wait for every submitted file.
+
+        Returns:
+            list: One dict per file, in upload order: filename, outputs, error
+        """
+        results = []
+        for filename, future in self._jobs:
+            outputs, error = future.result()
+            results.append({'filename': filename, 'outputs': outputs, 'error': error})
+        return results
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def receive_and_convert(stream, boundary, field_name, upload_dir, output_folder, max_workers=4):
+    """
+    Parse a multipart/form-data body incrementally and convert each file as soon as it is fully received.
+
+    Args:
+        stream: The raw request body (request.stream, before request.files is touched)
+        boundary: Multipart boundary from the Content-Type header
+        field_name: Form field holding the files (e.g. 'dicom_file')
+        upload_dir: Directory the uploaded files are written to
+        output_folder: Directory for converted images (one per request, so concurrent
+                       conversions of same-named files cannot overwrite each other)
+        max_workers: Files converted in parallel
+
+    Returns:
+        list: Per-file results from ConversionPipeline.results()
+    """
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    pipeline = ConversionPipeline(output_folder, max_workers=max_workers)
+    current_file = None
+    current_path = None
+    used_names = set()
+
+    try:
+        finished = False
+        while not finished:
+            chunk = stream.read(READ_CHUNK_SIZE)
+            decoder.receive_data(chunk or None)
+            event = decoder.next_event()
+            while not isinstance(event, NeedData):
+                if isinstance(event, Epilogue):
+                    finished = True
+                    break
+                if isinstance(event, File) and event.name == field_name and event.filename:
+                    # Number repeated names so files from different folders don't overwrite each other
+                    filename = unique_filename(secure_filename(event.filename) or 'upload', used_names)
+                    current_path = os.path.join(upload_dir, filename)
+                    current_file = open(current_path, 'wb')
+                elif isinstance(event, Data) and current_file is not None:
+                    current_file.write(event.data)
+                    if not event.more_data:
+                        current_file.close()
+                        current_file = None
+                        pipeline.submit(current_path)
+                event = decoder.next_event()
+            if not chunk:
+                break
+        return pipeline.results()
+    finally:
+        if current_file is not None:
+            current_file.close()
+        pipeline.close()
@@ -0,0 +1,207 @@
+# Streaming ZIP writer: yields archive bytes as members are read, without a temp file.
+#-----------------------------------
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .instrumentation import span
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# Only members up to this size are deflated ahead on the pool (each is held whole in memory until it
+# is written); larger ones are deflated inline and streamed block by block
+PARALLEL_DEFLATE_MAX_SIZE = 4 * 1024 * 1024
+
+# Members that are already compressed gain nothing from deflate, so they are STORED
+STORED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.zip', '.gz', '.npz', '.mp4')
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+ZIP64_LIMIT = 0xFFFFFFFF
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+
+def _dos_datetime(timestamp):
+    t = time.localtime(max(timestamp, 315532800))  # DOS dates start in 1980
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+def archive_members(paths, base_dir=None):
+    """(path, arcname) pairs, named like create_zip_archive: basename, or path relative to base_dir."""
+    return [(path, os.path.relpath(path, base_dir).replace(os.sep, '/') if base_dir else os.path.basename(path))
+            for path in paths if os.path.isfile(path)]
+
+
+def _deflate_file(path, compresslevel):
+    """Read and deflate a whole small member (runs on the worker pool; zlib releases the GIL)."""
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    crc = 0
+    size = 0
+    parts = []
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            crc = zlib.crc32(block, crc)
+            size += len(block)
+            parts.append(compressor.compress(block))
+    parts.append(compressor.flush())
+    return crc, size, b''.join(parts)
+
+
+class _Entry:
+    __slots__ = ('arcname', 'method', 'dos_time', 'dos_date', 'offset', 'crc', 'compressed_size', 'size', 'zip64')
+
+
+def stream_zip(members, compress_workers=0, compresslevel=6):
+    """
+    Generate a ZIP archive chunk by chunk.
+
+    Every member is written with a data descriptor, so its header goes out
+    before its CRC and sizes are known and each file is read exactly once.
+    PNG/JPEG and other compressed formats are STORED. Everything else is
+    deflated: with compress_workers > 1, members up to PARALLEL_DEFLATE_MAX_SIZE
+    are deflated a few ahead on a thread pool, so at most 2 x workers small
+    members are buffered; larger ones are always deflated inline and streamed
+    block by block. ZIP64 records are added when members or the archive pass
+    4 GB.
+
+    Args:
+        members: (path, arcname) pairs, e.g. from archive_members()
+        compress_workers: Threads for deflating members in parallel (0/1 = inline)
+        compresslevel: zlib level for deflated members
+
+    Yields:
+        bytes: Consecutive chunks of the archive
+    """
+    entries = []
+    offset = 0
+    pool = ThreadPoolExecutor(max_workers=compress_workers) if compress_workers > 1 else None
+    pending = deque()
+    members = list(members)
+
+    def method_for(arcname):
+        return ZIP_STORED if arcname.lower().endswith(STORED_EXTENSIONS) else ZIP_DEFLATED
+
+    def schedule(index):
+        # Keep up to 2x workers deflate jobs in flight ahead of the writer
+        while pool is not None and len(pending) < compress_workers * 2 and index[0] < len(members):
+            path, arcname = members[index[0]]
+            future = None
+            if method_for(arcname) == ZIP_DEFLATED and os.path.getsize(path) <= PARALLEL_DEFLATE_MAX_SIZE:
+                future = pool.submit(_deflate_file, path, compresslevel)
+            pending.append(future)
+            index[0] += 1
+
+    next_to_schedule = [0]
+    try:
+        for path, arcname in members:
+            schedule(next_to_schedule)
+            future = pending.popleft() if pool is not None else None
+
+            entry = _Entry()
+            entry.arcname = arcname.encode('utf-8')
+            entry.method = method_for(arcname)
+            entry.dos_time, entry.dos_date = _dos_datetime(os.path.getmtime(path))
+            entry.offset = offset
+            entry.zip64 = os.path.getsize(path) >= ZIP64_LIMIT
+
+            header = _local_header(entry)
+            offset += len(header)
+            yield header
+
+            crc = 0
+            size = 0
+            compressed_size = 0
+            with span('zip_stream', 'member'):
+                if future is not None:
+                    crc, size, data = future.result()
+                    compressed_size = len(data)
+                    offset += compressed_size
+                    yield data
+                else:
+                    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15) if entry.method == ZIP_DEFLATED else None
+                    with open(path, 'rb') as f:
+                        for block in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+                            crc = zlib.crc32(block, crc)
+                            size += len(block)
+                            out = compressor.compress(block) if compressor else block
+                            if out:
+                                compressed_size += len(out)
+                                yield out
+                    if compressor:
+                        out = compressor.flush()
+                        compressed_size += len(out)
+                        yield out
+                    offset += compressed_size
+
+            entry.crc, entry.size, entry.compressed_size = crc, size, compressed_size
+            descriptor = _data_descriptor(entry)
+            offset += len(descriptor)
+            yield descriptor
+            entries.append(entry)
+
+        yield _central_directory(entries, offset)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _local_header(entry):
+    extra = b''
+    if entry.zip64:
+        # Sizes follow in the ZIP64 data descriptor; the local extra only reserves the fields
+        extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+    return struct.pack(
+        '<IHHHHHIIIHH', 0x04034b50, 45 if entry.zip64 else 20, FLAG_DATA_DESCRIPTOR | FLAG_UTF8,
+        entry.method, entry.dos_time, entry.dos_date, 0,
+        ZIP64_LIMIT if entry.zip64 else 0, ZIP64_LIMIT if entry.zip64 else 0,
+        len(entry.arcname), len(extra)
+    ) + entry.arcname + extra
+
+
+def _data_descriptor(entry):
+    if entry.zip64:
+        return struct.pack('<IIQQ', 0x08074b50, entry.crc, entry.compressed_size, entry.size)
+    return struct.pack('<IIII', 0x08074b50, entry.crc, entry.compressed_size, entry.size)
+
+
+def _central_directory(entries, cd_offset):
+    records = []
+    for entry in entries:
+        zip64_fields = []
+        size, compressed_size, offset = entry.size, entry.compressed_size, entry.offset
+        if size >= ZIP64_LIMIT:
+            zip64_fields.append(size)
+            size = ZIP64_LIMIT
+        if compressed_size >= ZIP64_LIMIT:
+            zip64_fields.append(compressed_size)
+            compressed_size = ZIP64_LIMIT
+        if offset >= ZIP64_LIMIT:
+            zip64_fields.append(offset)
+            offset = ZIP64_LIMIT
+        extra = struct.pack(f'<HH{len(zip64_fields)}Q', 0x0001, 8 * len(zip64_fields), *zip64_fields) if zip64_fields else b''
+        version = 45 if (zip64_fields or entry.zip64) else 20
+        records.append(struct.pack(
+            '<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version,
+            FLAG_DATA_DESCRIPTOR | FLAG_UTF8, entry.method, entry.dos_time, entry.dos_date,
+            entry.crc, compressed_size, size, len(entry.arcname), len(extra), 0, 0, 0,
+            0o100644 << 16, offset
+        ) + entry.arcname + extra)
+
+    central = b''.join(records)
+    cd_size = len(central)
+    count = len(entries)
+    tail = b''
+    if count >= 0xFFFF or cd_size >= ZIP64_LIMIT or cd_offset >= ZIP64_LIMIT:
+        zip64_eocd_offset = cd_offset + cd_size
+        tail += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, (3 << 8) | 45, 45, 0, 0,
+                            count, count, cd_size, cd_offset)
+        tail += struct.pack('<IIQI', 0x07064b50, 0, zip64_eocd_offset, 1)
+    tail += struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                        min(cd_size, ZIP64_LIMIT), min(cd_offset, ZIP64_LIMIT), 0)
+    return central + tail